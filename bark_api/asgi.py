@@ -2,6 +2,14 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bark_api.settings')
+# Set the default settings module to development
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bark_api.settings.settings_dev")
+
+# Override with production settings if DJANGO_PRODUCTION env var is set
+if os.environ.get("DJANGO_PRODUCTION") == "true":
+    os.environ["DJANGO_SETTINGS_MODULE"] = "bark_api.settings.settings_prod"
+
+# Route the hot read endpoints to native async views
+os.environ.setdefault("BARK_ASYNC_VIEWS", "true")
 
 application = get_asgi_application()
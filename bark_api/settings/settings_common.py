@@ -1,6 +1,7 @@
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import tempfile
 
 load_dotenv()
 
@@ -23,6 +24,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bark_core.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     "whitenoise.middleware.WhiteNoiseMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -36,6 +38,12 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'bark_api.urls'
 
+# Serving over ASGI (bark_api.asgi) swaps in async views for the hot endpoints
+BARK_ASYNC_VIEWS = os.getenv('BARK_ASYNC_VIEWS') == "true"
+if BARK_ASYNC_VIEWS:
+    ROOT_URLCONF = 'bark_api.urls_async'
+BARK_ASYNC_TRANSFER_WORKERS = int(os.getenv('BARK_ASYNC_TRANSFER_WORKERS', 8))
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -53,6 +61,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'bark_api.wsgi.application'
+ASGI_APPLICATION = 'bark_api.asgi.application'
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -73,21 +82,58 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Signed bearer tokens carry the user id and expiry and are verified in memory,
+# so authenticated requests skip the Token/User lookup.
+BARK_SIGNED_TOKENS = os.getenv('BARK_SIGNED_TOKENS') == "true"
+BARK_SIGNED_TOKEN_TTL = int(os.getenv('BARK_SIGNED_TOKEN_TTL', 900))  # seconds
+BARK_SIGNED_TOKEN_REVOCATION_REFRESH = 5  # seconds between revocation list refreshes
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
+        *(["bark_core.tokens.SignedTokenAuthentication"] if BARK_SIGNED_TOKENS else []),
         "bark_core.tokens.BearerTokenAuthentication",
     ],
     "DEFAULT_THROTTLE_CLASSES": [
-        "rest_framework.throttling.AnonRateThrottle",
-        "rest_framework.throttling.UserRateThrottle",
+        "bark_core.throttling.SharedAnonRateThrottle",
+        "bark_core.throttling.SharedUserRateThrottle",
     ],
     "DEFAULT_THROTTLE_RATES": {
         "anon": "50/day",
         "user": "10000/day",
     },
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    'DEFAULT_PAGINATION_CLASS': 'bark_core.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
+# Upper bound for the ?page_size= query parameter on list endpoints
+BARK_MAX_PAGE_SIZE = int(os.getenv('BARK_MAX_PAGE_SIZE', 500))
+
+# SQLite file holding rate-throttle counters, shared by all workers on the node
+BARK_THROTTLE_DB = os.getenv('BARK_THROTTLE_DB', os.path.join(tempfile.gettempdir(), 'bark_throttle.sqlite3'))
+
+# Accounts kept in the per-process balance cache (0 disables it)
+BARK_BALANCE_CACHE_SIZE = int(os.getenv('BARK_BALANCE_CACHE_SIZE', 10000))
+
+# Account number -> id entries kept in the per-process lookup cache (0 disables it)
+BARK_ACCOUNT_NUMBER_CACHE_SIZE = int(os.getenv('BARK_ACCOUNT_NUMBER_CACHE_SIZE', 100000))
+
+# Queue every POST /api/transfers/ for bark_poster instead of only "Prefer: respond-async" ones
+BARK_QUEUED_TRANSFERS = os.getenv('BARK_QUEUED_TRANSFERS') == "true"
+
+# Serialize user/account lists and transfer history from values() (see bark_core.fast_serializers)
+BARK_FAST_SERIALIZERS = os.getenv('BARK_FAST_SERIALIZERS', "true") == "true"
+
+# OpenAPI schema written at build time by bark_openapi_schema; generated on first request if unset or missing
+BARK_OPENAPI_SCHEMA_FILE = os.getenv('BARK_OPENAPI_SCHEMA_FILE', '')
+
+# Server-Timing headers and the slow-request log (see bark_core.middleware)
+BARK_REQUEST_TIMING = os.getenv('BARK_REQUEST_TIMING', "true") == "true"
+BARK_REQUEST_TIMING_SAMPLE_RATE = float(os.getenv('BARK_REQUEST_TIMING_SAMPLE_RATE', 1.0))
+BARK_SLOW_REQUEST_MS = int(os.getenv('BARK_SLOW_REQUEST_MS', 500))
+# Send Server-Timing to every client rather than only to staff
+BARK_SERVER_TIMING_PUBLIC = os.getenv('BARK_SERVER_TIMING_PUBLIC', "false") == "true"
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = False
 CORS_ALLOWED_ORIGINS = [
@@ -104,4 +150,45 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
     }
-}
\ No newline at end of file
+}
+
+# SQLite tuned for concurrent writers on a single node (BARK_SQLITE_TUNED=false
+# restores SQLite's defaults). WAL lets readers run alongside the writer;
+# IMMEDIATE transactions take the write lock at BEGIN, so concurrent transfers
+# queue on the busy timeout instead of failing with "database is locked" when
+# a read lock can't be upgraded. synchronous=NORMAL skips the fsync per commit
+# and is still crash-safe in WAL mode, though a power loss can drop the last
+# commits; set BARK_SQLITE_SYNCHRONOUS=FULL where that matters.
+BARK_SQLITE_TUNED = os.getenv('BARK_SQLITE_TUNED', "true") == "true"
+if BARK_SQLITE_TUNED:
+    DATABASES['default'].update({
+        'OPTIONS': {
+            'timeout': int(os.getenv('BARK_SQLITE_BUSY_TIMEOUT', 20)),  # seconds
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                f"PRAGMA synchronous={os.getenv('BARK_SQLITE_SYNCHRONOUS', 'NORMAL')};"
+                f"PRAGMA mmap_size={int(os.getenv('BARK_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))};"
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+        # Keep each worker thread's connection open between requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # The in-memory test database can't be shared by concurrent threads
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'bark_test.sqlite3')},
+    })
+
+# Read replicas for the read-only API actions (see bark_core.db_routers). Locally
+# these are SQLite files that bark_sync_replicas copies the primary into.
+BARK_DB_REPLICAS = []
+for path in filter(None, os.getenv('BARK_SQLITE_REPLICAS', '').split(',')):
+    alias = f'replica{len(BARK_DB_REPLICAS) + 1}'
+    DATABASES[alias] = {**DATABASES['default'], 'NAME': path, 'TEST': {'MIRROR': 'default'}}
+    BARK_DB_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['bark_core.db_routers.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write
+BARK_REPLICA_PIN_SECONDS = int(os.getenv('BARK_REPLICA_PIN_SECONDS', 5))
+# SQLite file holding those pins, shared by all workers on the node
+BARK_REPLICA_PIN_DB = os.getenv('BARK_REPLICA_PIN_DB', os.path.join(tempfile.gettempdir(), 'bark_replica_pins.sqlite3'))
@@ -23,6 +23,13 @@ DATABASES = {
     'default': dj_database_url.config(conn_max_age=600, ssl_require=True)
 }
 
+# Read replicas, as comma-separated database URLs
+BARK_DB_REPLICAS = []
+for url in filter(None, os.getenv('BARK_DB_REPLICA_URLS', '').split(',')):
+    alias = f'replica{len(BARK_DB_REPLICAS) + 1}'
+    DATABASES[alias] = {**dj_database_url.parse(url, conn_max_age=600, ssl_require=True), 'TEST': {'MIRROR': 'default'}}
+    BARK_DB_REPLICAS.append(alias)
+
 CSRF_TRUSTED_ORIGINS = [
     'https://barkbankapi-e88bfd94ccc1.herokuapp.com',
     'https://barkbank-e1493dbfdf9d.herokuapp.com',
@@ -0,0 +1,13 @@
+# bark_api/urls_async.py - entry point when serving over ASGI
+from django.urls import path, include
+
+from bark_core import async_views
+
+# Hot endpoints get native async views; everything else is the regular URLconf
+urlpatterns = [
+    path('api/accounts/', async_views.account_list),
+    path('api/accounts/<int:pk>/balance/', async_views.account_balance),
+    path('api/accounts/<int:pk>/transfers/', async_views.account_transfers),
+    path('api/transfers/', async_views.transfer_list),
+    path('', include('bark_api.urls')),
+]
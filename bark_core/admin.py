@@ -1,14 +1,131 @@
 #bark_core/admin.py
-from django.contrib import admin
-from .models import Account, Transfer
+"""
+Admin for the large Account and Transfer tables.
+
+Changelists select the users behind every account they show, count through
+EstimatedCountPaginator, and search account numbers and usernames by prefix,
+which PostgreSQL serves from the varchar_pattern_ops index it keeps for every
+unique CharField. Transfers are browsed by date through the timestamp index.
+"""
+from datetime import datetime
+
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Max, Min, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import Account, Transfer, TransferQuerySet
+from .db_routers import ReplicaChangeListMixin
+
+ACCOUNT_NUMBER_LENGTH = Account._meta.get_field('account_number').max_length
+# Accounts an account number prefix may match when searching transfers
+ACCOUNT_SEARCH_LIMIT = 1000
+
+
+def estimated_row_count(queryset):
+    """The planner's estimate of the rows in queryset's table, or None if the database keeps none."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)',
+            [connection.ops.quote_name(queryset.model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    # -1 until the table is first vacuumed or analyzed
+    return row[0] if row and row[0] >= 0 else None
+
+
+def account_number_matches(term):
+    """Account numbers equal to term, or starting with it when it's shorter than a number."""
+    if len(term) >= ACCOUNT_NUMBER_LENGTH:
+        return Q(account_number=term)
+    return Q(account_number__startswith=term)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts a whole large table. An unfiltered list takes
+    PostgreSQL's estimate of the table size; anything else is counted up to
+    count_limit rows, so past that the count and the last page are cut short.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset)
+            if estimate is not None and estimate > self.count_limit:
+                return estimate
+        return queryset.order_by()[:self.count_limit].count()
+
+
+class DateHierarchyQuerySet(TransferQuerySet):
+    """
+    The queries behind the date hierarchy, answered from the timestamp index.
+    datetimes() lists every year, month or day between the first and last
+    timestamps rather than selecting the distinct ones from every row in
+    between, and the first and last timestamps are one ordered seek each.
+    """
+
+    def aggregate(self, *args, **kwargs):
+        plain = not args and not self.query.is_sliced and all(
+            type(aggregate) in (Min, Max) and aggregate.filter is None
+            and isinstance(aggregate.get_source_expressions()[0], F)
+            for aggregate in kwargs.values()
+        )
+        if not plain:
+            return super().aggregate(*args, **kwargs)
+        # PostgreSQL plans Min and Max this way itself; SQLite scans every row for the pair
+        result = {}
+        for alias, aggregate in kwargs.items():
+            field_name = aggregate.get_source_expressions()[0].name
+            result[alias] = (
+                self.filter(**{f'{field_name}__isnull': False})
+                .order_by(field_name if type(aggregate) is Min else f'-{field_name}')
+                .values_list(field_name, flat=True).first()
+            )
+        return result
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo)
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds['first'] is None:
+            return []
+        first, last = (timezone.localtime(bounds[bound], tzinfo) for bound in ('first', 'last'))
+        if kind == 'year':
+            periods = [datetime(year, 1, 1) for year in range(first.year, last.year + 1)]
+        elif kind == 'month':
+            periods = [
+                datetime(month // 12, month % 12 + 1, 1)
+                for month in range(first.year * 12 + first.month - 1, last.year * 12 + last.month)
+            ]
+        else:
+            periods = [
+                datetime.fromordinal(day)
+                for day in range(first.date().toordinal(), last.date().toordinal() + 1)
+            ]
+        periods = [timezone.make_aware(period, first.tzinfo) for period in periods]
+        return periods if order == 'ASC' else periods[::-1]
+
 
 @admin.register(Account)
-class AccountAdmin(admin.ModelAdmin):
+class AccountAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ('user', 'get_masked_account_number', 'balance', 'created_at', 'updated_at')
+    list_select_related = ('user',)
     search_fields = ('user__username', 'account_number')
+    search_help_text = "Account number or username, or the start of either."
     list_filter = ('created_at', 'updated_at')
-    ordering = ('-created_at',)
+    # Newest first, served by the primary key
+    ordering = ('-pk',)
     readonly_fields = ('created_at', 'updated_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def get_masked_account_number(self, obj):
         """Display the last 4 digits of the account number for privacy."""
@@ -16,6 +133,13 @@ class AccountAdmin(admin.ModelAdmin):
 
     get_masked_account_number.short_description = 'Account Number'
 
+    def get_search_results(self, request, queryset, search_term):
+        """Match account numbers or usernames by prefix, through their indexes."""
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(account_number_matches(term) | Q(user__username__startswith=term)), False
+
     def has_change_permission(self, request, obj=None):
         """Prevent any changes to the account data."""
         return False
@@ -26,12 +150,42 @@ class AccountAdmin(admin.ModelAdmin):
 
 
 @admin.register(Transfer)
-class TransferAdmin(admin.ModelAdmin):
+class TransferAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ('from_account', 'to_account', 'amount', 'timestamp')
+    # Account.__str__ shows the owner's username
+    list_select_related = ('from_account__user', 'to_account__user')
     search_fields = ('from_account__account_number', 'to_account__account_number')
+    search_help_text = "Account number, or the start of one, of either side."
     list_filter = ('timestamp',)
+    date_hierarchy = 'timestamp'
     ordering = ('-timestamp',)
     readonly_fields = ('timestamp',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return DateHierarchyQuerySet(self.model, query=queryset.query, using=queryset._db)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Look the accounts up by number or number prefix first, then find
+        their transfers through the two direction indexes.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        accounts = Account.objects.using(queryset.db).filter(account_number_matches(term))
+        account_ids = list(accounts.order_by('account_number').values_list('pk', flat=True)[:ACCOUNT_SEARCH_LIMIT + 1])
+        if len(account_ids) > ACCOUNT_SEARCH_LIMIT:
+            account_ids = account_ids[:ACCOUNT_SEARCH_LIMIT]
+            self.message_user(
+                request,
+                f"More than {ACCOUNT_SEARCH_LIMIT} accounts start with {term}; showing transfers of the first "
+                f"{ACCOUNT_SEARCH_LIMIT}. Enter more digits to narrow the search.",
+                messages.WARNING,
+            )
+        return queryset.filter(Q(from_account_id__in=account_ids) | Q(to_account_id__in=account_ids)), False
 
     def has_change_permission(self, request, obj=None):
         """Prevent changes to transfer records."""
@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 class BarkCoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'bark_core'
\ No newline at end of file
+    name = 'bark_core'
+
+    def ready(self):
+        from .middleware import install_query_recorder
+        connection_created.connect(install_query_recorder, dispatch_uid='bark_core.install_query_recorder')
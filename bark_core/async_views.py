@@ -0,0 +1,224 @@
+# bark_core/async_views.py
+"""
+Native async views for the hot read endpoints, used when serving over ASGI.
+
+Account list, balance and transfer history authenticate, throttle, query and
+serialize on the event loop using Django's async ORM, and return the same
+JSON as the DRF viewsets. Transfers are handed to the regular DRF view on a
+bounded thread pool, so a burst of writes can't tie up more than
+BARK_ASYNC_TRANSFER_WORKERS database connections. Anything else (other
+methods, ?as_of= queries) falls back to the sync viewsets. The async reads
+are routed to replicas on the same terms as the viewsets' replica_actions.
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .cache import balance_cache, CachedBalance
+from .conditional import make_etag, account_etag, changed_at, last_modified, not_modified, set_validators
+from .db_routers import current_routing, reading_from_primary, request_routing, route_reads
+from .models import Account, Transfer
+from . import fast_serializers
+from .pagination import KeysetPagination
+from .serializers import AccountSerializer, BalanceSerializer, TransferHistorySerializer
+from .tokens import SignedTokenAuthentication, revocation_list
+from .views import AccountViewSet, TransferViewSet, history_filters
+
+transfer_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BARK_ASYNC_TRANSFER_WORKERS', 8),
+    thread_name_prefix='bark-transfer',
+)
+
+account_list_view = AccountViewSet.as_view({'get': 'list', 'post': 'create'})
+account_balance_view = AccountViewSet.as_view({'get': 'balance'})
+account_transfers_view = AccountViewSet.as_view({'get': 'transfers'})
+transfer_list_view = TransferViewSet.as_view({'get': 'list', 'post': 'create'})
+
+
+def pooled_transfer(request):
+    """
+    Run the transfer view on a pool thread. The pool's threads outlive
+    requests, so their connections get the request_started/request_finished
+    treatment here instead: dropped if unusable or past CONN_MAX_AGE.
+    """
+    close_old_connections()
+    try:
+        return transfer_list_view(request)
+    finally:
+        close_old_connections()
+
+
+def json_response(data, status=200, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json', headers=headers)
+
+
+def error_response(exc):
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        headers['WWW-Authenticate'] = 'Bearer realm="api"'
+    if isinstance(exc, exceptions.Throttled) and exc.wait is not None:
+        headers['Retry-After'] = str(exc.wait)
+    return json_response({'detail': exc.detail}, status=exc.status_code, headers=headers)
+
+
+async def aauthenticate(request):
+    """Async counterpart of the configured Bearer token authentication."""
+    auth = get_authorization_header(request).split()
+    if not auth or auth[0].lower() != b'bearer':
+        raise exceptions.NotAuthenticated()
+    if len(auth) != 2:
+        raise exceptions.AuthenticationFailed('Invalid token header.')
+    try:
+        key = auth[1].decode()
+    except UnicodeError:
+        raise exceptions.AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+    if settings.BARK_SIGNED_TOKENS and ':' in key:
+        if revocation_list.needs_refresh():
+            await sync_to_async(revocation_list.refresh)()
+        return SignedTokenAuthentication().authenticate_signed(key)[0]
+
+    try:
+        token = await Token.objects.select_related('user').aget(key=key)
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    return token.user
+
+
+def check_throttles(request):
+    """Run the configured throttles; the shared store is a local SQLite file."""
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            raise exceptions.Throttled(throttle.wait())
+
+
+async def prepare(request):
+    """Authenticate and throttle a request, returning a DRF Request wrapper."""
+    request.user = await aauthenticate(request)
+    # The store's SQLite writes block; it keeps a connection per thread, so any thread will do
+    await sync_to_async(check_throttles, thread_sensitive=False)(request)
+    routing = current_routing.get()
+    if routing is not None:
+        route_reads(routing, request.user, read_only=True)
+    return Request(request)
+
+
+def replica_reads(view):
+    """Let a read-only async view read from a replica once prepare() has authenticated."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        with request_routing():
+            return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def paginate(queryset, request, serializer_class, fast):
+    """A page of queryset, serialized by fast (a FastSerializer) when BARK_FAST_SERIALIZERS is on."""
+    paginator = KeysetPagination()
+    use_fast = fast_serializers.enabled()
+    if use_fast:
+        queryset = fast.values(queryset)
+    page_queryset = paginator.get_page_queryset(queryset, request)
+    page = paginator.set_page([obj async for obj in page_queryset])
+    data = fast.represent(page) if use_fast else serializer_class(page, many=True).data
+    return paginator.get_paginated_response(data).data
+
+
+async def sync_fallback(view, request, **kwargs):
+    return await sync_to_async(view)(request, **kwargs)
+
+
+# Like DRF views these are token-authenticated, so CSRF doesn't apply
+
+
+@csrf_exempt
+@replica_reads
+async def account_list(request):
+    if request.method != 'GET':
+        return await sync_fallback(account_list_view, request)
+    try:
+        drf_request = await prepare(request)
+        queryset = Account.objects.select_related('user').with_striped_balance().order_by('-created_at', '-id')
+        if not request.user.is_staff:
+            queryset = queryset.filter(user_id=request.user.pk)
+        return json_response(await paginate(queryset, drf_request, AccountSerializer, fast_serializers.accounts))
+    except exceptions.APIException as exc:
+        return error_response(exc)
+
+
+@csrf_exempt
+@replica_reads
+async def account_balance(request, pk):
+    if request.method != 'GET' or 'as_of' in request.GET:
+        return await sync_fallback(account_balance_view, request, pk=pk)
+    try:
+        await prepare(request)
+        current = balance_cache.get(pk)
+        if (not current or (not request.user.is_staff and current.user_id != request.user.pk)
+                or not await Account.objects.abalance_unchanged(pk, current.ledger_sequence, current.user_id)):
+            token = balance_cache.token()
+            account = await (
+                Account.objects.filter(pk=pk).with_striped_balance().with_last_transfer()
+                .only('user_id', 'balance', 'ledger_sequence', 'stripe_count', 'updated_at').afirst()
+            )
+            if account is None or (not request.user.is_staff and account.user_id != request.user.pk):
+                raise exceptions.NotFound('No Account matches the given query.')
+            current = CachedBalance(account.user_id, account.current_balance, changed_at(account), account.ledger_sequence)
+            if reading_from_primary() and not account.stripe_count:
+                balance_cache.set(pk, current, token)
+
+        etag = make_etag(request, current.balance)
+        modified = last_modified(current.changed_at)
+        response = not_modified(request, etag, modified)
+        if response is not None:
+            return response
+        return set_validators(json_response(BalanceSerializer({'balance': current.balance}).data), etag, modified)
+    except exceptions.APIException as exc:
+        return error_response(exc)
+
+
+@csrf_exempt
+@replica_reads
+async def account_transfers(request, pk):
+    if request.method != 'GET':
+        return await sync_fallback(account_transfers_view, request, pk=pk)
+    try:
+        drf_request = await prepare(request)
+        accounts = Account.objects.filter(pk=pk).with_striped_balance().with_last_transfer()
+        if not request.user.is_staff:
+            accounts = accounts.filter(user_id=request.user.pk)
+        account = await accounts.only('ledger_sequence', 'updated_at').afirst()
+        if account is None:
+            raise exceptions.NotFound('No Account matches the given query.')
+        filters, counterparty_id = history_filters(request.GET)
+        etag = account_etag(request, account)
+        modified = last_modified(changed_at(account))
+        response = not_modified(request, etag, modified)
+        if response is not None:
+            return response
+        queryset = Transfer.objects.history(pk, counterparty_id).filter(**filters)
+        return set_validators(json_response(await paginate(queryset, drf_request, TransferHistorySerializer, fast_serializers.transfer_history)), etag, modified)
+    except exceptions.APIException as exc:
+        return error_response(exc)
+
+
+@csrf_exempt
+async def transfer_list(request):
+    if request.method != 'POST':
+        return await sync_fallback(transfer_list_view, request)
+    # The whole DRF create path (auth, validation, engine) runs on the bounded pool
+    return await sync_to_async(pooled_transfer, thread_sensitive=False, executor=transfer_executor)(request)
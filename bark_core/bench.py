@@ -0,0 +1,758 @@
+# bark_core/bench.py
+"""
+Benchmark scenarios for ``manage.py bark_bench``.
+
+Every scenario runs against a throwaway test database (file backed for SQLite
+so worker threads really contend for it) and returns a JSON-serializable dict.
+"""
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction, OperationalError
+from django.db.models import F, Sum
+from django.core.cache import cache
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.throttling import SimpleRateThrottle, UserRateThrottle
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import fast_serializers
+from .admin import TransferAdmin
+from .docs import generate_schema
+from .engine import execute_transfer, is_retryable, post_queued_transfers, set_stripe_count
+from .models import Account, Transfer, LedgerEntry, BalanceCheckpoint, BalanceStripe, MonthlyStatement, StatementStripe, QueuedTransfer
+from .reconcile import reconcile, transfer_total
+from .serializers import UserSerializer, AccountSerializer, TransferHistorySerializer
+from .throttling import SharedUserRateThrottle
+from .urls import router
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register a benchmark scenario under the given name."""
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def bench_database():
+    """Create a disposable database for the duration of a benchmark run."""
+    # Keep benchmark traffic out of the node's real throttle counters
+    throttle_dir = tempfile.TemporaryDirectory(prefix='bark_bench_')
+    settings.BARK_THROTTLE_DB = os.path.join(throttle_dir.name, 'throttle.sqlite3')
+    # Throttles still run, but benchmark clients must never be throttled
+    throttle_rates = SimpleRateThrottle.THROTTLE_RATES.copy()
+    SimpleRateThrottle.THROTTLE_RATES.update({scope: '1000000000/day' for scope in throttle_rates})
+    if connection.vendor == 'sqlite':
+        fd, path = tempfile.mkstemp(prefix='bark_bench_', suffix='.sqlite3')
+        os.close(fd)
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = path
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        throttle_dir.cleanup()
+        SimpleRateThrottle.THROTTLE_RATES.update(throttle_rates)
+
+
+def api_client(user):
+    """An in-process API client authenticated as user."""
+    client = APIClient()
+    token, _ = Token.objects.get_or_create(user=user)
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token.key}')
+    return client
+
+
+def run_concurrently(work, threads, iterations):
+    """
+    Call work(thread_index, iteration) `iterations` times in each of `threads`
+    threads. Returns (elapsed seconds, completed calls, failed calls).
+    """
+    completed = [0] * threads
+    failed = [0] * threads
+    start_barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        start_barrier.wait()
+        try:
+            for i in range(iterations):
+                try:
+                    work(index, i)
+                    completed[index] += 1
+                except Exception:
+                    failed[index] += 1
+        finally:
+            connection.close()
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - started, sum(completed), sum(failed)
+
+
+def create_accounts(count, balance, prefix='bench'):
+    """Bulk create `count` accounts owned by a single benchmark user."""
+    user, _ = User.objects.get_or_create(username=f'{prefix}-user')
+    Account.objects.bulk_create(
+        Account(user=user, account_number=f'{prefix[:4]}{i:012d}', balance=balance, opening_balance=balance)
+        for i in range(count)
+    )
+    return list(Account.objects.filter(user=user).order_by('pk'))
+
+
+def reset_ledger(balance):
+    """Drop all transfers and journal rows and reset every account to balance."""
+    LedgerEntry.objects.all().delete()
+    BalanceCheckpoint.objects.all().delete()
+    MonthlyStatement.objects.all().delete()
+    StatementStripe.objects.all().delete()
+    QueuedTransfer.objects.all().delete()
+    Transfer.objects.all().delete()
+    BalanceStripe.objects.update(balance=0)
+    Account.objects.update(balance=balance, opening_balance=balance, ledger_sequence=0)
+
+
+def legacy_transfer(from_account_id, to_account_id, amount):
+    """The old read-modify-write transfer path, kept for comparison."""
+    with transaction.atomic():
+        from_account = Account.objects.get(pk=from_account_id)
+        to_account = Account.objects.get(pk=to_account_id)
+        if from_account.balance < amount:
+            raise ValueError("Insufficient funds")
+        from_account.balance -= amount
+        from_account.save(update_fields=['balance', 'updated_at'])
+        to_account.balance += amount
+        to_account.save(update_fields=['balance', 'updated_at'])
+        Transfer.objects.create(from_account=from_account, to_account=to_account, amount=amount)
+
+
+@scenario('transfers')
+def bench_transfers(options):
+    """Transfers/sec out of one hot account, before and after the engine."""
+    threads, iterations = options['threads'], options['iterations']
+    amount = Decimal('1.00')
+    opening = Decimal('1000000.0000')
+    accounts = create_accounts(threads + 1, opening)
+    hot, receivers = accounts[0], accounts[1:]
+
+    modes = {
+        'legacy': lambda index, i: legacy_transfer(hot.pk, receivers[index].pk, amount),
+        'engine': lambda index, i: execute_transfer(hot, receivers[index], amount),
+    }
+    results = {}
+    for name, work in modes.items():
+        reset_ledger(opening)
+        elapsed, completed, failed = run_concurrently(work, threads, iterations)
+        hot.refresh_from_db()
+        debited = opening - hot.balance
+        credited = sum(Account.objects.filter(pk__in=[r.pk for r in receivers])
+                       .values_list('balance', flat=True)) - opening * len(receivers)
+        expected = amount * completed
+        results[name] = {
+            'transfers': completed,
+            'errors': failed,
+            'seconds': round(elapsed, 3),
+            'transfers_per_sec': round(completed / elapsed, 1) if elapsed else None,
+            # Non-zero drift means concurrent writes clobbered each other
+            'debit_drift': str(expected - debited),
+            'credit_drift': str(expected - credited),
+        }
+    return {'scenario': 'transfers', 'threads': threads, 'iterations': iterations, 'results': results}
+
+
+@scenario('batch')
+def bench_batch(options):
+    """N single POST /api/transfers/ calls against one POST /api/transfers/batch/."""
+    size = options['batch_size']
+    accounts = create_accounts(100, Decimal('1000000.0000'))
+    client = api_client(User.objects.get(username='bench-user'))
+    items = [
+        {
+            'from_account_number': accounts[i % 100].account_number,
+            'to_account_number': accounts[(i * 7 + 1) % 100].account_number,
+            'amount': '1.00',
+        }
+        for i in range(size)
+    ]
+
+    started = time.perf_counter()
+    for item in items:
+        client.post('/api/transfers/', item, format='json')
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    response = client.post('/api/transfers/batch/', {'transfers': items}, format='json')
+    batch = time.perf_counter() - started
+
+    return {
+        'scenario': 'batch',
+        'transfers': len(items),
+        'batch_status': response.status_code,
+        'single': {'seconds': round(single, 3), 'transfers_per_sec': round(len(items) / single, 1)},
+        'batch': {'seconds': round(batch, 3), 'transfers_per_sec': round(len(items) / batch, 1)},
+        'speedup': round(single / batch, 1),
+    }
+
+
+@scenario('queue')
+def bench_queue(options):
+    """Sustained transfers/sec between a few hot accounts: synchronous POSTs against queued ones."""
+    threads, iterations = options['threads'], options['iterations']
+    opening = Decimal('1000000.0000')
+    accounts = create_accounts(4, opening)
+    user = User.objects.get(username='bench-user')
+    clients = [api_client(user) for _ in range(threads)]
+
+    def post(index, i, **headers):
+        body = {
+            'from_account_number': accounts[(index + i) % 4].account_number,
+            'to_account_number': accounts[(index + i + 1) % 4].account_number,
+            'amount': '1.00',
+        }
+        response = clients[index].post('/api/transfers/', body, format='json', **headers)
+        if response.status_code not in (201, 202):
+            raise RuntimeError(response.status_code)
+
+    results = {}
+    reset_ledger(opening)
+    elapsed, completed, failed = run_concurrently(post, threads, iterations)
+    results['sync'] = {
+        'transfers': completed,
+        'errors': failed,
+        'seconds': round(elapsed, 3),
+        'transfers_per_sec': round(completed / elapsed, 1) if elapsed else None,
+    }
+
+    reset_ledger(opening)
+    producing = threading.Event()
+    producing.set()
+    max_lag = [0.0]
+
+    def poster():
+        try:
+            while True:
+                try:
+                    batch = post_queued_transfers(options['batch_size'])
+                except OperationalError as e:
+                    if not is_retryable(e):
+                        raise
+                    continue
+                if batch:
+                    lag = (timezone.now() - batch[0].created_at).total_seconds()
+                    max_lag[0] = max(max_lag[0], lag)
+                elif not producing.is_set():
+                    return
+                else:
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    poster_thread = threading.Thread(target=poster)
+    poster_thread.start()
+    started = time.perf_counter()
+    accept_elapsed, completed, failed = run_concurrently(
+        lambda index, i: post(index, i, HTTP_PREFER='respond-async'), threads, iterations
+    )
+    producing.clear()
+    poster_thread.join()
+    elapsed = time.perf_counter() - started
+    posted = QueuedTransfer.objects.filter(status=QueuedTransfer.POSTED).count()
+    results['queued'] = {
+        'transfers': posted,
+        'errors': failed,
+        'rejected': QueuedTransfer.objects.filter(status=QueuedTransfer.REJECTED).count(),
+        'seconds': round(elapsed, 3),
+        # Until the last queued transfer is posted
+        'transfers_per_sec': round(posted / elapsed, 1) if elapsed else None,
+        'accepted_per_sec': round(completed / accept_elapsed, 1) if accept_elapsed else None,
+        'max_posting_lag_seconds': round(max_lag[0], 3),
+    }
+    return {'scenario': 'queue', 'threads': threads, 'iterations': iterations, 'results': results}
+
+
+@scenario('stripes')
+def bench_stripes(options):
+    """Deposits/sec into one hot account from many senders, by number of credit stripes."""
+    threads, iterations = options['threads'], options['iterations']
+    amount = Decimal('1.00')
+    opening = Decimal('1000000.0000')
+    accounts = create_accounts(threads + 1, opening)
+    hot, senders = accounts[0], accounts[1:]
+
+    results = {}
+    for count in [int(value) for value in options['stripes'].split(',')]:
+        set_stripe_count(hot, count)
+        hot.refresh_from_db()
+        reset_ledger(opening)
+        elapsed, completed, failed = run_concurrently(
+            lambda index, i: execute_transfer(senders[index], hot, amount), threads, iterations
+        )
+        balance = Account.objects.with_striped_balance().get(pk=hot.pk).current_balance
+        received = sum(
+            model.objects.filter(account=hot).aggregate(total=Sum('received_total'))['total'] or 0
+            for model in (MonthlyStatement, StatementStripe)
+        )
+        results[str(count)] = {
+            'transfers': completed,
+            'errors': failed,
+            'seconds': round(elapsed, 3),
+            'transfers_per_sec': round(completed / elapsed, 1) if elapsed else None,
+            # Non-zero drift means a striped credit was lost
+            'credit_drift': str(amount * completed - (balance - opening)),
+            # Likewise for a striped statement increment
+            'statement_drift': str(amount * completed - received),
+        }
+    return {'scenario': 'stripes', 'threads': threads, 'iterations': iterations, 'results': results}
+
+
+@scenario('throttle')
+def bench_throttle(options):
+    """Per-request throttle overhead: DRF's cached history against the shared store."""
+    iterations = options['iterations']
+    request = RequestFactory().get('/api/accounts/')
+    request.user = User.objects.create_user('bench-throttle')
+    results = {}
+    for name, throttle_class in (('drf_cache', UserRateThrottle), ('shared_store', SharedUserRateThrottle)):
+        cache.clear()
+        # A limit high enough that every request is allowed and recorded
+        throttle_class.rate = f'{iterations * 10}/day'
+        timings = []
+        for _ in range(iterations):
+            throttle = throttle_class()
+            started = time.perf_counter()
+            throttle.allow_request(request, None)
+            timings.append(time.perf_counter() - started)
+        del throttle_class.rate
+        results[name] = {
+            'first_100_us': round(sum(timings[:100]) / len(timings[:100]) * 1e6, 1),
+            'last_100_us': round(sum(timings[-100:]) / len(timings[-100:]) * 1e6, 1),
+            'mean_us': round(sum(timings) / len(timings) * 1e6, 1),
+        }
+    return {'scenario': 'throttle', 'requests': iterations, 'results': results}
+
+
+def seed_dataset(users, accounts, transfers, batch_size=5000):
+    """
+    Bulk insert a synthetic dataset: users, accounts spread round-robin over
+    them, and random transfers between accounts spread over the past year.
+    Returns the ids of the first user and first account.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, users, batch_size):
+            User.objects.bulk_create(
+                User(username=f'seed-{i}', password='!') for i in range(start, min(start + batch_size, users))
+            )
+        first_user = User.objects.filter(username='seed-0').values_list('pk', flat=True).get()
+
+        for start in range(0, accounts, batch_size):
+            Account.objects.bulk_create(
+                Account(
+                    user_id=first_user + i % users,
+                    account_number=f'{i:016d}',
+                    balance=Decimal('1000000.0000'),
+                    opening_balance=Decimal('1000000.0000'),
+                )
+                for i in range(start, min(start + batch_size, accounts))
+            )
+        first_account = Account.objects.filter(account_number=f'{0:016d}').values_list('pk', flat=True).get()
+
+        rng = random.Random(0)
+        seconds = 365 * 24 * 3600
+        for start in range(0, transfers, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, transfers)):
+                from_offset = rng.randrange(accounts)
+                to_offset = (from_offset + 1 + rng.randrange(accounts - 1)) % accounts
+                batch.append(Transfer(
+                    from_account_id=first_account + from_offset,
+                    to_account_id=first_account + to_offset,
+                    amount=Decimal('1.00'),
+                    timestamp=now - timedelta(seconds=seconds * (transfers - i) / transfers),
+                ))
+            Transfer.objects.bulk_create(batch)
+    return first_user, first_account
+
+
+def time_serialization(fetch, serialize, repeats):
+    """Best-of-repeats seconds to fetch rows and to serialize and render them; returns (fetch, serialize, body)."""
+    renderer = JSONRenderer()
+    fetch_times, serialize_times = [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = fetch()
+        fetched = time.perf_counter()
+        body = renderer.render(serialize(rows))
+        fetch_times.append(fetched - started)
+        serialize_times.append(time.perf_counter() - fetched)
+    return min(fetch_times), min(serialize_times), body
+
+
+@scenario('serializers')
+def bench_serializers(options):
+    """Per-row cost of DRF serializers against the fast path for large list and history responses."""
+    rows, repeats = options['rows'], 5
+    first_user, first_account = seed_dataset(rows, rows, 0)
+    now = timezone.now()
+    Transfer.objects.bulk_create(
+        Transfer(
+            from_account_id=first_account, to_account_id=first_account + 1 + i % (rows - 1),
+            amount=Decimal('1.2345'), timestamp=now - timedelta(seconds=i),
+        )
+        for i in range(rows)
+    )
+
+    cases = {
+        'users': (User.objects.order_by('-id'), UserSerializer, fast_serializers.users),
+        'accounts': (
+            Account.objects.select_related('user').with_striped_balance().order_by('-created_at', '-id'),
+            AccountSerializer, fast_serializers.accounts,
+        ),
+        'transfer_history': (Transfer.objects.history(first_account), TransferHistorySerializer, fast_serializers.transfer_history),
+    }
+    to_us = lambda seconds: round(seconds / rows * 1e6, 2)
+    results = {}
+    for name, (queryset, serializer_class, fast) in cases.items():
+        drf_fetch, drf_serialize, drf_body = time_serialization(
+            lambda: list(queryset[:rows]), lambda page: serializer_class(page, many=True).data, repeats,
+        )
+        fast_fetch, fast_serialize, fast_body = time_serialization(
+            lambda: list(fast.values(queryset)[:rows]), fast.represent, repeats,
+        )
+        results[name] = {
+            'drf': {'fetch_us_per_row': to_us(drf_fetch), 'serialize_us_per_row': to_us(drf_serialize)},
+            'fast': {'fetch_us_per_row': to_us(fast_fetch), 'serialize_us_per_row': to_us(fast_serialize)},
+            'speedup': round((drf_fetch + drf_serialize) / (fast_fetch + fast_serialize), 2),
+            'identical_output': drf_body == fast_body,
+        }
+    return {'scenario': 'serializers', 'rows': rows, 'results': results}
+
+
+@scenario('reconcile')
+def bench_reconcile(options):
+    """Full reconciliation with one and with --threads worker processes, then an incremental run after new transfers."""
+    workers, accounts = options['threads'], options['accounts']
+    seed_dataset(options['users'], accounts, options['transfers'])
+    # Seeded transfers don't move balances; settle them so nothing has drifted
+    Account.objects.update(
+        balance=F('opening_balance') + transfer_total('to_account') - transfer_total('from_account'),
+    )
+    chunk_size = max(1, accounts // (workers * 4))
+
+    def timed(**kwargs):
+        started = time.perf_counter()
+        report = reconcile(chunk_size=chunk_size, **kwargs)
+        elapsed = time.perf_counter() - started
+        return {
+            'accounts_checked': report['accounts_checked'],
+            'drifted': report['drifted_count'],
+            'money_conserved': report['money_conserved'],
+            'seconds': round(elapsed, 3),
+            'accounts_per_sec': round(report['accounts_checked'] / elapsed, 1),
+        }
+
+    results = {'full_1_worker': timed(full=True, workers=1), f'full_{workers}_workers': timed(full=True, workers=workers)}
+    # 100 transfers between 100 random accounts, each to the next
+    touched = list(Account.objects.order_by('?')[:100])
+    for i, sender in enumerate(touched):
+        execute_transfer(sender, touched[(i + 1) % len(touched)], Decimal('1.00'))
+    # The seeded accounts were all created moments ago, so look back no further than the last run
+    results['incremental'] = timed(workers=workers, overlap=timedelta(0))
+    return {
+        'scenario': 'reconcile',
+        'accounts': accounts,
+        'transfers': options['transfers'],
+        'chunk_size': chunk_size,
+        'results': results,
+    }
+
+
+# Run in a fresh interpreter: what a worker imports before it can serve a request
+STARTUP_PROBE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+from bark_api.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({
+    'ready_ms': (time.perf_counter() - started) * 1000,
+    'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules),
+    'docs_stack_loaded': 'drf_yasg.views' in sys.modules or 'django.test' in sys.modules,
+}))
+'''
+
+
+@scenario('startup')
+def bench_startup(options):
+    """Worker cold start (settings, apps and URLconf) and the cost of serving the API schema."""
+    runs = [
+        json.loads(subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE], cwd=settings.BASE_DIR.parent,
+            capture_output=True, text=True, check=True,
+        ).stdout)
+        for _ in range(5)
+    ]
+    startup = {key: round(statistics.median(run[key] for run in runs), 1) for key in ('ready_ms', 'maxrss_mb', 'modules')}
+    startup['docs_stack_loaded'] = any(run['docs_stack_loaded'] for run in runs)
+
+    # What every docs page load used to cost, against the cached response
+    started = time.perf_counter()
+    body = generate_schema()
+    generate_ms = (time.perf_counter() - started) * 1000
+    client = Client()
+    first = client.get('/?format=openapi', HTTP_ACCEPT_ENCODING='gzip')
+    timings = []
+    for _ in range(100):
+        started = time.perf_counter()
+        client.get('/?format=openapi', HTTP_ACCEPT_ENCODING='gzip')
+        timings.append(time.perf_counter() - started)
+    return {
+        'scenario': 'startup',
+        'startup': startup,
+        'schema': {
+            'generate_ms': round(generate_ms, 1),
+            'cached_request_ms': round(statistics.median(timings) * 1000, 3),
+            'bytes': len(body),
+            'gzip_bytes': len(first.content),
+        },
+    }
+
+
+@scenario('admin')
+def bench_admin(options):
+    """Median time and query count of admin changelist pages over the seeded dataset."""
+    first_user, first_account = seed_dataset(options['users'], options['accounts'], options['transfers'])
+    admin_user = User.objects.create_superuser('bench-admin', password='!')
+    client = Client()
+    client.force_login(admin_user)
+    number = Account.objects.values_list('account_number', flat=True).get(pk=first_account)
+    year = timezone.localtime(Transfer.objects.latest('timestamp').timestamp).year
+    # Page 50, or the last page of a smaller seed; past the last page the admin redirects
+    deep_page = min(50, max(1, -(-Transfer.objects.count() // TransferAdmin.list_per_page)))
+    pages = {
+        'transfers': '/admin/bark_core/transfer/',
+        f'transfers_page_{deep_page}': f'/admin/bark_core/transfer/?p={deep_page}',
+        'transfers_year': f'/admin/bark_core/transfer/?timestamp__year={year}',
+        'transfers_account': f'/admin/bark_core/transfer/?q={number}',
+        'transfers_account_prefix': f'/admin/bark_core/transfer/?q={number[:-2]}',
+        'accounts': '/admin/bark_core/account/',
+        'accounts_number_prefix': f'/admin/bark_core/account/?q={number[:-2]}',
+        'accounts_username': '/admin/bark_core/account/?q=seed-1',
+    }
+    results = {}
+    for name, url in pages.items():
+        timings = []
+        for _ in range(5):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - started)
+            assert response.status_code == 200, (url, response.status_code)
+        results[name] = {'ms': round(statistics.median(timings) * 1000, 1), 'queries': len(queries)}
+    return {
+        'scenario': 'admin',
+        'accounts': options['accounts'],
+        'transfers': options['transfers'],
+        'results': results,
+    }
+
+
+class EndpointClient:
+    """
+    One simulated API client: a seeded user with its own token, one of its
+    accounts, a counterparty account, and a transfer and a queued transfer
+    it can see.
+    """
+
+    def __init__(self, user_id, account, counterparty, transfer_id, queued_id):
+        self.user_id = user_id
+        self.account = account
+        self.counterparty = counterparty
+        self.transfer_id = transfer_id
+        self.queued_id = queued_id
+        self.client = api_client(User.objects.get(pk=user_id))
+
+    def transfer_body(self):
+        return {
+            'from_account_number': self.account.account_number,
+            'to_account_number': self.counterparty.account_number,
+            'amount': '0.01',
+        }
+
+    def request(self, name):
+        """Issue the request for a router URL name; returns the response."""
+        client = self.client
+        if name in ('user-list', 'account-list', 'transfer-list'):
+            return client.get(reverse(name))
+        if name == 'user-detail':
+            return client.get(reverse(name, kwargs={'pk': self.user_id}))
+        if name in ('account-detail', 'account-balance', 'account-transfers', 'account-statements'):
+            return client.get(reverse(name, kwargs={'pk': self.account.pk}))
+        if name == 'account-export-transfers':
+            response = client.get(reverse(name, kwargs={'pk': self.account.pk}), {'format': 'csv'})
+            # The export streams; the timing has to include producing every row
+            b''.join(response.streaming_content)
+            return response
+        if name == 'transfer-detail':
+            return client.get(reverse(name, kwargs={'pk': self.transfer_id}))
+        if name == 'transfer-queued':
+            return client.get(reverse(name, kwargs={'queued_id': self.queued_id}))
+        if name == 'transfer-create':
+            return client.post(reverse('transfer-list'), self.transfer_body(), format='json')
+        if name == 'transfer-batch':
+            return client.post(reverse(name), {'transfers': [self.transfer_body()] * 10}, format='json')
+        raise LookupError(f"No benchmark request defined for {name}")
+
+
+def endpoint_names():
+    """Every named router endpoint, plus the POST side of transfer-list."""
+    names = []
+    for url in router.urls:
+        if url.name != 'api-root' and url.name not in names:
+            names.append(url.name)
+    names.append('transfer-create')
+    return names
+
+
+def measure_endpoint(clients, name, concurrency, requests):
+    """Drive one endpoint with `concurrency` threads; returns latency and query stats."""
+    latencies = []
+    queries = []
+    statuses = {}
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def work(index, i):
+        counter = [0]
+
+        def count(execute, sql, params, many, context):
+            counter[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = clients[index % len(clients)].request(name)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            queries.append(counter[0])
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    elapsed, completed, failed = run_concurrently(work, concurrency, per_thread)
+    latencies.sort()
+    to_ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'requests': completed,
+        'errors': failed,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'requests_per_sec': round(completed / elapsed, 1) if elapsed else None,
+        'p50_ms': to_ms(latencies[int(0.50 * (len(latencies) - 1))]) if latencies else None,
+        'p95_ms': to_ms(latencies[int(0.95 * (len(latencies) - 1))]) if latencies else None,
+        'p99_ms': to_ms(latencies[int(0.99 * (len(latencies) - 1))]) if latencies else None,
+        'queries_per_request': round(statistics.fmean(queries), 2) if queries else None,
+    }
+
+
+@scenario('endpoints')
+def bench_endpoints(options):
+    """Latency, throughput and queries per request for every router endpoint."""
+    levels = sorted({int(level) for level in options['concurrency'].split(',')})
+    started = time.perf_counter()
+    first_user, first_account = seed_dataset(options['users'], options['accounts'], options['transfers'])
+    seed_seconds = time.perf_counter() - started
+
+    clients = []
+    for offset in range(min(max(levels), options['users'])):
+        account = Account.objects.get(pk=first_account + offset)
+        counterparty = Account.objects.get(pk=first_account + (offset + 1) % options['accounts'])
+        transfer_id = Transfer.objects.filter(from_account=account).values_list('pk', flat=True).first()
+        queued_id = QueuedTransfer.objects.create(
+            user_id=first_user + offset, from_account=account, to_account=counterparty, amount=Decimal('0.01'),
+        ).pk
+        clients.append(EndpointClient(first_user + offset, account, counterparty, transfer_id, queued_id))
+
+    # Warm up connections, caches and lazily imported code
+    names = []
+    skipped = []
+    for name in endpoint_names():
+        try:
+            clients[0].request(name)
+        except LookupError:
+            skipped.append(name)
+        else:
+            names.append(name)
+
+    endpoints = {}
+    for name in names:
+        endpoints[name] = {
+            str(level): measure_endpoint(clients, name, level, options['requests'])
+            for level in levels
+        }
+    return {
+        'scenario': 'endpoints',
+        'dataset': {
+            'users': options['users'],
+            'accounts': options['accounts'],
+            'transfers': options['transfers'],
+            'seed_seconds': round(seed_seconds, 1),
+        },
+        'endpoints': endpoints,
+        # Routes added without a request defined in EndpointClient
+        'skipped': skipped,
+    }
+
+
+def find_regressions(baseline, result, tolerance):
+    """
+    Compare an endpoints run against a stored baseline. An endpoint regresses
+    when its p95 latency or queries per request grow by more than `tolerance`
+    (a fraction), or when its throughput drops by more than `tolerance`.
+    Query counts get the same slack because retries under contention make
+    them vary a little between runs; an added query per request still shows.
+    """
+    regressions = []
+    for name, levels in baseline.get('endpoints', {}).items():
+        for level, before in levels.items():
+            after = result.get('endpoints', {}).get(name, {}).get(level)
+            if after is None:
+                regressions.append(f"{name} @ {level}: missing from this run")
+                continue
+            if after['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{name} @ {level}: p95 {before['p95_ms']}ms -> {after['p95_ms']}ms")
+            if after['queries_per_request'] > before['queries_per_request'] * (1 + tolerance):
+                regressions.append(
+                    f"{name} @ {level}: queries/request {before['queries_per_request']} -> {after['queries_per_request']}"
+                )
+            if after['requests_per_sec'] < before['requests_per_sec'] * (1 - tolerance):
+                regressions.append(
+                    f"{name} @ {level}: throughput {before['requests_per_sec']}/s -> {after['requests_per_sec']}/s"
+                )
+    return regressions
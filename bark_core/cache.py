@@ -0,0 +1,164 @@
+# bark_core/cache.py
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+# changed_at feeds Last-Modified on the balance endpoint (see conditional.py);
+# ledger_sequence is what a hit is checked against
+CachedBalance = namedtuple('CachedBalance', ['user_id', 'balance', 'changed_at', 'ledger_sequence'])
+
+
+class BalanceCache:
+    """
+    Bounded, thread-safe LRU cache of account_id -> CachedBalance.
+
+    The cache lives in each worker process, but balances are also changed by
+    other processes (other web workers, the ASGI app, bark_poster), whose
+    commits it never hears about. So an entry is only a hint: callers check
+    every hit against the account row's ledger_sequence and owner on the
+    primary with Account.objects.balance_unchanged(); every balance change
+    bumps the sequence. A hit still costs that primary key lookup. What it
+    saves is the stripe and last-transfer subqueries behind the balance and
+    its Last-Modified.
+
+    Within the process the transfer path also invalidates accounts from
+    transaction.on_commit. Readers take a token before going to the database
+    and only populate the cache if the account hasn't been invalidated since,
+    so a read that raced a local commit doesn't reinstate the old balance.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # account_id -> (invalidation stamp, CachedBalance or None)
+        self._clock = 0  # Bumped on every invalidation
+        self._evicted_stamp = 0  # Highest invalidation stamp we've forgotten
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, account_id):
+        with self._lock:
+            entry = self._entries.get(account_id)
+            if entry is None or entry[1] is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(account_id)
+            self.hits += 1
+            return entry[1]
+
+    def token(self):
+        """Take before reading a balance from the database; pass to set()."""
+        return self._clock
+
+    def set(self, account_id, value, token):
+        if not self.max_size:
+            return
+        with self._lock:
+            entry = self._entries.get(account_id)
+            stamp = entry[0] if entry is not None else self._evicted_stamp
+            if stamp > token:
+                # Invalidated while the caller was reading; its value may be stale
+                return
+            self._entries[account_id] = (stamp, value)
+            self._entries.move_to_end(account_id)
+            self._evict()
+
+    def invalidate(self, account_ids):
+        with self._lock:
+            for account_id in account_ids:
+                self._clock += 1
+                self.invalidations += 1
+                # Keep a tombstone so in-flight readers can tell they lost the race
+                self._entries[account_id] = (self._clock, None)
+                self._entries.move_to_end(account_id)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_size:
+            _, (stamp, _) = self._entries.popitem(last=False)
+            self._evicted_stamp = max(self._evicted_stamp, stamp)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._evicted_stamp = self._clock
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': sum(1 for _, value in self._entries.values() if value is not None),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'invalidations': self.invalidations,
+            }
+
+
+balance_cache = BalanceCache(getattr(settings, 'BARK_BALANCE_CACHE_SIZE', 10000))
+
+
+class AccountNumberCache:
+    """
+    Bounded, thread-safe LRU cache of account number hash -> account id.
+
+    Entries are only hints: account numbers can be edited, so callers must
+    check the number on the row they fetch by id.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, number_hashes):
+        """Return {hash: account_id} for the hashes that are cached."""
+        found = {}
+        with self._lock:
+            for number_hash in number_hashes:
+                account_id = self._entries.get(number_hash)
+                if account_id is None:
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(number_hash)
+                self.hits += 1
+                found[number_hash] = account_id
+        return found
+
+    def set_many(self, mapping):
+        if not self.max_size:
+            return
+        with self._lock:
+            for number_hash, account_id in mapping.items():
+                self._entries[number_hash] = account_id
+                self._entries.move_to_end(number_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, number_hashes):
+        with self._lock:
+            for number_hash in number_hashes:
+                self._entries.pop(number_hash, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+account_number_cache = AccountNumberCache(getattr(settings, 'BARK_ACCOUNT_NUMBER_CACHE_SIZE', 100000))
@@ -0,0 +1,75 @@
+# bark_core/conditional.py
+"""
+Conditional GET (ETag / Last-Modified) for the account read endpoints.
+
+Validators come from the account row, read in the same query that checks the
+caller may see the account, so a matching If-None-Match or If-Modified-Since
+is answered with a 304 before any payload is loaded or serialized.
+
+An account's ETag hashes its ledger_sequence, striped_balance and updated_at.
+Every transfer bumps ledger_sequence on both accounts in the same statement
+as their balance, except credits to a hot account, which only grow its
+stripes. So the ETag changes on every committed transfer, even when
+transfers commit out of id or timestamp order. The balance endpoint, which
+is usually answered from the balance cache, hashes the balance itself.
+
+Last-Modified is the later of updated_at and the account's newest transfer.
+HTTP dates only have whole seconds, and timestamps are taken a little before
+their transaction commits, so it is left off while the account changed
+within the last LAST_MODIFIED_SETTLE; those clients revalidate by ETag.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+LAST_MODIFIED_SETTLE = timedelta(seconds=2)
+
+
+def make_etag(request, *parts):
+    """
+    ETag for the representation of parts at this URL. The query string and
+    Accept header are part of it, since they change the response body.
+    """
+    key = repr((request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), parts))
+    return f'"{hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]}"'
+
+
+def account_etag(request, account, *parts):
+    """
+    ETag of a representation that only changes with account's balance and
+    transfers (plus parts). account needs with_striped_balance().
+    """
+    version = (account.pk, account.ledger_sequence, str(account.striped_balance), account.updated_at.isoformat())
+    return make_etag(request, *version, *parts)
+
+
+def changed_at(account):
+    """When account or its transfers last changed. account needs with_last_transfer()."""
+    return max(filter(None, (account.updated_at, account.last_sent_at, account.last_received_at)))
+
+
+def last_modified(changed):
+    """The Last-Modified to send for something changed at changed, if any."""
+    if changed is None or timezone.now() - changed < LAST_MODIFIED_SETTLE:
+        return None
+    return changed
+
+
+def not_modified(request, etag, modified=None):
+    """Return a 304 (or for If-Match, 412) response if the request's preconditions say so, otherwise None."""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(modified.timestamp()) if modified else None,
+    )
+    if response is not None:
+        set_validators(response, etag, modified)
+    return response
+
+
+def set_validators(response, etag, modified=None):
+    response['ETag'] = etag
+    if modified is not None:
+        response['Last-Modified'] = http_date(modified.timestamp())
+    return response
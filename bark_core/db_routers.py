@@ -0,0 +1,237 @@
+# bark_core/db_routers.py
+"""
+Read replica routing.
+
+Reads go to the primary unless a request opts in: ReplicaReadMixin sends the
+read-only actions listed in a viewset's replica_actions to a randomly chosen
+alias in BARK_DB_REPLICAS. Writes always go to the primary, and once a request
+writes, the rest of its reads do too.
+
+A user who has just written is pinned to the primary for
+BARK_REPLICA_PIN_SECONDS, so they never read data older than their own
+transfer. Pins live in a SQLite file (BARK_REPLICA_PIN_DB) shared by every
+worker process on the node, like the throttle counters, so a write served by
+one worker pins the user's next read in any other.
+
+Authentication runs before a request is routed, and the models it reads
+(tokens, revoked tokens) plus the idempotency keys are always read from the
+primary.
+"""
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY_ONLY_APPS = {'authtoken', 'sessions', 'contenttypes'}
+PRIMARY_ONLY_MODELS = {'bark_core.revokedtoken', 'bark_core.idempotencykey'}
+
+# Purge expired pins once every this many pins per process
+PURGE_PINS_EVERY = 10000
+
+current_routing = ContextVar('bark_db_routing', default=None)
+
+
+class Routing:
+    """Where the current request reads from."""
+    __slots__ = ('alias', 'wrote')
+
+    def __init__(self, alias=None):
+        self.alias = alias  # None reads from the primary
+        self.wrote = False
+
+
+class RoutingStats:
+    """Per-process counts of routed requests, for MetricsView."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.replica_requests = 0
+        self.pinned_requests = 0
+
+    def record(self, alias, pinned):
+        with self._lock:
+            self.requests += 1
+            if alias is not None:
+                self.replica_requests += 1
+            if pinned:
+                self.pinned_requests += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'replicas': len(replicas()),
+                'requests': self.requests,
+                'replica_requests': self.replica_requests,
+                'pinned_requests': self.pinned_requests,
+                'replica_share': round(self.replica_requests / self.requests, 3) if self.requests else 0,
+            }
+
+
+routing_stats = RoutingStats()
+
+
+def replicas():
+    return getattr(settings, 'BARK_DB_REPLICAS', [])
+
+
+class PinStore:
+    """Users pinned to the primary, with the time each pin expires."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pins = 0
+        self._lock = threading.Lock()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS replica_pin (user_id INTEGER PRIMARY KEY, expires REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        """One connection per thread, reused across requests."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # A pin lost to a power cut only costs a possibly stale read
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def pin(self, user_id, seconds, now):
+        self._connect().execute(
+            'INSERT INTO replica_pin (user_id, expires) VALUES (?, ?)'
+            ' ON CONFLICT(user_id) DO UPDATE SET expires = MAX(expires, excluded.expires)',
+            (user_id, now + seconds),
+        )
+        with self._lock:
+            self._pins += 1
+            purge = not self._pins % PURGE_PINS_EVERY
+        if purge:
+            self._connect().execute('DELETE FROM replica_pin WHERE expires < ?', (now,))
+
+    def is_pinned(self, user_id, now):
+        row = self._connect().execute('SELECT expires FROM replica_pin WHERE user_id = ?', (user_id,)).fetchone()
+        return row is not None and row[0] > now
+
+
+_pin_stores = {}
+_pin_stores_lock = threading.Lock()
+
+
+def get_pin_store():
+    """Return the store for the configured BARK_REPLICA_PIN_DB path."""
+    path = settings.BARK_REPLICA_PIN_DB
+    with _pin_stores_lock:
+        if path not in _pin_stores:
+            _pin_stores[path] = PinStore(path)
+        return _pin_stores[path]
+
+
+def pin_user(user):
+    """Read user's requests from the primary for the next BARK_REPLICA_PIN_SECONDS."""
+    if replicas() and user is not None and user.is_authenticated:
+        get_pin_store().pin(user.pk, getattr(settings, 'BARK_REPLICA_PIN_SECONDS', 5), time.time())
+
+
+def is_pinned(user):
+    return user is not None and user.is_authenticated and get_pin_store().is_pinned(user.pk, time.time())
+
+
+def reading_from_primary():
+    """True unless the current request's reads are being served by a replica."""
+    routing = current_routing.get()
+    return routing is None or routing.alias is None or routing.wrote
+
+
+def current_read_alias():
+    """The alias the current request reads from."""
+    routing = current_routing.get()
+    return DEFAULT_DB_ALIAS if reading_from_primary() else routing.alias
+
+
+@contextmanager
+def request_routing():
+    """
+    Scope for one request. Reads start on the primary until route_reads()
+    picks a replica; a request that wrote pins its user on the way out.
+    """
+    routing = Routing()
+    token = current_routing.set(routing)
+    try:
+        yield routing
+    finally:
+        current_routing.reset(token)
+
+
+def route_reads(routing, user, read_only):
+    """Send the rest of a request's reads to a replica if it's safe to."""
+    pinned = bool(replicas()) and read_only and is_pinned(user)
+    if replicas() and read_only and not pinned:
+        routing.alias = random.choice(replicas())
+    routing_stats.record(routing.alias, pinned)
+
+
+class ReplicaReadMixin:
+    """
+    Serve the actions named in replica_actions from a read replica when the
+    request uses a safe method and its user isn't pinned to the primary.
+    """
+    replica_actions = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        with request_routing() as routing:
+            self.db_routing = routing
+            response = super().dispatch(request, *args, **kwargs)
+            if routing.wrote:
+                pin_user(request.user)
+            return response
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication, permissions and throttles all run on the primary
+        super().initial(request, *args, **kwargs)
+        read_only = request.method in SAFE_METHODS and self.action in self.replica_actions
+        route_reads(self.db_routing, request.user, read_only)
+
+
+class ReplicaChangeListMixin:
+    """ReplicaReadMixin for ModelAdmin changelist pages."""
+
+    def changelist_view(self, request, extra_context=None):
+        with request_routing() as routing:
+            route_reads(routing, request.user, request.method == 'GET')
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                # Most of the changelist's queries run while its template renders
+                response.render()
+            if routing.wrote:
+                pin_user(request.user)
+            return response
+
+
+class ReplicaRouter:
+    """Database router for BARK_DB_REPLICAS; see the module docstring."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_ONLY_APPS or model._meta.label_lower in PRIMARY_ONLY_MODELS:
+            return DEFAULT_DB_ALIAS
+        return current_read_alias()
+
+    def db_for_write(self, model, **hints):
+        routing = current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
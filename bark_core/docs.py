@@ -0,0 +1,130 @@
+# bark_core/docs.py
+"""
+API docs: Swagger UI at /, ReDoc at /redoc/, and the OpenAPI schema both
+fetch from ?format=openapi.
+
+The schema is built once per process, on the first request for it, or read
+from BARK_OPENAPI_SCHEMA_FILE when that file exists (written at build time
+by ``manage.py bark_openapi_schema``). It is kept as JSON and gzip bytes
+and served with an ETag, so loading the docs no longer walks every viewset
+and serializer.
+
+drf_yasg (and django.test, for the RequestFactory the schema is built with)
+is only imported when a docs page or the schema is first built, not when a
+worker starts.
+"""
+import functools
+import gzip
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from rest_framework import permissions
+
+from .conditional import not_modified, set_validators
+
+SCHEMA_CONTENT_TYPE = 'application/openapi+json; charset=utf-8'
+
+# Check if the environment is production
+is_production = os.getenv('DJANGO_PRODUCTION') == "true"
+
+# Conditionally set the base URL
+base_url = 'https://barkbankapi-e88bfd94ccc1.herokuapp.com/' if is_production else 'http://localhost:8000/'
+
+
+def api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Bark Banking API",
+        default_version='v1',
+        description="API for Bark banking operations.\nBark Technologies is a financial technology company, not a bank.",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="contact@barkbank.local"),
+        license=openapi.License(name="MIT License"),
+    )
+
+
+@functools.cache
+def schema_view():
+    """drf_yasg's SchemaView for this API."""
+    from drf_yasg.views import get_schema_view
+
+    return get_schema_view(
+        api_info(),
+        url=base_url,
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+
+
+@functools.cache
+def ui_view(ui):
+    return schema_view().with_ui(ui, cache_timeout=0)
+
+
+def generate_schema():
+    """Walk the API and return its OpenAPI schema, as drf_yasg serves it to an anonymous client."""
+    # django.test pulls in the test client, runner and HTML parser; workers don't need them
+    from django.test import RequestFactory
+
+    response = schema_view().without_ui(cache_timeout=0)(RequestFactory().get('/', {'format': 'openapi'}))
+    response.render()
+    if response.status_code != 200:
+        raise RuntimeError(f"Generating the OpenAPI schema failed with status {response.status_code}.")
+    return response.content
+
+
+class CachedSchema:
+    def __init__(self, body):
+        self.body = body
+        self.gzipped = gzip.compress(body, mtime=0)
+        # Weak, since the same ETag covers both encodings
+        self.etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+_schema = None
+_schema_lock = threading.Lock()
+
+
+def cached_schema():
+    global _schema
+    if _schema is None:
+        with _schema_lock:
+            if _schema is None:
+                path = getattr(settings, 'BARK_OPENAPI_SCHEMA_FILE', '')
+                if path and os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        _schema = CachedSchema(f.read())
+                else:
+                    _schema = CachedSchema(generate_schema())
+    return _schema
+
+
+def serve_schema(request):
+    schema = cached_schema()
+    response = not_modified(request, schema.etag)
+    if response is None:
+        if re_accepts_gzip.search(request.headers.get('Accept-Encoding', '')):
+            response = HttpResponse(schema.gzipped, content_type=SCHEMA_CONTENT_TYPE)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(schema.body, content_type=SCHEMA_CONTENT_TYPE)
+        set_validators(response, schema.etag)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    # Stored, but revalidated against the ETag on every use
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def docs_view(ui):
+    """The 'swagger' or 'redoc' page, with its schema request answered from the cache."""
+    def view(request, *args, **kwargs):
+        if request.GET.get('format') == 'openapi':
+            return serve_schema(request)
+        return ui_view(ui)(request, *args, **kwargs)
+    return view
@@ -0,0 +1,282 @@
+# bark_core/engine.py
+"""
+Transfer engine.
+
+Balances are never read into Python and written back. A debit is a single
+conditional ``UPDATE ... SET balance = balance - x WHERE balance >= x`` and a
+credit is ``UPDATE ... SET balance = balance + x``, so concurrent transfers on
+the same account can't lose updates. The two row updates are always issued in
+ascending account-id order, which means A->B and B->A take their row locks in
+the same order and can't deadlock.
+
+Credits to a hot account (stripe_count > 0) update one of its BalanceStripe
+rows instead of the account row. Stripe locks are only ever taken after every
+row lock a transaction needs, and a hot account's stripes are folded into its
+row before it is debited. Serialization failures, deadlocks and
+SQLite "database is locked" errors are retried with jittered exponential
+backoff.
+"""
+import logging
+import random
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction, OperationalError
+
+from django.utils import timezone
+
+from .models import Account, Transfer, IdempotencyKey, QueuedTransfer
+from .ledger import journal_transfers
+from .statements import record_statements
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL SQLSTATEs for serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = {'40001', '40P01'}
+
+BATCH_INSERT_SIZE = 500
+
+
+def is_retryable(exc):
+    """Return True if a database error is a transient concurrency failure."""
+    pgcode = getattr(exc.__cause__, 'pgcode', None)
+    if pgcode in RETRYABLE_PGCODES:
+        return True
+    return 'database is locked' in str(exc)
+
+
+def run_with_retries(func, *args, **kwargs):
+    """
+    Run func inside its own transaction, retrying transient concurrency
+    failures with jittered exponential backoff.
+
+    Retrying is only safe when we own the whole transaction, so if we're
+    already inside an atomic block the first failure is re-raised.
+    """
+    max_retries = getattr(settings, 'BARK_TRANSFER_MAX_RETRIES', 5)
+    backoff = getattr(settings, 'BARK_TRANSFER_RETRY_BACKOFF', 0.01)
+    nested = transaction.get_connection().in_atomic_block
+
+    attempt = 0
+    while True:
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            if nested or attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+            attempt += 1
+            logger.warning(f"Retrying transfer after {e!s} (attempt {attempt}, sleeping {delay:.3f}s)")
+            time.sleep(delay)
+
+
+def _apply_transfer(from_account, to_account, amount, idempotency_key=None):
+    """Move amount between two accounts. Must run inside a transaction."""
+    if from_account.stripe_count:
+        # The funds check needs the credits held in stripes; both rows go first
+        Account.objects.lock([from_account.pk, to_account.pk])
+        Account.objects.fold_stripes(from_account.pk)
+
+    striped = to_account.stripe_count > 0
+    steps = [(from_account.pk, Account.objects.debit, "Insufficient funds")]
+    if not striped:
+        steps.append((to_account.pk, Account.objects.credit, "Account does not exist"))
+    # Lock rows in a fixed (ascending id) order to rule out deadlocks
+    for account_id, apply, error in sorted(steps, key=lambda step: step[0]):
+        if not apply(account_id, amount):
+            raise ValidationError(error)
+    if striped and not Account.objects.credit_stripe(to_account, amount):
+        # Hot mode was switched off meanwhile
+        striped = False
+        if not Account.objects.credit(to_account.pk, amount):
+            raise ValidationError("Account does not exist")
+
+    transfer = Transfer.objects.create(
+        from_account=from_account,
+        to_account=to_account,
+        amount=amount,
+    )
+    # Tie the transfer to its Idempotency-Key claim, unless the claim was taken over
+    if idempotency_key is not None and not IdempotencyKey.objects.filter(
+        pk=idempotency_key.pk, transfer__isnull=True
+    ).update(transfer=transfer):
+        raise ValidationError("The Idempotency-Key was taken over by a newer request.")
+
+    # Rows are still locked, so these are exactly the post-transfer states
+    after = Account.objects.filter(pk__in=[from_account.pk, to_account.pk]).values_list('pk', 'ledger_sequence', 'balance')
+    states = {pk: [sequence, balance] for pk, sequence, balance in after}
+    states[from_account.pk] = [states[from_account.pk][0] - 1, states[from_account.pk][1] + amount]
+    if striped:
+        journal_transfers([transfer], states, striped={to_account.pk})
+    else:
+        states[to_account.pk] = [states[to_account.pk][0] - 1, states[to_account.pk][1] - amount]
+        journal_transfers([transfer], states)
+    record_statements([transfer], striped={to_account.pk} if striped else ())
+    return transfer
+
+
+def execute_transfer(from_account, to_account, amount, idempotency_key=None):
+    """
+    Atomically move amount from from_account to to_account and record the
+    Transfer. Raises ValidationError on invalid input or insufficient funds.
+    idempotency_key is the IdempotencyKey claimed for the request, if any.
+    """
+    amount = Decimal(amount)
+    if amount <= 0:
+        raise ValidationError("Transfer amount must be positive")
+    if from_account.pk == to_account.pk:
+        raise ValidationError("Cannot transfer to the same account")
+
+    return run_with_retries(_apply_transfer, from_account, to_account, amount, idempotency_key)
+
+
+class BatchTransferError(ValidationError):
+    """Raised in all-or-nothing mode when any transfer in a batch is rejected."""
+
+    def __init__(self, results):
+        super().__init__("One or more transfers in the batch were rejected.")
+        self.results = results
+
+
+def _apply_batch(items, user, atomic):
+    """Resolve, validate, net and post a batch of transfers. Must run inside a transaction."""
+    numbers = {item['from_account_number'] for item in items} | {item['to_account_number'] for item in items}
+    # One query resolves every account number and locks the rows in id order
+    accounts = Account.objects.select_for_update().resolve_numbers(numbers)
+    # Fold hot accounts first, so the batch sees whole balances and can credit their rows
+    for account in sorted(accounts.values(), key=lambda account: account.pk):
+        if account.stripe_count and Account.objects.fold_stripes(account.pk):
+            account.refresh_from_db(fields=['balance', 'ledger_sequence'])
+    balances = {account.pk: account.balance for account in accounts.values()}
+    states = {account.pk: [account.ledger_sequence, account.balance] for account in accounts.values()}
+
+    results = []
+    accepted = []
+    for index, item in enumerate(items):
+        from_account = accounts.get(item['from_account_number'])
+        to_account = accounts.get(item['to_account_number'])
+        amount = Decimal(item['amount'])
+
+        error = None
+        if not from_account or not to_account:
+            error = "One or both of the account numbers are invalid."
+        elif from_account.pk == to_account.pk:
+            error = "Cannot transfer to the same account."
+        elif amount <= 0:
+            error = "Transfer amount must be positive."
+        elif user is not None and not user.is_staff and from_account.user_id != user.pk:
+            error = "You don't have permission to transfer from this account."
+        elif balances[from_account.pk] < amount:
+            error = "Insufficient funds."
+
+        if error:
+            results.append({'index': index, 'status': 'rejected', 'detail': error})
+            continue
+
+        # Simulate in submission order so later items see earlier ones
+        balances[from_account.pk] -= amount
+        balances[to_account.pk] += amount
+        accepted.append(Transfer(from_account=from_account, to_account=to_account, amount=amount))
+        results.append({'index': index, 'status': 'created'})
+
+    if atomic and len(accepted) != len(items):
+        raise BatchTransferError(results)
+
+    # Apply the net change per account with set-based CASE updates
+    deltas = {}
+    entry_counts = {}
+    for transfer in accepted:
+        for account_id, amount in ((transfer.from_account_id, -transfer.amount), (transfer.to_account_id, transfer.amount)):
+            deltas[account_id] = deltas.get(account_id, 0) + amount
+            entry_counts[account_id] = entry_counts.get(account_id, 0) + 1
+    Account.objects.apply_deltas(deltas, entry_counts)
+
+    created = iter(Transfer.objects.bulk_create(accepted, batch_size=BATCH_INSERT_SIZE))
+    journal_transfers(accepted, states)
+    record_statements(accepted)
+    for result in results:
+        if result['status'] == 'created':
+            result['id'] = next(created).pk
+    return results
+
+
+def execute_batch(items, user=None, atomic=True):
+    """
+    Post a batch of transfers in one transaction.
+
+    items is a sequence of dicts with from_account_number, to_account_number
+    and amount. Returns one result dict per item. In atomic mode a
+    BatchTransferError carrying the per-item results is raised if any item
+    is rejected; otherwise rejected items are skipped and the rest posted.
+    """
+    return run_with_retries(_apply_batch, items, user, atomic)
+
+
+def _post_queued(batch_size):
+    """Post the oldest pending queued transfers as one batch. Must run inside a transaction."""
+    # skip_locked lets several posters drain the queue side by side
+    queued = list(
+        QueuedTransfer.objects.select_for_update(skip_locked=True, of=('self',))
+        .filter(status=QueuedTransfer.PENDING)
+        .select_related('from_account', 'to_account')
+        .order_by('pk')[:batch_size]
+    )
+    if not queued:
+        return []
+
+    # Authorization was checked when the transfers were queued
+    results = _apply_batch([
+        {
+            'from_account_number': item.from_account.account_number,
+            'to_account_number': item.to_account.account_number,
+            'amount': item.amount,
+        }
+        for item in queued
+    ], None, atomic=False)
+
+    now = timezone.now()
+    for item, result in zip(queued, results):
+        item.posted_at = now
+        if result['status'] == 'created':
+            item.status = QueuedTransfer.POSTED
+            item.transfer_id = result['id']
+        else:
+            item.status = QueuedTransfer.REJECTED
+            item.detail = result['detail']
+    QueuedTransfer.objects.bulk_update(queued, ['status', 'transfer', 'detail', 'posted_at'], batch_size=BATCH_INSERT_SIZE)
+    return queued
+
+
+def set_stripe_count(account, count):
+    """Put an account in hot mode with count credit stripes, or take it out with 0."""
+    run_with_retries(Account.objects.set_stripe_count, account.pk, count)
+
+
+def _fold(account_id):
+    Account.objects.lock([account_id])
+    return Account.objects.fold_stripes(account_id)
+
+
+def fold_hot_accounts():
+    """
+    Fold the stripes of every hot account into its balance, one short
+    transaction per account. Returns the number of accounts folded.
+    """
+    folded = 0
+    for account_id in Account.objects.filter(stripe_count__gt=0).values_list('pk', flat=True):
+        if run_with_retries(_fold, account_id):
+            folded += 1
+    return folded
+
+
+def post_queued_transfers(batch_size=1000):
+    """
+    Post up to batch_size pending queued transfers, oldest first, in one
+    transaction with balance changes netted per account. Transfers that
+    would overdraw their account are marked rejected. Returns the
+    QueuedTransfer rows that were processed.
+    """
+    return run_with_retries(_post_queued, batch_size)
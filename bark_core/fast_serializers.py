@@ -0,0 +1,164 @@
+# bark_core/fast_serializers.py
+"""
+Fast path for the large read responses: user and account lists and
+transfer history.
+
+On a big page DRF spends most of its time walking serializer fields for
+every row. A FastSerializer is built from a read-only ModelSerializer's own
+fields instead: it fetches exactly their columns with values() and formats
+each with a function whose settings (decimal places and context, time zone)
+are worked out once per response. Rows come out as the same primitives the
+serializer would produce, so the renderer emits the same bytes in a single
+json.dumps.
+
+Only plain columns, primary-key relations, decimals, datetimes and nested
+serializers of those are supported; anything else is refused when the fast
+serializer is first used. BARK_FAST_SERIALIZERS=false turns the fast path
+off.
+"""
+import decimal
+import operator
+from functools import cached_property
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+
+from .serializers import UserSerializer, AccountSerializer, TransferHistorySerializer
+
+# Fields whose representation of a values() column is the column itself
+PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+                serializers.ReadOnlyField, serializers.PrimaryKeyRelatedField)
+
+
+def enabled():
+    return getattr(settings, 'BARK_FAST_SERIALIZERS', True)
+
+
+def decimal_formatter(field):
+    """DecimalField.to_representation with its quantum and context worked out once."""
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if field.decimal_places is None or field.normalize_output or field.localize or not coerce_to_string:
+        return field.to_representation
+    quantum = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def format_decimal(value):
+        return '{:f}'.format(value.quantize(quantum, rounding=rounding, context=context))
+    return format_decimal
+
+
+def datetime_formatter(field):
+    """DateTimeField.to_representation for ISO 8601 with the time zone looked up once."""
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def format_datetime(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return format_datetime
+
+
+def formatter(field):
+    """Function from a column value to the field's representation; None stays None as in DRF."""
+    if isinstance(field, serializers.DecimalField):
+        format_value = decimal_formatter(field)
+    elif isinstance(field, serializers.DateTimeField):
+        format_value = datetime_formatter(field)
+    else:
+        return None
+
+    def format_column(value):
+        return None if value is None else format_value(value)
+    return format_column
+
+
+class FastSerializer:
+    """
+    Values-based stand-in for a read-only ModelSerializer.
+
+    computed maps a field source that isn't a column, like a property, to
+    (columns, function of those columns).
+    """
+
+    def __init__(self, serializer_class, computed=None, prefix=''):
+        self.serializer_class = serializer_class
+        self.computed = computed or {}
+        self.prefix = prefix
+
+    @cached_property
+    def fields(self):
+        """(field name, field, column(s) or nested FastSerializer) for each field in the output."""
+        fields = []
+        for name, field in self.serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if field.source in self.computed:
+                source = [self.prefix + column for column in self.computed[field.source][0]]
+            elif isinstance(field, serializers.BaseSerializer) and not getattr(field, 'many', False):
+                source = FastSerializer(type(field), prefix=f'{self.prefix}{field.source}__')
+            elif isinstance(field, (*PLAIN_FIELDS, serializers.DecimalField, serializers.DateTimeField)) and '.' not in field.source:
+                source = self.prefix + field.source
+            else:
+                raise ImproperlyConfigured(
+                    f"{self.serializer_class.__name__}.{name} ({type(field).__name__}) has no fast representation."
+                )
+            fields.append((name, field, source))
+        return fields
+
+    @cached_property
+    def columns(self):
+        columns = []
+        for _, _, source in self.fields:
+            if isinstance(source, FastSerializer):
+                columns.extend(source.columns)
+            elif isinstance(source, list):
+                columns.extend(source)
+            else:
+                columns.append(source)
+        return list(dict.fromkeys(columns))
+
+    def values(self, queryset):
+        """queryset (or AccountHistory) fetching just the columns this serializer needs."""
+        return queryset.values(*self.columns)
+
+    def row_builder(self):
+        """Return a function from a values() row to its representation."""
+        getters = []
+        for name, field, source in self.fields:
+            format_value = formatter(field)
+            if isinstance(source, FastSerializer):
+                get = source.row_builder()
+            elif isinstance(source, list):
+                compute = self.computed[field.source][1]
+                get = (lambda row, keys=source, compute=compute, format_value=format_value or (lambda value: value):
+                       format_value(compute(*(row[key] for key in keys))))
+            elif format_value is None:
+                get = operator.itemgetter(source)
+            else:
+                get = (lambda row, key=source, format_value=format_value: format_value(row[key]))
+            getters.append((name, get))
+
+        def build(row):
+            return {name: get(row) for name, get in getters}
+        return build
+
+    def represent(self, rows):
+        """The serializer's many=True data for rows from values()."""
+        build = self.row_builder()
+        return [build(row) for row in rows]
+
+
+users = FastSerializer(UserSerializer)
+accounts = FastSerializer(AccountSerializer, computed={'current_balance': (['balance', 'striped_balance'], operator.add)})
+transfer_history = FastSerializer(TransferHistorySerializer)
@@ -0,0 +1,144 @@
+# bark_core/idempotency.py
+"""
+Idempotency-Key handling for POST /api/transfers/.
+
+The first request with a key claims it by inserting an IdempotencyKey row;
+its response is stored on the row afterwards. A repeat of the key is answered
+from the row with one lookup on the (user, key) index and never reaches the
+accounts. A repeat that arrives while the first request is still running
+waits for it (on an in-process event, or by polling when the first request
+is being served by another process) instead of running the transfer again.
+
+The transfer engine records the transfer on the claim inside the transfer's
+transaction and rolls back if the claim is gone, so a claim that was taken
+over after BARK_IDEMPOTENCY_LOCK_TIMEOUT can never produce a second transfer.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+# Purge expired keys once every this many claims per process
+PURGE_EVERY = 1000
+
+_claims = 0
+_inflight = {}  # (user id, key) -> threading.Event set when the owner finishes
+_lock = threading.Lock()
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = "This Idempotency-Key was already used with a different request."
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyKeyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "A request with this Idempotency-Key is still in progress."
+    default_code = 'idempotency_key_in_progress'
+
+
+def request_fingerprint(data):
+    """Hash of the request data, independent of key order and whitespace."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def replay(row):
+    return Response(row.response, status=row.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def claim(user, key, fingerprint, recover):
+    """
+    Claim key for a new request. Returns (claim, None) when the caller should
+    go ahead, or (None, response) with the stored response of an earlier
+    request. recover(row) builds the response for a row whose transfer was
+    committed but whose response was never stored.
+    """
+    if not key or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        raise ValidationError({"Idempotency-Key": "Must be between 1 and 255 characters."})
+    wait = getattr(settings, 'BARK_IDEMPOTENCY_WAIT', 10)
+    lock_timeout = getattr(settings, 'BARK_IDEMPOTENCY_LOCK_TIMEOUT', 60)
+    ttl = getattr(settings, 'BARK_IDEMPOTENCY_KEY_TTL', 24 * 3600)
+
+    deadline = time.monotonic() + wait
+    delay = 0.005
+    while True:
+        row = IdempotencyKey.objects.filter(user_id=user.pk, key=key).first()
+        now = timezone.now()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    row = IdempotencyKey.objects.create(
+                        user_id=user.pk, key=key, fingerprint=fingerprint, expires_at=now + timedelta(seconds=ttl),
+                    )
+            except IntegrityError:
+                continue  # Someone else claimed it first
+            with _lock:
+                _inflight[user.pk, key] = threading.Event()
+            _maybe_purge(now)
+            return row, None
+
+        if row.expires_at <= now:
+            IdempotencyKey.objects.filter(pk=row.pk, expires_at__lte=now).delete()
+            continue
+        if row.fingerprint != fingerprint:
+            raise IdempotencyKeyReused()
+        if row.status_code is not None:
+            return None, replay(row)
+        if row.transfer_id is None and row.created_at <= now - timedelta(seconds=lock_timeout):
+            # The first request died before committing anything; take the key over
+            IdempotencyKey.objects.filter(pk=row.pk, transfer__isnull=True, status_code__isnull=True).delete()
+            continue
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if row.transfer_id is not None:
+                return None, recover(row)
+            raise IdempotencyKeyInProgress()
+        event = _inflight.get((user.pk, key))
+        if event is not None:
+            event.wait(min(delay, remaining))
+        else:
+            time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.1)
+
+
+def finish(row, response):
+    """Store the response for replay; server errors release the key instead."""
+    if response.status_code >= 500:
+        release(row)
+        return
+    IdempotencyKey.objects.filter(pk=row.pk).update(status_code=response.status_code, response=response.data)
+    _wake(row)
+
+
+def release(row):
+    """Give the key up so a retry runs the request again."""
+    IdempotencyKey.objects.filter(pk=row.pk, transfer__isnull=True).delete()
+    _wake(row)
+
+
+def _wake(row):
+    with _lock:
+        event = _inflight.pop((row.user_id, row.key), None)
+    if event is not None:
+        event.set()
+
+
+def _maybe_purge(now):
+    global _claims
+    with _lock:
+        _claims += 1
+        if _claims % PURGE_EVERY:
+            return
+    IdempotencyKey.objects.filter(expires_at__lte=now).delete()
@@ -0,0 +1,130 @@
+# bark_core/ledger.py
+"""
+Append-only ledger journal.
+
+Every posted transfer appends a debit entry for the sender and a credit entry
+for the receiver, each stamped with the account's next ledger sequence number
+and its running balance after the entry. Every BARK_LEDGER_CHECKPOINT_INTERVAL
+entries per account a BalanceCheckpoint is written as well. Checkpoints are
+also the anchor for balances that predate the journal (see migration 0010 and
+bark_rebuild_ledger).
+
+Credits to a hot account's stripes don't touch the account row, so they are
+journaled without a sequence or running balance. Folding the stripes writes a
+checkpoint, and debits fold first, so the balance at any moment is the latest
+running balance plus the striped credits after it.
+
+Migration 0010 anchored each existing account with a sequence-0 checkpoint
+stamped with the time it ran, not the time of the account's last transfer.
+Until bark_rebuild_ledger replays the transfers before it, such an account
+has no history before that checkpoint, and balance_as_of() refuses to
+answer for earlier moments rather than return the opening balance.
+"""
+from django.conf import settings
+from django.db.models import Sum
+
+from .models import LedgerEntry, BalanceCheckpoint
+
+
+class HistoryUnavailable(Exception):
+    """The journal doesn't reach back to the requested moment."""
+
+    def __init__(self, starts_at):
+        super().__init__(f"The ledger history of this account starts at {starts_at.isoformat()}.")
+        self.starts_at = starts_at
+
+
+def checkpoint_interval():
+    return getattr(settings, 'BARK_LEDGER_CHECKPOINT_INTERVAL', 1000)
+
+
+def journal_transfers(transfers, states, striped=()):
+    """
+    Append ledger entries for transfers, in order.
+
+    states maps account_id -> [ledger_sequence, balance] as they were before
+    these transfers were applied, and is advanced in place. The caller must
+    hold the account rows for the duration of its transaction. Credits to
+    the accounts in striped went to a stripe and don't need a state.
+    """
+    interval = checkpoint_interval()
+    entries = []
+    checkpoints = []
+    for transfer in transfers:
+        sides = (
+            (transfer.from_account_id, -transfer.amount),
+            (transfer.to_account_id, transfer.amount),
+        )
+        for account_id, amount in sides:
+            if amount > 0 and account_id in striped:
+                entries.append(LedgerEntry(
+                    account_id=account_id,
+                    transfer=transfer,
+                    amount=amount,
+                    timestamp=transfer.timestamp,
+                ))
+                continue
+            state = states[account_id]
+            state[0] += 1
+            state[1] += amount
+            entries.append(LedgerEntry(
+                account_id=account_id,
+                transfer=transfer,
+                sequence=state[0],
+                amount=amount,
+                balance_after=state[1],
+                timestamp=transfer.timestamp,
+            ))
+            if state[0] % interval == 0:
+                checkpoints.append(BalanceCheckpoint(
+                    account_id=account_id,
+                    sequence=state[0],
+                    balance=state[1],
+                    timestamp=transfer.timestamp,
+                ))
+    LedgerEntry.objects.bulk_create(entries, batch_size=500)
+    if checkpoints:
+        BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=500)
+    return entries
+
+
+def balance_as_of(account, as_of):
+    """
+    Return the account's balance at the moment as_of, or None if the account
+    did not exist yet. Costs three index seeks whatever the history length,
+    plus a range scan over striped credits since the last fold. Raises
+    HistoryUnavailable if as_of predates a backfilled account's journal.
+    """
+    entry = (
+        LedgerEntry.objects
+        .filter(account=account, balance_after__isnull=False, timestamp__lte=as_of)
+        .order_by('-timestamp', '-sequence')
+        .values_list('sequence', 'balance_after', 'timestamp')
+        .first()
+    )
+    checkpoint = (
+        BalanceCheckpoint.objects
+        .filter(account=account, timestamp__lte=as_of)
+        .order_by('-timestamp', '-sequence')
+        .values_list('sequence', 'balance', 'timestamp')
+        .first()
+    )
+    # A checkpoint at the same sequence as an entry agrees with it, so prefer
+    # whichever is furthest along.
+    candidates = [found for found in (entry, checkpoint) if found is not None]
+    if candidates:
+        _, balance, since = max(candidates, key=lambda found: found[0])
+    elif as_of < account.created_at:
+        return None
+    else:
+        backfilled_at = (
+            BalanceCheckpoint.objects.filter(account=account, sequence=0).values_list('timestamp', flat=True).first()
+        )
+        if backfilled_at is not None:
+            raise HistoryUnavailable(backfilled_at)
+        balance, since = account.opening_balance, None
+
+    striped = LedgerEntry.objects.filter(account=account, balance_after__isnull=True, timestamp__lte=as_of)
+    if since is not None:
+        striped = striped.filter(timestamp__gt=since)
+    return balance + (striped.aggregate(total=Sum('amount'))['total'] or 0)
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bark_core.bench import SCENARIOS, bench_database, find_regressions
+
+
+class Command(BaseCommand):
+    help = "Run a Bark benchmark scenario against a throwaway database and print the results as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS), help="Benchmark scenario to run.")
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent worker threads.")
+        parser.add_argument('--iterations', type=int, default=200, help="Operations per thread.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Transfers per batch (batch scenario).")
+        parser.add_argument('--stripes', default='0,1,4,16', help="Comma-separated stripe counts (stripes scenario).")
+        parser.add_argument('--users', type=int, default=1000, help="Seeded users (endpoints, reconcile and admin scenarios).")
+        parser.add_argument('--accounts', type=int, default=10000, help="Seeded accounts (endpoints, reconcile and admin scenarios).")
+        parser.add_argument('--transfers', type=int, default=100000, help="Seeded transfers (endpoints, reconcile and admin scenarios).")
+        parser.add_argument('--rows', type=int, default=10000, help="Rows per response (serializers scenario).")
+        parser.add_argument('--concurrency', default='1,8', help="Comma-separated concurrency levels (endpoints scenario).")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and concurrency level (endpoints scenario).")
+        parser.add_argument('--baseline', help="Fail if the run regresses against this saved result.")
+        parser.add_argument('--save-baseline', help="Write the result to this file for later --baseline runs.")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed fractional slowdown against the baseline.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        with bench_database():
+            result = SCENARIOS[options['scenario']](options)
+        self.stdout.write(json.dumps(result, indent=2))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(result, f, indent=2)
+        if baseline is not None:
+            regressions = find_regressions(baseline, result, options['tolerance'])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+
+from bark_core.engine import fold_hot_accounts, is_retryable
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold the credit stripes of hot accounts into their balances every --every seconds. "
+        "Folding keeps the stripes small and writes the checkpoints historical balances start from."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=1.0, help="Seconds between folds.")
+        parser.add_argument('--once', action='store_true', help="Fold once and exit.")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                try:
+                    folded = fold_hot_accounts()
+                except OperationalError as e:
+                    if not is_retryable(e):
+                        raise
+                    self.stderr.write(f"Folding failed, retrying: {e}")
+                else:
+                    if folded:
+                        self.stdout.write(f"Folded {folded} hot accounts.")
+                if options['once']:
+                    break
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bark_core.engine import set_stripe_count
+from bark_core.models import Account
+
+
+class Command(BaseCommand):
+    help = (
+        "Put an account that receives many concurrent credits in hot mode. Its credits are "
+        "spread over --stripes rows and folded into the balance by bark_fold_stripes and "
+        "before every debit. --stripes 0 folds the stripes and turns hot mode off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_number')
+        parser.add_argument('--stripes', type=int, required=True, help="Number of credit stripes (0 to turn off).")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['stripes'] <= 1024:
+            raise CommandError("--stripes must be between 0 and 1024.")
+        account = Account.verify_account_number(options['account_number'])
+        if account is None:
+            raise CommandError("No account has that number.")
+        set_stripe_count(account, options['stripes'])
+        if options['stripes']:
+            self.stdout.write(self.style.SUCCESS(f"Account {account.pk} is hot with {options['stripes']} stripes."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Account {account.pk} is no longer hot."))
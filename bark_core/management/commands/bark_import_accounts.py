@@ -0,0 +1,240 @@
+import csv
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from bark_core.models import Account
+from bark_core.utils import hash_account_number
+
+MAX_BALANCE = Decimal('1e15')  # DecimalField(max_digits=19, decimal_places=4)
+
+
+class Position:
+    """Byte offset just past the last record read, for checkpoints."""
+
+    def __init__(self, offset):
+        self.offset = offset
+
+
+def read_lines(f, position):
+    for raw in f:
+        position.offset += len(raw)
+        # Bad bytes become U+FFFD and get their row rejected in parse()
+        yield raw.decode('utf-8', errors='replace')
+
+
+class Command(BaseCommand):
+    help = (
+        "Import accounts from a CSV or NDJSON file with account_number, username (or user_id) "
+        "and opening_balance per row. The file is streamed and imported a chunk at a time: "
+        "each chunk's account numbers are checked against the database in one query and the "
+        "accounts bulk-created in one transaction. Progress is checkpointed after every chunk, "
+        "so rerunning the same command after a failure resumes where it stopped. Rejected rows "
+        "are written to a side file with the reason."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with a header row) or NDJSON file.")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Rows validated and inserted per transaction.")
+        parser.add_argument('--create-users', action='store_true', help="Create users named in the file that don't exist yet.")
+        parser.add_argument('--rejects', help="Where to write rejected rows (default: <path>.rejects.ndjson).")
+        parser.add_argument('--checkpoint', help="Progress file (default: <path>.checkpoint).")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start over.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        rejects_path = options['rejects'] or f'{path}.rejects.ndjson'
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+
+        progress = {'offset': 0, 'rows': 0, 'imported': 0, 'existing': 0, 'rejected': 0, 'rejects_size': 0}
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as f:
+                progress = json.load(f)
+            self.stdout.write(f"Resuming after row {progress['rows']}.")
+        elif os.path.exists(rejects_path):
+            os.remove(rejects_path)
+
+        try:
+            f = open(path, 'rb')
+        except OSError as e:
+            raise CommandError(f"Can't read {path}: {e}")
+        with f, open(rejects_path, 'a') as rejects:
+            # Rejects past the checkpoint came from a chunk that is about to be replayed
+            if 'rejects_size' in progress:
+                rejects.truncate(progress['rejects_size'])
+            chunk = []
+            for row_number, row, offset in self.read_rows(f, fmt, progress):
+                chunk.append((row_number, row))
+                if len(chunk) >= options['chunk_size']:
+                    self.import_chunk(chunk, options, progress, rejects)
+                    self.save_progress(checkpoint_path, progress, offset, row_number, rejects)
+                    chunk = []
+            if chunk:
+                self.import_chunk(chunk, options, progress, rejects)
+
+        # Finished, so a rerun should start from the top
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {progress['imported']} accounts; {progress['existing']} were already there "
+            f"and {progress['rejected']} were rejected."
+        ))
+        if progress['rejected']:
+            self.stdout.write(self.style.WARNING(f"Rejected rows are in {rejects_path}."))
+
+    def read_rows(self, f, fmt, progress):
+        """
+        Yield (row number, row, byte offset after the row) from the checkpointed
+        offset on. A row that can't be decoded is yielded as a ValueError.
+        """
+        position = Position(0)
+        lines = read_lines(f, position)
+        if fmt == 'csv':
+            reader = csv.reader(lines)
+            header = [column.strip() for column in next(reader, [])]
+        if progress['offset']:
+            f.seek(progress['offset'])
+            position.offset = progress['offset']
+
+        row_number = progress['rows']
+        while True:
+            try:
+                if fmt == 'csv':
+                    values = next(reader, None)
+                    if values is None:
+                        return
+                    if not values:
+                        continue
+                    row = dict(zip(header, values))
+                else:
+                    line = next(lines, None)
+                    if line is None:
+                        return
+                    if not line.strip():
+                        continue
+                    row = json.loads(line)
+            except (ValueError, csv.Error) as e:
+                row = ValueError(f"Unreadable row: {e}")
+            row_number += 1
+            yield row_number, row, position.offset
+
+    def parse(self, row):
+        """Return (account_number, user reference, opening balance) or raise ValueError with the reason."""
+        if isinstance(row, ValueError):
+            raise row
+        if not isinstance(row, dict):
+            raise ValueError("Expected an object.")
+        if any('\ufffd' in str(value) for value in row.values()):
+            raise ValueError("Row is not valid UTF-8.")
+        number = str(row.get('account_number') or '').strip()
+        if not number or len(number) > Account._meta.get_field('account_number').max_length:
+            raise ValueError("account_number must be 1 to 16 characters.")
+        if row.get('username'):
+            user = ('username', str(row['username']).strip())
+        elif row.get('user_id'):
+            try:
+                user = ('pk', int(row['user_id']))
+            except (TypeError, ValueError):
+                raise ValueError("user_id must be an integer.")
+        else:
+            raise ValueError("A username or user_id is required.")
+        try:
+            balance = Decimal(str(row.get('opening_balance') or '0').strip())
+        except InvalidOperation:
+            raise ValueError("opening_balance must be a number.")
+        if not balance.is_finite() or balance < 0 or balance >= MAX_BALANCE or balance.as_tuple().exponent < -4:
+            raise ValueError("opening_balance must be between 0 and 10^15 with at most 4 decimal places.")
+        return number, user, balance
+
+    def import_chunk(self, chunk, options, progress, rejects):
+        # A concurrent insert of the same number fails the chunk; revalidating then rejects it
+        for attempt in range(3):
+            try:
+                with transaction.atomic():
+                    imported, existing, rejected = self.validate_and_insert(chunk, options)
+                break
+            except IntegrityError:
+                if attempt == 2:
+                    raise
+        for row_number, row, error in rejected:
+            data = None if isinstance(row, ValueError) else row
+            rejects.write(json.dumps({'row': row_number, 'error': error, 'data': data}, default=str) + '\n')
+        rejects.flush()
+        progress['imported'] += imported
+        progress['existing'] += existing
+        progress['rejected'] += len(rejected)
+        self.stdout.write(f"Row {chunk[-1][0]}: {progress['imported']} imported, {progress['rejected']} rejected.")
+
+    def validate_and_insert(self, chunk, options):
+        rejected = []
+        parsed = []
+        seen = set()
+        for row_number, row in chunk:
+            try:
+                number, user, balance = self.parse(row)
+            except ValueError as e:
+                rejected.append((row_number, row, str(e)))
+                continue
+            if number in seen:
+                rejected.append((row_number, row, "Duplicate account_number in the file."))
+                continue
+            seen.add(number)
+            parsed.append((row_number, row, number, user, balance))
+
+        users = self.resolve_users({user for *_, user, _ in parsed}, options['create_users'])
+        # One lookup per chunk through the hashed account number index
+        existing = {
+            number: (user_id, opening_balance)
+            for number, user_id, opening_balance in Account.objects.filter(
+                account_number_hash__in=[hash_account_number(number) for _, _, number, _, _ in parsed]
+            ).values_list('account_number', 'user_id', 'opening_balance')
+        }
+
+        accounts = []
+        already = 0
+        for row_number, row, number, user, balance in parsed:
+            user_id = users.get(user)
+            if user_id is None:
+                rejected.append((row_number, row, "No such user."))
+            elif number in existing:
+                # Rows committed just before an interrupted checkpoint come back identical
+                if existing[number] == (user_id, balance):
+                    already += 1
+                else:
+                    rejected.append((row_number, row, "An account with this number already exists."))
+            else:
+                accounts.append(Account(user_id=user_id, account_number=number, balance=balance, opening_balance=balance))
+        Account.objects.bulk_create(accounts, batch_size=1000)
+        rejected.sort(key=lambda reject: reject[0])
+        return len(accounts), already, rejected
+
+    def resolve_users(self, references, create):
+        """Map ('username', name) / ('pk', id) references to user ids."""
+        names = {value for kind, value in references if kind == 'username'}
+        ids = {value for kind, value in references if kind == 'pk'}
+        users = {('username', name): pk for pk, name in User.objects.filter(username__in=names).values_list('pk', 'username')}
+        users.update({('pk', pk): pk for pk in User.objects.filter(pk__in=ids).values_list('pk', flat=True)})
+        missing = [name for name in names if ('username', name) not in users]
+        if create and missing:
+            User.objects.bulk_create([User(username=name, password=make_password(None)) for name in missing], batch_size=1000)
+            users.update({
+                ('username', name): pk
+                for pk, name in User.objects.filter(username__in=missing).values_list('pk', 'username')
+            })
+        return users
+
+    def save_progress(self, checkpoint_path, progress, offset, row_number, rejects):
+        progress.update(offset=offset, rows=row_number, rejects_size=os.fstat(rejects.fileno()).st_size)
+        temp_path = f'{checkpoint_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(progress, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, checkpoint_path)
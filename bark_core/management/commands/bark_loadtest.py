@@ -0,0 +1,106 @@
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive one endpoint on one or more running servers with N concurrent keep-alive "
+        "connections and report throughput and latency percentiles as JSON, e.g. "
+        "--target waitress=http://127.0.0.1:8000 --target asgi=http://127.0.0.1:8001"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', required=True, help="name=base_url of a running server.")
+        parser.add_argument('--path', default='/api/accounts/', help="Endpoint path to request.")
+        parser.add_argument('--method', default='GET')
+        parser.add_argument('--body', default=None, help="JSON request body.")
+        parser.add_argument('--token', required=True, help="Bearer token to authenticate with.")
+        parser.add_argument('--concurrency', type=int, default=32, help="Concurrent connections.")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run against each target.")
+
+    def handle(self, *args, **options):
+        results = {}
+        for target in options['target']:
+            name, sep, base_url = target.partition('=')
+            if not sep:
+                raise CommandError(f"--target must look like name=http://host:port, got {target!r}")
+            results[name] = self.run_target(base_url, options)
+        self.stdout.write(json.dumps({
+            'path': options['path'],
+            'method': options['method'],
+            'concurrency': options['concurrency'],
+            'duration': options['duration'],
+            'results': results,
+        }, indent=2))
+
+    def run_target(self, base_url, options):
+        url = urlsplit(base_url)
+        headers = {'Authorization': f"Bearer {options['token']}", 'Accept': 'application/json'}
+        body = None
+        if options['body'] is not None:
+            body = options['body'].encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        latencies = []
+        statuses = {}
+        errors = [0]
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['duration']
+
+        def worker():
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            local_latencies = []
+            local_statuses = {}
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    conn.request(options['method'], options['path'], body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    with lock:
+                        errors[0] += 1
+                    conn.close()
+                    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+                    continue
+                local_latencies.append(time.perf_counter() - started)
+                local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+            conn.close()
+            with lock:
+                latencies.extend(local_latencies)
+                for code, count in local_statuses.items():
+                    statuses[code] = statuses.get(code, 0) + count
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        to_ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+        return {
+            'requests': len(latencies),
+            'errors': errors[0],
+            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+            'requests_per_sec': round(len(latencies) / elapsed, 1),
+            'p50_ms': to_ms(percentile(latencies, 50)),
+            'p95_ms': to_ms(percentile(latencies, 95)),
+            'p99_ms': to_ms(percentile(latencies, 99)),
+            'mean_ms': to_ms(statistics.fmean(latencies)) if latencies else None,
+        }
@@ -0,0 +1,29 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from bark_core.docs import generate_schema
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the OpenAPI schema behind / and /redoc/ and write it to a file, by default "
+        "BARK_OPENAPI_SCHEMA_FILE. Run it at build time so workers serve the file instead of "
+        "generating the schema on their first docs request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help="Where to write the schema (default: BARK_OPENAPI_SCHEMA_FILE).")
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'BARK_OPENAPI_SCHEMA_FILE', '')
+        if not path:
+            raise CommandError("Pass a path or set BARK_OPENAPI_SCHEMA_FILE.")
+        body = generate_schema()
+        # Workers may be reading the old file; swap the new one in whole
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        os.replace(temp_path, path)
+        self.stdout.write(self.style.SUCCESS(f"Wrote the OpenAPI schema ({len(body)} bytes) to {path}."))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+
+from bark_core.engine import is_retryable, post_queued_transfers
+from bark_core.models import QueuedTransfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Post queued transfers in batches: each batch is validated in order, netted "
+        "per account and committed in one transaction. Run one or more of these alongside "
+        "the web workers when transfers are queued."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Queued transfers posted per transaction.")
+        parser.add_argument('--idle-sleep', type=float, default=0.2, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue and exit.")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                try:
+                    batch = post_queued_transfers(options['batch_size'])
+                except OperationalError as e:
+                    # Out of retries under heavy contention; nothing was posted, so try again
+                    if not is_retryable(e):
+                        raise
+                    self.stderr.write(f"Posting failed, retrying: {e}")
+                    time.sleep(options['idle_sleep'])
+                    continue
+                if batch:
+                    posted = sum(1 for item in batch if item.status == QueuedTransfer.POSTED)
+                    self.stdout.write(f"Posted {posted}/{len(batch)} queued transfers.")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bark_core.ledger import journal_transfers
+from bark_core.models import Account, Transfer, LedgerEntry, BalanceCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the ledger journal by replaying every transfer from each account's "
+        "opening balance. Use once to backfill history that predates the journal."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Transfers replayed per chunk.")
+        parser.add_argument('--force', action='store_true', help="Discard an existing journal and rebuild it.")
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        if LedgerEntry.objects.exists() and not options['force']:
+            raise CommandError("The ledger already has entries. Pass --force to discard and rebuild it.")
+
+        # Lock every account so no transfer is posted while we replay
+        states = {
+            pk: [0, opening_balance]
+            for pk, opening_balance in Account.objects.select_for_update().values_list('pk', 'opening_balance')
+        }
+        # Replayed credits all carry a running balance, so nothing may be left in stripes
+        for account_id in Account.objects.filter(stripe_count__gt=0).values_list('pk', flat=True):
+            Account.objects.fold_stripes(account_id)
+        LedgerEntry.objects.all().delete()
+        BalanceCheckpoint.objects.all().delete()
+
+        chunk = []
+        replayed = 0
+        for transfer in Transfer.objects.order_by('timestamp', 'id').iterator(chunk_size=options['chunk_size']):
+            chunk.append(transfer)
+            if len(chunk) >= options['chunk_size']:
+                journal_transfers(chunk, states)
+                replayed += len(chunk)
+                chunk = []
+        if chunk:
+            journal_transfers(chunk, states)
+            replayed += len(chunk)
+
+        accounts = list(Account.objects.only('pk', 'balance'))
+        for account in accounts:
+            account.ledger_sequence = states[account.pk][0]
+        Account.objects.bulk_update(accounts, ['ledger_sequence'], batch_size=1000)
+
+        drifted = sum(1 for account in accounts if account.balance != states[account.pk][1])
+        self.stdout.write(self.style.SUCCESS(f"Replayed {replayed} transfers into {replayed * 2} ledger entries."))
+        if drifted:
+            self.stdout.write(self.style.WARNING(f"{drifted} accounts have a balance that differs from their replayed ledger."))
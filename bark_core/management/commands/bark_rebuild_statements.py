@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+from bark_core.models import Account, Transfer, MonthlyStatement, StatementStripe
+from bark_core.statements import month_of
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the monthly statement rollups from the transfer history, a chunk of "
+        "accounts at a time. Use once to backfill history that predates the rollups."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Accounts rebuilt per transaction.")
+
+    def handle(self, *args, **options):
+        account_ids = list(Account.objects.order_by('pk').values_list('pk', flat=True))
+        rows = 0
+        for start in range(0, len(account_ids), options['chunk_size']):
+            rows += self.rebuild_chunk(account_ids[start:start + options['chunk_size']])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} monthly statements for {len(account_ids)} accounts."))
+
+    @transaction.atomic
+    def rebuild_chunk(self, account_ids):
+        # Hold the accounts so no transfer touching them is posted mid-rebuild
+        list(Account.objects.select_for_update().filter(pk__in=account_ids).order_by('pk').values_list('pk'))
+        MonthlyStatement.objects.filter(account_id__in=account_ids).delete()
+        # Striped credits not yet folded are counted from their transfers too
+        StatementStripe.objects.filter(account_id__in=account_ids).delete()
+
+        statements = {}
+        for direction, total_field, count_field in (('from_account', 'sent_total', 'sent_count'),
+                                                    ('to_account', 'received_total', 'received_count')):
+            grouped = (
+                Transfer.objects
+                .filter(**{f'{direction}__in': account_ids})
+                .annotate(month=TruncMonth('timestamp'))
+                .values_list(direction, 'month')
+                .annotate(total=Sum('amount'), count=Count('id'))
+                .order_by()
+            )
+            for account_id, month, total, count in grouped:
+                month = month_of(month)
+                statement = statements.get((account_id, month))
+                if statement is None:
+                    statement = statements[account_id, month] = MonthlyStatement(account_id=account_id, month=month)
+                setattr(statement, total_field, getattr(statement, total_field) + total)
+                setattr(statement, count_field, getattr(statement, count_field) + count)
+        MonthlyStatement.objects.bulk_create(statements.values(), batch_size=1000)
+        return len(statements)
@@ -0,0 +1,51 @@
+import json
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from bark_core.reconcile import DEFAULT_OVERLAP, reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        "Check every account's balance against its opening balance and transfers, and that "
+        "no money was created or lost, then write a JSON report of drifted accounts. After "
+        "the first run only accounts touched since the previous run are checked, unless "
+        "--full is given. Exits non-zero when anything drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Check every account, not just those touched since the last run.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes (default: one per CPU).")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Accounts checked per query.")
+        parser.add_argument(
+            '--overlap', type=float, default=DEFAULT_OVERLAP.total_seconds(),
+            help="Seconds before the last run's start to look back from, for transactions still in flight then.",
+        )
+        parser.add_argument('--output', help="Write the report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1.")
+        report = reconcile(
+            full=options['full'],
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            overlap=timedelta(seconds=options['overlap']),
+        )
+        body = json.dumps(report, cls=DjangoJSONEncoder, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(body + '\n')
+        else:
+            self.stdout.write(body)
+
+        kind = 'full' if report['full'] else 'incremental'
+        summary = f"Checked {report['accounts_checked']} accounts ({kind}), {report['drifted_count']} drifted."
+        if report['drifted_count'] or not report['money_conserved']:
+            if not report['money_conserved']:
+                summary += f" Total balances differ from opening balances by {report['total_difference']}."
+            raise CommandError(summary)
+        self.stderr.write(self.style.SUCCESS(summary))
@@ -0,0 +1,45 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the SQLite primary into each SQLite replica in BARK_SQLITE_REPLICAS with the "
+        "online backup API. Run it with --every to mimic replication lag when trying out "
+        "replica routing locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None, help="Keep copying every this many seconds.")
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        aliases = getattr(settings, 'BARK_DB_REPLICAS', [])
+        if not aliases:
+            raise CommandError("No replicas are configured (set BARK_SQLITE_REPLICAS).")
+        for alias in [DEFAULT_DB_ALIAS, *aliases]:
+            if settings.DATABASES[alias]['ENGINE'] != 'django.db.backends.sqlite3':
+                raise CommandError(f"{alias} isn't a SQLite database; replicate it with the database's own tools.")
+
+        try:
+            while True:
+                source = sqlite3.connect(primary['NAME'])
+                try:
+                    for alias in aliases:
+                        target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                        try:
+                            source.backup(target)
+                        finally:
+                            target.close()
+                finally:
+                    source.close()
+                self.stdout.write(f"Copied the primary to {', '.join(aliases)}.")
+                if options['every'] is None:
+                    break
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
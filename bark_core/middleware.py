@@ -0,0 +1,196 @@
+# bark_core/middleware.py
+"""
+Per-request timing: SQL count and time, view time and render time.
+
+Sampled requests (BARK_REQUEST_TIMING_SAMPLE_RATE) made by staff get a
+Server-Timing header, e.g.
+
+    Server-Timing: db;dur=4.2;desc="7 queries", view;dur=9.8, render;dur=1.1, total;dur=12.0
+
+`view` is the time spent in the view (including the SQL it ran, and the
+serializers its response data came from), `render` the time spent rendering
+the response body and `total` the whole trip through the middleware stack.
+BARK_SERVER_TIMING_PUBLIC sends the header to everyone.
+
+Every request slower than BARK_SLOW_REQUEST_MS is logged as one JSON line.
+For a sampled request the line also has the view and render times and the
+slowest and most repeated SQL statements; otherwise it has the total and the
+query count and time.
+
+Queries are recorded by an execute wrapper installed on every database
+connection. It finds the current request through a context variable, so it
+also sees queries an async view runs in sync_to_async worker threads.
+"""
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+logger = logging.getLogger(__name__)
+
+# Statements kept per request for the slow log; beyond this they are only counted
+MAX_RECORDED_STATEMENTS = 1000
+# Statements listed in each section of a slow-request log line
+SLOW_LOG_STATEMENTS = 10
+
+current_timing = ContextVar('bark_request_timing', default=None)
+
+
+class RequestTiming:
+    def __init__(self, sampled):
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = []  # (seconds, sql)
+        self.view_started = None
+        self.view_time = None
+        self.render_started = None
+        self.render_time = None
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+        if self.sampled and len(self.statements) < MAX_RECORDED_STATEMENTS:
+            self.statements.append((duration, sql))
+
+    def rendered(self, response):
+        self.render_time = time.perf_counter() - self.render_started
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper counting and timing queries for the current request."""
+    timing = current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver; wrappers survive reconnects, so add it once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def to_ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+class RequestTimingMiddleware:
+    """Keep this first in MIDDLEWARE so `total` covers the whole stack."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'BARK_REQUEST_TIMING', True):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'BARK_REQUEST_TIMING_SAMPLE_RATE', 1.0)
+        self.slow_request_ms = getattr(settings, 'BARK_SLOW_REQUEST_MS', 500)
+        self.public = getattr(settings, 'BARK_SERVER_TIMING_PUBLIC', False)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Async hooks, so the handler doesn't push them onto a worker thread
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timing = RequestTiming(random.random() < self.sample_rate)
+        reset_token = current_timing.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(reset_token)
+        self.finish(request, response, timing)
+        return response
+
+    async def __acall__(self, request):
+        timing = RequestTiming(random.random() < self.sample_rate)
+        reset_token = current_timing.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(reset_token)
+        self.finish(request, response, timing)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timing = current_timing.get()
+        if timing is not None and timing.sampled:
+            timing.view_started = time.perf_counter()
+        return None
+
+    def process_template_response(self, request, response):
+        # Called as soon as the view returns and right before the response is rendered
+        timing = current_timing.get()
+        if timing is not None and timing.view_started is not None:
+            timing.render_started = time.perf_counter()
+            timing.view_time = timing.render_started - timing.view_started
+            response.add_post_render_callback(timing.rendered)
+        return response
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        return RequestTimingMiddleware.process_view(self, request, view_func, view_args, view_kwargs)
+
+    async def aprocess_template_response(self, request, response):
+        return RequestTimingMiddleware.process_template_response(self, request, response)
+
+    def finish(self, request, response, timing):
+        total = time.perf_counter() - timing.started
+        if timing.view_time is None and timing.view_started is not None:
+            # Plain (non-template) responses are finished when the view returns
+            timing.view_time = total - (timing.view_started - timing.started)
+
+        if timing.sampled and self.show_server_timing(request):
+            metrics = [f'db;dur={to_ms(timing.sql_time)};desc="{timing.queries} queries"']
+            if timing.view_time is not None:
+                metrics.append(f'view;dur={to_ms(timing.view_time)}')
+            if timing.render_time is not None:
+                metrics.append(f'render;dur={to_ms(timing.render_time)}')
+            metrics.append(f'total;dur={to_ms(total)}')
+            response['Server-Timing'] = ', '.join(metrics)
+
+        if to_ms(total) >= self.slow_request_ms:
+            self.log_slow_request(request, response, timing, total)
+
+    def show_server_timing(self, request):
+        """Timings and query counts help profile the service, so only staff see them by default."""
+        if self.public:
+            return True
+        # DRF sets the user it authenticates on the underlying request too
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def log_slow_request(self, request, response, timing, total):
+        user = getattr(request, 'user', None)
+        slowest = sorted(timing.statements, key=lambda statement: statement[0], reverse=True)
+        repeated = Counter(sql for _, sql in timing.statements).most_common(SLOW_LOG_STATEMENTS)
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'sampled': timing.sampled,
+            'total_ms': to_ms(total),
+            'view_ms': to_ms(timing.view_time) if timing.view_time is not None else None,
+            'render_ms': to_ms(timing.render_time) if timing.render_time is not None else None,
+            'db_ms': to_ms(timing.sql_time),
+            'queries': timing.queries,
+            # Statements are logged without their parameters, which hold customer data
+            'slowest_sql': [{'ms': to_ms(duration), 'sql': sql} for duration, sql in slowest[:SLOW_LOG_STATEMENTS]],
+            'repeated_sql': [{'count': count, 'sql': sql} for sql, count in repeated if count > 1],
+        }))
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0008_remove_account_bark_core_a_user_id_23b0da_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='bark_core_a_user_id_3c45db_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['-timestamp', '-id'], name='bark_core_t_timesta_29a685_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_opening_balances(apps, schema_editor):
+    """
+    Derive each account's opening balance from its transfers and anchor the
+    journal with a sequence-0 checkpoint at the current balance.
+    """
+    Account = apps.get_model('bark_core', 'Account')
+    Transfer = apps.get_model('bark_core', 'Transfer')
+    BalanceCheckpoint = apps.get_model('bark_core', 'BalanceCheckpoint')
+
+    sent = dict(Transfer.objects.values('from_account').annotate(total=models.Sum('amount')).values_list('from_account', 'total'))
+    received = dict(Transfer.objects.values('to_account').annotate(total=models.Sum('amount')).values_list('to_account', 'total'))
+    now = django.utils.timezone.now()
+    checkpoints = []
+    for account in Account.objects.only('pk', 'balance').iterator(chunk_size=2000):
+        account.opening_balance = account.balance - received.get(account.pk, 0) + sent.get(account.pk, 0)
+        account.save(update_fields=['opening_balance'])
+        checkpoints.append(BalanceCheckpoint(account_id=account.pk, sequence=0, balance=account.balance, timestamp=now))
+    BalanceCheckpoint.objects.bulk_create(checkpoints, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0009_account_bark_core_a_user_id_3c45db_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='ledger_sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='opening_balance',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=19),
+        ),
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.BigIntegerField()),
+                ('balance', models.DecimalField(decimal_places=4, max_digits=19)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='balance_checkpoints', to='bark_core.account')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', '-timestamp', '-sequence'], name='bark_core_b_account_7089c6_idx')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'sequence'), name='unique_checkpoint_sequence')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.BigIntegerField()),
+                ('amount', models.DecimalField(decimal_places=4, max_digits=19)),
+                ('balance_after', models.DecimalField(decimal_places=4, max_digits=19)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='bark_core.account')),
+                ('transfer', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='bark_core.transfer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', '-timestamp', '-sequence'], name='bark_core_l_account_a5eecb_idx')],
+                'constraints': [models.UniqueConstraint(fields=('account', 'sequence'), name='unique_ledger_sequence')],
+            },
+        ),
+        migrations.RunPython(backfill_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:40
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def populate_account_number_hashes(apps, schema_editor):
+    Account = apps.get_model('bark_core', 'Account')
+    accounts = []
+    for account in Account.objects.only('pk', 'account_number').iterator(chunk_size=2000):
+        account.account_number_hash = hashlib.sha256(account.account_number.encode('utf-8')).hexdigest()
+        accounts.append(account)
+    Account.objects.bulk_update(accounts, ['account_number_hash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0011_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='account_number_hash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_account_number_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0012_account_number_hash'),
+    ]
+
+    # Build the new indexes before dropping the ones they replace
+    operations = [
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['from_account', '-timestamp', '-id'], name='bark_core_t_from_ac_b7d951_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transfer',
+            index=models.Index(fields=['to_account', '-timestamp', '-id'], name='bark_core_t_to_acco_26e4a5_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='transfer',
+            name='bark_core_t_from_ac_1003be_idx',
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='from_account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='transfers_sent', to='bark_core.account'),
+        ),
+        migrations.AlterField(
+            model_name='transfer',
+            name='to_account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='transfers_received', to='bark_core.account'),
+        ),
+    ]
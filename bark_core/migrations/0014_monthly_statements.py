@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0013_transfer_direction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('sent_total', models.DecimalField(decimal_places=4, default=0, max_digits=19)),
+                ('sent_count', models.IntegerField(default=0)),
+                ('received_total', models.DecimalField(decimal_places=4, default=0, max_digits=19)),
+                ('received_count', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_statements', to='bark_core.account')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'month'), name='unique_statement_month')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0016_queuedtransfer'),
+    ]
+
+    # Build the partial ledger indexes before dropping the full one they replace
+    operations = [
+        migrations.CreateModel(
+            name='BalanceStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('balance', models.DecimalField(decimal_places=4, default=0, max_digits=19)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='stripe_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='balance_after',
+            field=models.DecimalField(decimal_places=4, max_digits=19, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='sequence',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(condition=models.Q(('balance_after__isnull', False)), fields=['account', '-timestamp', '-sequence'], name='ledger_entry_balance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(condition=models.Q(('balance_after__isnull', True)), fields=['account', 'timestamp'], name='ledger_striped_credit_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='ledgerentry',
+            name='bark_core_l_account_a5eecb_idx',
+        ),
+        migrations.AddField(
+            model_name='balancestripe',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='bark_core.account'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancestripe',
+            constraint=models.UniqueConstraint(fields=('account', 'index'), name='unique_balance_stripe'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:21
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0017_hot_account_stripes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reconciliation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('full', models.BooleanField(default=False)),
+                ('accounts_checked', models.IntegerField(default=0)),
+                ('drifted_accounts', models.JSONField(default=list)),
+                ('total_difference', models.DecimalField(decimal_places=4, default=0, max_digits=19)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-started_at'], name='bark_core_r_started_345cb5_idx')],
+            },
+        ),
+    ]
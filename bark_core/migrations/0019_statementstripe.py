@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0018_reconciliation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatementStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('index', models.PositiveSmallIntegerField()),
+                ('received_total', models.DecimalField(decimal_places=4, default=0, max_digits=19)),
+                ('received_count', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='statement_stripes', to='bark_core.account')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'month', 'index'), name='unique_statement_stripe')],
+            },
+        ),
+    ]
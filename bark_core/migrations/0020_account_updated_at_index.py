@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bark_core', '0019_statementstripe'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['updated_at'], name='bark_core_a_updated_0b3e04_idx'),
+        ),
+    ]
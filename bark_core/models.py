@@ -1,50 +1,375 @@
 # bark_core/models.py
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from decimal import Decimal
+import random
 from django.utils import timezone
+from functools import partial
+
+from .cache import balance_cache, account_number_cache
+from .utils import hash_account_number
+
+class AccountQuerySet(models.QuerySet):
+    def _invalidate_on_commit(self, account_ids):
+        """Drop cached balances once the change is committed."""
+        transaction.on_commit(partial(balance_cache.invalidate, list(account_ids)), using=self.db)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for account in objs:
+            account.account_number_hash = hash_account_number(account.account_number)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def resolve_numbers(self, account_numbers):
+        """
+        Return {account_number: Account} for the numbers that exist, in one
+        query on this queryset (so a select_for_update() queryset locks the
+        rows in id order). Ids remembered from earlier lookups are fetched by
+        primary key, the rest through the hashed account number index.
+        """
+        hashes = {hash_account_number(number): number for number in set(account_numbers)}
+        cached = account_number_cache.get_many(hashes)
+        lookup = Q(pk__in=cached.values()) | Q(account_number_hash__in=[h for h in hashes if h not in cached])
+        accounts = {}
+        for account in self.filter(lookup).order_by('pk'):
+            # A cached id whose number has since changed no longer matches
+            if account.account_number_hash in hashes:
+                accounts[account.account_number] = account
+
+        stale = [h for h in cached if hashes[h] not in accounts]
+        if stale:
+            account_number_cache.discard(stale)
+            for account in self.filter(account_number_hash__in=stale).order_by('pk'):
+                accounts[account.account_number] = account
+        account_number_cache.set_many({account.account_number_hash: account.pk for account in accounts.values()})
+        return accounts
+
+    def balance_unchanged(self, account_id, ledger_sequence, user_id):
+        """
+        Whether a balance read at ledger_sequence is still the account's
+        balance on the primary, and the account still belongs to user_id:
+        one primary key lookup. An owner change doesn't bump the sequence,
+        so it is checked too. Hot accounts never match, since striped
+        credits leave the row alone.
+        """
+        return self._balance_unchanged(account_id, ledger_sequence, user_id).exists()
+
+    async def abalance_unchanged(self, account_id, ledger_sequence, user_id):
+        return await self._balance_unchanged(account_id, ledger_sequence, user_id).aexists()
+
+    def _balance_unchanged(self, account_id, ledger_sequence, user_id):
+        return self.using(DEFAULT_DB_ALIAS).filter(
+            pk=account_id, ledger_sequence=ledger_sequence, user_id=user_id, stripe_count=0,
+        )
+
+    def with_striped_balance(self):
+        """
+        Annotate striped_balance, the credits a hot account holds in its
+        stripes. It is read in the same statement as balance, so a concurrent
+        fold can't make the two disagree.
+        """
+        stripes = (
+            BalanceStripe.objects.filter(account=OuterRef('pk'))
+            .values('account').annotate(total=Sum('balance')).values('total')
+        )
+        return self.annotate(striped_balance=Coalesce(
+            Subquery(stripes), Value(Decimal(0)), output_field=models.DecimalField(max_digits=19, decimal_places=4),
+        ))
+
+    def with_last_transfer(self):
+        """
+        Annotate last_sent_at and last_received_at, the timestamps of the
+        account's newest transfers. Each is one seek on a direction index.
+        """
+        def newest(field):
+            return Subquery(
+                Transfer.objects.filter(**{field: OuterRef('pk')}).order_by('-timestamp', '-id').values('timestamp')[:1]
+            )
+        return self.annotate(last_sent_at=newest('from_account'), last_received_at=newest('to_account'))
+
+    def lock(self, account_ids):
+        """Take the row locks of the given accounts in ascending id order."""
+        list(self.select_for_update().filter(pk__in=account_ids).order_by('pk').values_list('pk', flat=True))
+
+    def debit(self, account_id, amount):
+        """
+        Conditionally subtract amount from an account's balance in one UPDATE.
+        Returns False (and changes nothing) if the balance is insufficient.
+        """
+        updated = self.filter(pk=account_id, balance__gte=amount).update(
+            balance=F('balance') - amount,
+            ledger_sequence=F('ledger_sequence') + 1,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            self._invalidate_on_commit([account_id])
+        return updated == 1
+
+    def credit(self, account_id, amount):
+        """Add amount to an account's balance in one UPDATE."""
+        updated = self.filter(pk=account_id).update(
+            balance=F('balance') + amount,
+            ledger_sequence=F('ledger_sequence') + 1,
+            updated_at=timezone.now(),
+        )
+        if updated:
+            self._invalidate_on_commit([account_id])
+        return updated == 1
+
+    def credit_stripe(self, account, amount):
+        """
+        Add amount to a randomly chosen stripe of a hot account, leaving the
+        account row alone. Returns False if the stripe is gone because hot
+        mode was switched off or resized in the meantime.
+        """
+        updated = BalanceStripe.objects.filter(
+            account_id=account.pk, index=random.randrange(account.stripe_count),
+        ).update(balance=F('balance') + amount)
+        if updated:
+            self._invalidate_on_commit([account.pk])
+        return updated == 1
+
+    def fold_stripes(self, account_id):
+        """
+        Move a hot account's stripes into its balance and its statement
+        stripes into its statements, and write a BalanceCheckpoint. The
+        caller must hold the account row; rows are always locked before
+        stripes. Returns the amount folded.
+        """
+        stripes = list(
+            BalanceStripe.objects.select_for_update().filter(account_id=account_id)
+            .order_by('index').values_list('pk', 'balance')
+        )
+        stripes = [(pk, balance) for pk, balance in stripes if balance]
+        total = sum(balance for _, balance in stripes)
+        if not total:
+            return Decimal(0)
+        from .statements import fold_statement_stripes
+        fold_statement_stripes(account_id)
+        BalanceStripe.objects.filter(pk__in=[pk for pk, _ in stripes]).update(balance=F('balance') - Case(
+            *[When(pk=pk, then=Value(balance)) for pk, balance in stripes],
+            output_field=models.DecimalField(max_digits=19, decimal_places=4),
+        ))
+        now = timezone.now()
+        self.filter(pk=account_id).update(
+            balance=F('balance') + total,
+            ledger_sequence=F('ledger_sequence') + 1,
+            updated_at=now,
+        )
+        # Striped credits are journaled without a running balance; this anchors them
+        sequence, balance = self.filter(pk=account_id).values_list('ledger_sequence', 'balance').get()
+        BalanceCheckpoint.objects.create(account_id=account_id, sequence=sequence, balance=balance, timestamp=now)
+        return total
+
+    def set_stripe_count(self, account_id, count):
+        """
+        Turn hot-account mode on with count stripes, or off with 0. Must run
+        inside a transaction.
+        """
+        self.lock([account_id])
+        self.fold_stripes(account_id)
+        BalanceStripe.objects.filter(account_id=account_id, index__gte=count).delete()
+        BalanceStripe.objects.bulk_create(
+            [BalanceStripe(account_id=account_id, index=index) for index in range(count)], ignore_conflicts=True,
+        )
+        self.filter(pk=account_id).update(stripe_count=count)
+
+    def apply_deltas(self, deltas, entry_counts, chunk_size=500):
+        """
+        Add a signed amount to each account in {account_id: delta} and advance
+        its ledger sequence by {account_id: entries}, using one CASE update
+        per chunk. Callers must hold the rows and have checked that no
+        balance goes negative.
+        """
+        account_ids = list(entry_counts)
+        now = timezone.now()
+        for start in range(0, len(account_ids), chunk_size):
+            chunk = account_ids[start:start + chunk_size]
+            self.filter(pk__in=chunk).update(
+                balance=F('balance') + Case(
+                    *[When(pk=pk, then=Value(deltas.get(pk, 0))) for pk in chunk],
+                    output_field=models.DecimalField(max_digits=19, decimal_places=4),
+                ),
+                ledger_sequence=F('ledger_sequence') + Case(
+                    *[When(pk=pk, then=Value(entry_counts[pk])) for pk in chunk],
+                    output_field=models.BigIntegerField(),
+                ),
+                updated_at=now,
+            )
+        self._invalidate_on_commit(account_ids)
 
 class Account(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     account_number = models.CharField(max_length=16, unique=True)
+    account_number_hash = models.CharField(max_length=64, db_index=True, editable=False)  # sha256 of account_number
     balance = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+    opening_balance = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+    ledger_sequence = models.BigIntegerField(default=0)  # Number of balance changes so far
+    stripe_count = models.PositiveSmallIntegerField(default=0)  # Hot-account credit stripes, 0 when off
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = AccountQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves the keyset-paginated account list for a user
+            models.Index(fields=['user', '-created_at', '-id']),
+            # Serves the incremental reconciliation's look for rows changed since the last run
+            models.Index(fields=['updated_at']),
+        ]
+
     def __str__(self):
         return f"Account {self.account_number[-4:]} - {self.user.username}"
 
+    def save(self, *args, **kwargs):
+        self.account_number_hash = hash_account_number(self.account_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'account_number' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'account_number_hash'}
+        super().save(*args, **kwargs)
+
+    @property
+    def current_balance(self):
+        """The balance including credits still held in stripes (see with_striped_balance())."""
+        return self.balance + getattr(self, 'striped_balance', 0)
+
     def deposit(self, amount):
         """Add the given amount to the account's balance."""
         if amount <= 0:
             raise ValidationError("Deposit amount must be positive")
-        self.balance += Decimal(amount)
-        self.save(update_fields=['balance', 'updated_at'])
+        Account.objects.credit(self.pk, Decimal(amount))
+        self.refresh_from_db(fields=['balance', 'updated_at'])
 
     def withdraw(self, amount):
         """Subtract the given amount from the account's balance."""
         if amount <= 0:
             raise ValidationError("Withdrawal amount must be positive")
-        if self.balance < amount:
-            raise ValidationError("Insufficient funds")
-        self.balance -= Decimal(amount)
-        self.save(update_fields=['balance', 'updated_at'])
+        with transaction.atomic():
+            if self.stripe_count:
+                # Credits still in stripes count towards the funds available
+                Account.objects.lock([self.pk])
+                Account.objects.fold_stripes(self.pk)
+            if not Account.objects.debit(self.pk, Decimal(amount)):
+                raise ValidationError("Insufficient funds")
+        self.refresh_from_db(fields=['balance', 'updated_at'])
 
     @classmethod
     def verify_account_number(cls, account_number):
         """Verify if an account exists by account number."""
-        return cls.objects.filter(account_number=account_number).first()
+        return cls.objects.resolve_numbers([account_number]).get(account_number)
+
+class BalanceStripe(models.Model):
+    """
+    One slice of a hot account's balance. Credits to an account in hot mode
+    land on a random stripe instead of the account row, so concurrent credits
+    don't all queue for the same row lock. Stripes are folded into
+    Account.balance periodically and before every debit.
+    """
+    # The unique constraint leads with account, so no separate FK index
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='stripes', db_index=False)
+    index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'index'], name='unique_balance_stripe'),
+        ]
+
+    def __str__(self):
+        return f"Stripe {self.index} of Account {self.account_id}: {self.balance}"
+
+class AccountHistory:
+    """
+    Transfers sent or received by an account, built as a UNION of two scans
+    that each walk one direction's (account, -timestamp, -id) index.
+
+    An OR across from_account and to_account can't be served in order by
+    either index. Here filter() and order_by() apply to both scans, and a
+    [:limit] slice pushes the LIMIT into each of them, so a page reads at
+    most 2 * limit index entries. That is all keyset pagination needs.
+    """
+
+    def __init__(self, queryset, account_id, counterparty_id=None, fields=None):
+        self.queryset = queryset
+        self.account_id = account_id
+        self.counterparty_id = counterparty_id
+        self.fields = fields  # Set by values()
+        self.model = queryset.model
+
+    @property
+    def query(self):
+        return self.queryset.query
+
+    def filter(self, *args, **kwargs):
+        return AccountHistory(self.queryset.filter(*args, **kwargs), self.account_id, self.counterparty_id, self.fields)
+
+    def order_by(self, *fields):
+        return AccountHistory(self.queryset.order_by(*fields), self.account_id, self.counterparty_id, self.fields)
+
+    def values(self, *fields):
+        return AccountHistory(self.queryset.values(*fields), self.account_id, self.counterparty_id, fields)
+
+    def sides(self):
+        """The sent and received scans."""
+        sent = self.queryset.filter(from_account_id=self.account_id)
+        received = self.queryset.filter(to_account_id=self.account_id)
+        if self.counterparty_id is not None:
+            sent = sent.filter(to_account_id=self.counterparty_id)
+            received = received.filter(from_account_id=self.counterparty_id)
+        return sent, received
+
+    def __getitem__(self, k):
+        if not isinstance(k, slice) or k.start or k.step or k.stop is None:
+            raise TypeError("Account history only supports [:limit] slices.")
+        ordering = self.queryset.query.order_by
+        sent, received = self.sides()
+        if connections[self.queryset.db].features.supports_slicing_ordering_in_compound:
+            # (SELECT ... LIMIT n) UNION (SELECT ... LIMIT n) ORDER BY ... LIMIT n
+            return sent[:k.stop].union(received[:k.stop]).order_by(*ordering)[:k.stop]
+        # SQLite can't LIMIT the arms of a compound SELECT, but it can LIMIT an IN subquery
+        base = self.model._default_manager.using(self.queryset.db)
+        if self.fields is not None:
+            base = base.values(*self.fields)
+        return base.filter(pk__in=sent.values('pk')[:k.stop]).union(
+            base.filter(pk__in=received.values('pk')[:k.stop])
+        ).order_by(*ordering)[:k.stop]
+
+
+class TransferQuerySet(models.QuerySet):
+    def for_account(self, account_id, counterparty_id=None):
+        """Transfers sent or received by an account (optionally only with one counterparty), newest first."""
+        if counterparty_id is None:
+            condition = Q(from_account_id=account_id) | Q(to_account_id=account_id)
+        else:
+            condition = (Q(from_account_id=account_id, to_account_id=counterparty_id)
+                         | Q(from_account_id=counterparty_id, to_account_id=account_id))
+        return self.filter(condition).order_by('-timestamp', '-id')
+
+    def history(self, account_id, counterparty_id=None):
+        """Like for_account(), for paging through with index-ordered scans."""
+        return AccountHistory(self.order_by('-timestamp', '-id'), account_id, counterparty_id)
 
 class Transfer(models.Model):
-    from_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='transfers_sent')
-    to_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='transfers_received')
+    # The direction indexes below lead with each account, so no separate FK indexes
+    from_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='transfers_sent', db_index=False)
+    to_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='transfers_received', db_index=False)
     amount = models.DecimalField(max_digits=19, decimal_places=4)
     timestamp = models.DateTimeField(default=timezone.now)
 
+    objects = TransferQuerySet.as_manager()
+
     class Meta:
         indexes = [
-            models.Index(fields=['from_account', 'to_account', 'timestamp']),
+            # One per direction; each serves its half of an account's history in order
+            models.Index(fields=['from_account', '-timestamp', '-id']),
+            models.Index(fields=['to_account', '-timestamp', '-id']),
+            # Serves keyset pagination on (timestamp, id)
+            models.Index(fields=['-timestamp', '-id']),
         ]
 
     def __str__(self):
@@ -61,3 +386,183 @@ class Transfer(models.Model):
         """Validate the transfer before saving."""
         self.full_clean()
         super().save(*args, **kwargs)
+
+
+class LedgerEntry(models.Model):
+    """
+    One side of a transfer in the append-only journal. Debits carry a negative
+    amount, credits a positive one, and balance_after is the account's
+    running balance once the entry is applied. Credits to a stripe of a hot
+    account have neither a sequence nor a balance_after until a later entry
+    or checkpoint accounts for them.
+    """
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='ledger_entries')
+    transfer = models.ForeignKey(Transfer, on_delete=models.PROTECT, related_name='ledger_entries')
+    sequence = models.BigIntegerField(null=True)  # Per-account, gap-free while every change is journaled
+    amount = models.DecimalField(max_digits=19, decimal_places=4)
+    balance_after = models.DecimalField(max_digits=19, decimal_places=4, null=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Serves balance-as-of lookups with a single index seek
+            models.Index(
+                fields=['account', '-timestamp', '-sequence'], condition=Q(balance_after__isnull=False),
+                name='ledger_entry_balance_idx',
+            ),
+            # Striped credits, summed on top of the latest running balance
+            models.Index(
+                fields=['account', 'timestamp'], condition=Q(balance_after__isnull=True),
+                name='ledger_striped_credit_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'sequence'], name='unique_ledger_sequence'),
+        ]
+
+    def __str__(self):
+        return f"Ledger entry {self.sequence} for Account {self.account_id}: {self.amount}"
+
+class BalanceCheckpoint(models.Model):
+    """The balance of an account after a given ledger sequence number."""
+    account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='balance_checkpoints')
+    sequence = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=19, decimal_places=4)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', '-timestamp', '-sequence']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'sequence'], name='unique_checkpoint_sequence'),
+        ]
+
+    def __str__(self):
+        return f"Checkpoint {self.sequence} for Account {self.account_id}: {self.balance}"
+
+
+class MonthlyStatement(models.Model):
+    """Per-account totals of the transfers sent and received in one calendar month."""
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='monthly_statements')
+    month = models.DateField()  # First day of the month
+    sent_total = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+    sent_count = models.IntegerField(default=0)
+    received_total = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+    received_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Also serves listing an account's statements newest first
+            models.UniqueConstraint(fields=['account', 'month'], name='unique_statement_month'),
+        ]
+
+    def __str__(self):
+        return f"Statement {self.month:%Y-%m} for Account {self.account_id}"
+
+
+class StatementStripe(models.Model):
+    """
+    One slice of the received totals of a hot account's striped credits in
+    one month, not yet added to its MonthlyStatement. Like BalanceStripe, it
+    keeps concurrent deposits off a single row, and it is folded along with
+    the balance stripes.
+    """
+    # The unique constraint leads with account, so no separate FK index
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='statement_stripes', db_index=False)
+    month = models.DateField()  # First day of the month
+    index = models.PositiveSmallIntegerField()
+    received_total = models.DecimalField(max_digits=19, decimal_places=4, default=0)
+    received_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'month', 'index'], name='unique_statement_stripe'),
+        ]
+
+    def __str__(self):
+        return f"Statement stripe {self.index} for Account {self.account_id}, {self.month:%Y-%m}"
+
+
+class QueuedTransfer(models.Model):
+    """
+    A transfer accepted for later posting by bark_poster. The request has
+    been validated and authorized; funds are checked when it is posted.
+    """
+    PENDING = 'pending'
+    POSTED = 'posted'
+    REJECTED = 'rejected'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (POSTED, 'Posted'), (REJECTED, 'Rejected')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    from_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='+')
+    to_account = models.ForeignKey(Account, on_delete=models.PROTECT, related_name='+')
+    amount = models.DecimalField(max_digits=19, decimal_places=4)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING)
+    transfer = models.ForeignKey(Transfer, null=True, on_delete=models.CASCADE, related_name='+')
+    detail = models.CharField(max_length=255, blank=True)  # Why it was rejected
+    created_at = models.DateTimeField(default=timezone.now)
+    posted_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # Only pending rows are indexed, so draining the queue stays cheap as history grows
+            models.Index(fields=['id'], condition=Q(status='pending'), name='queued_transfer_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"Queued transfer {self.pk} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client's Idempotency-Key for a transfer request and the response it
+    produced. While the first request is still running status_code is null;
+    transfer is set inside the transfer's own transaction.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # sha256 of the request body
+    transfer = models.ForeignKey(Transfer, null=True, on_delete=models.CASCADE, related_name='+')
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for User {self.user_id}"
+
+
+class RevokedToken(models.Model):
+    """A signed bearer token revoked before its expiry."""
+    jti = models.CharField(max_length=32, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Revoked token {self.jti}"
+
+
+class Reconciliation(models.Model):
+    """
+    A finished bark_reconcile run. The started_at of the latest one is the
+    high-water mark the next incremental run checks from.
+    """
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(default=timezone.now)
+    full = models.BooleanField(default=False)  # Checked every account, not just those touched since the last run
+    accounts_checked = models.IntegerField(default=0)
+    drifted_accounts = models.JSONField(default=list)  # Ids rechecked by the next incremental run
+    total_difference = models.DecimalField(max_digits=19, decimal_places=4, default=0)  # Money created (+) or lost (-)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-started_at']),
+        ]
+
+    def __str__(self):
+        return f"Reconciliation {self.pk} ({len(self.drifted_accounts)} drifted)"
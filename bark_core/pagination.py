@@ -0,0 +1,199 @@
+# bark_core/pagination.py
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset (cursor) pagination.
+
+    The keyset is the queryset's ordering, e.g. ('-timestamp', '-id'), with the
+    primary key appended as a tie-breaker if it's missing. The cursor carries
+    the ordering values of the last row on the page, and the next page is
+    fetched with a WHERE on those values instead of an OFFSET, so every page
+    costs the same index range scan. No COUNT(*) is issued.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'BARK_MAX_PAGE_SIZE', 500)
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request)
+        if page_queryset is None:
+            return None
+        return self.set_page(list(page_queryset))
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Return the (unevaluated) queryset for the requested page, including
+        one extra row to learn whether there is a next page. Async callers
+        evaluate it themselves and pass the rows to set_page().
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        queryset, self.ordering = self.get_ordering(queryset)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.keyset_filter(position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, queryset):
+        """Return the queryset (ordered by a unique keyset) and its ordering."""
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not ordering or ordering[-1].lstrip('-') not in ('pk', 'id'):
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append('-pk' if descending or not ordering else 'pk')
+            queryset = queryset.order_by(*ordering)
+        return queryset, tuple(ordering)
+
+    def keyset_filter(self, position):
+        """
+        Build "row comes after position" for the ordering, e.g. for
+        ('-timestamp', '-id'): timestamp < t OR (timestamp = t AND id < i).
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def decode_cursor(self, request, model):
+        """
+        Return the position in the request's cursor, each value converted
+        by its ordering field of model, or None without a cursor. A cursor
+        that doesn't decode to values of those fields is a 404.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        values = []
+        for field, value in zip(self.ordering, position):
+            # encode_cursor() only writes strings and numbers; ordering fields are never null
+            if not isinstance(value, (str, int, float)):
+                raise NotFound(self.invalid_cursor_message)
+            name = field.lstrip('-')
+            model_field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            try:
+                values.append(model_field.to_python(value))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def encode_cursor(self, instance):
+        position = []
+        for field in self.ordering:
+            # Rows are model instances, or dicts for values() querysets
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        encoded = base64.urlsafe_b64encode(json.dumps(position, default=str).encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        return [
+            coreapi.Field(
+                name=self.cursor_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(
+                    title='Cursor',
+                    description='The pagination cursor value.'
+                )
+            ),
+            coreapi.Field(
+                name=self.page_size_query_param,
+                required=False,
+                location='query',
+                schema=coreschema.Integer(
+                    title='Page size',
+                    description=f'Number of results to return per page (at most {self.max_page_size}).'
+                )
+            ),
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Number of results to return per page (at most {self.max_page_size}).',
+                'schema': {'type': 'integer'},
+            },
+        ]
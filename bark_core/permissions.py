@@ -2,4 +2,4 @@ from rest_framework import permissions
 
 class IsAccountOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user
\ No newline at end of file
+        return obj.user_id == request.user.pk
\ No newline at end of file
@@ -0,0 +1,171 @@
+# bark_core/reconcile.py
+"""
+Ledger reconciliation for ``manage.py bark_reconcile``.
+
+An account is in balance when its balance plus the credits held in its
+stripes equals its opening balance plus everything it received less
+everything it sent. A chunk of accounts is checked with one statement that
+reads their balances and sums each account's transfers along both direction
+indexes. Only the sums come back. Being one statement, it reads one
+snapshot: a transfer that commits meanwhile is either wholly in it or not at
+all, so traffic can't show up as drift.
+
+Money is conserved when all balances and stripes add up to all opening
+balances, since a transfer only moves money between accounts. That is also
+one statement, over the whole table.
+
+A full run splits the accounts into id ranges and checks them on a process
+pool. An incremental run only checks the accounts that sent or received a
+transfer, or whose row changed, since the previous run started, plus those
+it found drifted. Timestamps are taken a little before their transaction
+commits, so it looks back a further overlap.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+from django.db import connections, models
+from django.db.models import ExpressionWrapper, Func, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Account, BalanceStripe, Reconciliation, Transfer
+
+AMOUNT_FIELD = models.DecimalField(max_digits=19, decimal_places=4)
+DEFAULT_OVERLAP = timedelta(minutes=5)
+
+
+def transfer_total(field):
+    """Sum of the amounts of the account's transfers with the account as field."""
+    totals = (
+        Transfer.objects.filter(**{field: OuterRef('pk')})
+        .values(field).annotate(total=Sum('amount')).values('total')
+    )
+    return Coalesce(Subquery(totals), Value(Decimal(0)), output_field=AMOUNT_FIELD)
+
+
+def check_accounts(lookup):
+    """
+    Check the accounts matching lookup (filter() keyword arguments). Returns
+    the number checked and a report for each drifted one.
+    """
+    rows = (
+        Account.objects.filter(**lookup).order_by('pk').with_striped_balance()
+        .annotate(sent=transfer_total('from_account'), received=transfer_total('to_account'))
+        .values_list('pk', 'user_id', 'opening_balance', 'balance', 'striped_balance', 'sent', 'received')
+    )
+    checked = 0
+    drifted = []
+    for account_id, user_id, opening_balance, balance, striped_balance, sent, received in rows.iterator(chunk_size=2000):
+        checked += 1
+        expected = opening_balance + received - sent
+        if balance + striped_balance != expected:
+            drifted.append({
+                'account_id': account_id,
+                'user_id': user_id,
+                'opening_balance': opening_balance,
+                'received': received,
+                'sent': sent,
+                'expected_balance': expected,
+                'balance': balance,
+                'striped_balance': striped_balance,
+                'difference': balance + striped_balance - expected,
+            })
+    return checked, drifted
+
+
+def total_difference():
+    """All balances and stripes less all opening balances; zero while money is conserved."""
+    # Func rather than Sum, so the stripe total stays a scalar subquery of the same statement
+    stripes = BalanceStripe.objects.order_by().values(total=Func('balance', function='SUM', output_field=AMOUNT_FIELD))
+    zero = Value(Decimal(0))
+    return Account.objects.order_by().aggregate(difference=ExpressionWrapper(
+        Coalesce(Sum('balance'), zero) - Coalesce(Sum('opening_balance'), zero) + Coalesce(Subquery(stripes), zero),
+        output_field=AMOUNT_FIELD,
+    ))['difference']
+
+
+def id_ranges(chunk_size):
+    """Lookups splitting every account into ranges of chunk_size ids."""
+    bounds = Account.objects.aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['low'] is None:
+        return []
+    return [
+        {'pk__gte': start, 'pk__lt': start + chunk_size}
+        for start in range(bounds['low'], bounds['high'] + 1, chunk_size)
+    ]
+
+
+def touched_since(since):
+    """Ids of the accounts whose row changed or that sent or received a transfer at or after since."""
+    account_ids = set(Account.objects.filter(updated_at__gte=since).values_list('pk', flat=True))
+    transfers = Transfer.objects.filter(timestamp__gte=since).order_by().values_list('from_account_id', 'to_account_id')
+    for from_account_id, to_account_id in transfers.iterator(chunk_size=5000):
+        account_ids.add(from_account_id)
+        account_ids.add(to_account_id)
+    return account_ids
+
+
+def run_checks(lookups, workers):
+    """check_accounts() each lookup, on a pool of worker processes when there is more than one chunk."""
+    if workers <= 1 or len(lookups) <= 1:
+        return list(map(check_accounts, lookups))
+    # Children must open their own connections rather than share the parent's
+    connections.close_all()
+    # fork keeps settings changed at runtime (such as a test database name); elsewhere children set Django up again
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(lookups)),
+        mp_context=multiprocessing.get_context(method),
+        initializer=django.setup,
+    ) as executor:
+        return list(executor.map(check_accounts, lookups))
+
+
+def reconcile(full=False, workers=1, chunk_size=5000, overlap=DEFAULT_OVERLAP):
+    """
+    Check accounts against their transfers and the total against the opening
+    balances, record the run, and return its report. Runs incrementally from
+    the previous run unless full is set or there is none.
+    """
+    started_at = timezone.now()
+    previous = Reconciliation.objects.order_by('-started_at').first()
+    since = None
+    if previous is not None and not full:
+        since = previous.started_at - overlap
+        account_ids = sorted(touched_since(since).union(previous.drifted_accounts))
+        lookups = [
+            {'pk__in': account_ids[start:start + chunk_size]}
+            for start in range(0, len(account_ids), chunk_size)
+        ]
+    else:
+        lookups = id_ranges(chunk_size)
+
+    checked = 0
+    drifted = []
+    for chunk_checked, chunk_drifted in run_checks(lookups, workers):
+        checked += chunk_checked
+        drifted.extend(chunk_drifted)
+    difference = total_difference()
+
+    run = Reconciliation.objects.create(
+        started_at=started_at,
+        full=since is None,
+        accounts_checked=checked,
+        drifted_accounts=[account['account_id'] for account in drifted],
+        total_difference=difference,
+    )
+    return {
+        'id': run.pk,
+        'full': run.full,
+        'since': since,
+        'started_at': run.started_at,
+        'finished_at': run.finished_at,
+        'accounts_checked': checked,
+        'money_conserved': difference == 0,
+        'total_difference': difference,
+        'drifted_count': len(drifted),
+        'drifted': drifted,
+    }
@@ -0,0 +1,68 @@
+# bark_core/renderers.py
+"""
+Renderers for file exports.
+
+Both render ordinary response data (a dict or a list of dicts), which covers
+error responses, and also stream rows with render_stream() for
+StreamingHttpResponse. Rows are buffered into chunks of ROWS_PER_CHUNK so the
+server isn't asked to flush one tiny write per row.
+"""
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+ROWS_PER_CHUNK = 500
+
+
+class StreamingRenderer(BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = [data] if isinstance(data, dict) else list(data)
+        columns = list(rows[0]) if rows else []
+        return b''.join(self.render_stream(columns, ([row.get(column) for column in columns] for row in rows)))
+
+    def render_stream(self, columns, rows):
+        """Yield the encoded document for an iterable of row value lists, chunk by chunk."""
+        header = self.render_header(columns)
+        if header:
+            yield header.encode(self.charset)
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) == ROWS_PER_CHUNK:
+                yield self.render_rows(columns, buffer).encode(self.charset)
+                buffer = []
+        if buffer:
+            yield self.render_rows(columns, buffer).encode(self.charset)
+
+    def render_header(self, columns):
+        return ''
+
+    def render_rows(self, columns, rows):
+        raise NotImplementedError
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def render_header(self, columns):
+        return self.render_rows(columns, [columns])
+
+    def render_rows(self, columns, rows):
+        out = io.StringIO()
+        csv.writer(out).writerows(rows)
+        return out.getvalue()
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render_rows(self, columns, rows):
+        return ''.join(json.dumps(dict(zip(columns, row)), separators=(',', ':')) + '\n' for row in rows)
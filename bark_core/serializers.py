@@ -1,7 +1,10 @@
 # bark_core/serializers.py
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Account, Transfer
+from django.urls import reverse
+from .models import Account, Transfer, MonthlyStatement, QueuedTransfer
+from .engine import execute_transfer
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -13,6 +16,8 @@ class AccountSerializer(serializers.ModelSerializer):
     user_detail = UserSerializer(read_only=True, source='user')  # Use UserSerializer for read operations
     initial_deposit = serializers.DecimalField(max_digits=19, decimal_places=2, write_only=True)
     account_number = serializers.CharField(write_only=True)
+    # Includes credits a hot account still holds in stripes
+    balance = serializers.DecimalField(max_digits=19, decimal_places=4, read_only=True, source='current_balance')
 
     class Meta:
         model = Account
@@ -32,7 +37,8 @@ class AccountSerializer(serializers.ModelSerializer):
         account = Account.objects.create(
             user=user,
             account_number=account_number,
-            balance=initial_deposit
+            balance=initial_deposit,
+            opening_balance=initial_deposit
         )
         return account
 
@@ -47,8 +53,10 @@ class TransferSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'timestamp']
 
     def validate(self, data):
-        from_account = Account.verify_account_number(data['from_account_number'])
-        to_account = Account.verify_account_number(data['to_account_number'])
+        # Both sides in one query; the engine's conditional updates lock the rows
+        accounts = Account.objects.resolve_numbers([data['from_account_number'], data['to_account_number']])
+        from_account = accounts.get(data['from_account_number'])
+        to_account = accounts.get(data['to_account_number'])
 
         if not from_account or not to_account:
             raise serializers.ValidationError("One or both of the account numbers are invalid.")
@@ -66,22 +74,49 @@ class TransferSerializer(serializers.ModelSerializer):
         to_account = validated_data.pop('to_account')
         amount = validated_data.pop('amount')
 
-        # Ensure enough funds before creating transfer
-        if from_account.balance < amount:
-            raise serializers.ValidationError("Insufficient funds in the account.")
+        # The engine debits conditionally, so insufficient funds surface as a ValidationError
+        return execute_transfer(from_account, to_account, amount, validated_data.pop('idempotency_key', None))
 
-        transfer = Transfer.objects.create(
-            from_account=from_account,
-            to_account=to_account,
-            amount=amount
-        )
+class TransferBatchItemSerializer(serializers.Serializer):
+    from_account_number = serializers.CharField()
+    to_account_number = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=19, decimal_places=2)
 
-        return transfer
+class TransferBatchSerializer(serializers.Serializer):
+    transfers = TransferBatchItemSerializer(many=True, allow_empty=False)
+    atomic = serializers.BooleanField(default=True)  # False returns a result per item instead
+
+    def validate_transfers(self, value):
+        max_size = getattr(settings, 'BARK_TRANSFER_BATCH_MAX', 5000)
+        if len(value) > max_size:
+            raise serializers.ValidationError(f"A batch may contain at most {max_size} transfers.")
+        return value
 
 class BalanceSerializer(serializers.Serializer):
     balance = serializers.DecimalField(max_digits=19, decimal_places=4, read_only=True)
+    as_of = serializers.DateTimeField(read_only=True)  # Only present for historical balances
 
 class TransferHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Transfer
         fields = ['id', 'from_account', 'to_account', 'amount', 'timestamp']
+
+class MonthlyStatementSerializer(serializers.ModelSerializer):
+    month = serializers.DateField(format='%Y-%m')
+
+    class Meta:
+        model = MonthlyStatement
+        fields = ['month', 'sent_total', 'sent_count', 'received_total', 'received_count']
+
+class QueuedTransferSerializer(serializers.ModelSerializer):
+    status_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = QueuedTransfer
+        fields = ['id', 'status', 'status_url', 'transfer', 'detail', 'amount', 'created_at', 'posted_at']
+        read_only_fields = fields
+
+    def get_status_url(self, obj):
+        url = reverse('transfer-queued', kwargs={'queued_id': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,141 @@
+# bark_core/statements.py
+"""
+Monthly statement rollups.
+
+Each posted transfer adds to the sender's and the receiver's MonthlyStatement
+row for the month of the transfer, inside the transfer's own transaction.
+Rows are created with an insert that ignores conflicts and then incremented
+with a single CASE update, so concurrent transfers add to the totals rather
+than overwrite them. Reading an account's statements is then an index range
+scan over at most one row per month.
+
+A striped credit to a hot account adds to a random one of its
+StatementStripe rows for the month instead, so deposits don't queue for the
+receiver's statement row any more than for its account row. The statement
+stripes are added to MonthlyStatement when the balance stripes are folded,
+and until then a statement read adds them on.
+"""
+import random
+
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import MonthlyStatement, StatementStripe
+
+STATEMENT_FIELDS = (
+    ('sent_total', DecimalField(max_digits=19, decimal_places=4)),
+    ('sent_count', IntegerField()),
+    ('received_total', DecimalField(max_digits=19, decimal_places=4)),
+    ('received_count', IntegerField()),
+)
+
+
+def month_of(timestamp):
+    """First day of the (server time zone) month a timestamp falls in."""
+    return timezone.localtime(timestamp).date().replace(day=1)
+
+
+def add_totals(model, totals, fields, chunk_size=500, create=()):
+    """
+    Add {key: [increment per field]} to model's rows, where each key is a
+    tuple of the (field, value) pairs of a row's unique fields. Rows that
+    don't exist are created, as are those keyed in create, which are not
+    updated.
+    """
+    keys = list(totals)
+    model.objects.bulk_create(
+        [model(**dict(key)) for key in keys + [key for key in create if key not in totals]],
+        batch_size=chunk_size,
+        ignore_conflicts=True,
+    )
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+
+        def increment(index, output_field):
+            return Case(
+                *[When(**dict(key), then=Value(totals[key][index])) for key in chunk],
+                default=Value(0),
+                output_field=output_field,
+            )
+
+        condition = Q()
+        for key in chunk:
+            condition |= Q(**dict(key))
+        model.objects.filter(condition).update(**{
+            name: F(name) + increment(index, output_field)
+            for index, (name, output_field) in enumerate(fields)
+        })
+
+
+def record_statements(transfers, chunk_size=500, striped=()):
+    """
+    Add transfers to their accounts' monthly statements. Credits to the
+    accounts in striped (hot accounts whose credit went to a stripe) go to a
+    statement stripe. Must run inside a transaction.
+    """
+    totals = {}  # (('account_id', id), ('month', month)) -> [sent_total, sent_count, received_total, received_count]
+    stripe_totals = {}  # (('account_id', id), ('month', month), ('index', index)) -> [received_total, received_count]
+    listed = set()  # Statement rows of striped credits, which must exist to be listed
+    for transfer in transfers:
+        month = month_of(transfer.timestamp)
+        sent = totals.setdefault((('account_id', transfer.from_account_id), ('month', month)), [0, 0, 0, 0])
+        sent[0] += transfer.amount
+        sent[1] += 1
+        receiver = (('account_id', transfer.to_account_id), ('month', month))
+        if transfer.to_account_id in striped:
+            listed.add(receiver)
+            received = stripe_totals.setdefault(receiver + (('index', random.randrange(transfer.to_account.stripe_count)),), [0, 0])
+            received[0] += transfer.amount
+            received[1] += 1
+            continue
+        received = totals.setdefault(receiver, [0, 0, 0, 0])
+        received[2] += transfer.amount
+        received[3] += 1
+
+    # Inserting a row that exists takes no lock on it, where updating it would
+    add_totals(MonthlyStatement, totals, STATEMENT_FIELDS, chunk_size, create=listed)
+    if stripe_totals:
+        add_totals(StatementStripe, stripe_totals, STATEMENT_FIELDS[2:], chunk_size)
+
+
+def fold_statement_stripes(account_id):
+    """
+    Add an account's statement stripes to its monthly statements and clear
+    them. Called by Account.objects.fold_stripes() with the account row and
+    its balance stripes held, so no striped credit is in flight.
+    """
+    stripes = (
+        StatementStripe.objects.select_for_update().filter(account_id=account_id)
+        .order_by('month', 'index').values_list('pk', 'month', 'received_total', 'received_count')
+    )
+    totals = {}
+    pks = []
+    for pk, month, received_total, received_count in stripes:
+        pks.append(pk)
+        received = totals.setdefault((('account_id', account_id), ('month', month)), [0, 0, 0, 0])
+        received[2] += received_total
+        received[3] += received_count
+    if not pks:
+        return
+    StatementStripe.objects.filter(pk__in=pks).delete()
+    add_totals(MonthlyStatement, totals, STATEMENT_FIELDS)
+
+
+def add_striped_totals(account, statements):
+    """
+    Add a hot account's not yet folded statement stripes to statements, a
+    list of its MonthlyStatement rows, in place.
+    """
+    if not account.stripe_count or not statements:
+        return statements
+    stripes = (
+        StatementStripe.objects.filter(account=account, month__in=[statement.month for statement in statements])
+        .values('month').annotate(total=Sum('received_total'), count=Sum('received_count'))
+        .values_list('month', 'total', 'count').order_by()
+    )
+    pending = {month: (total, count) for month, total, count in stripes}
+    for statement in statements:
+        total, count = pending.get(statement.month, (0, 0))
+        statement.received_total += total
+        statement.received_count += count
+    return statements
@@ -1,3 +1,1320 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf, skipUnless
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from . import async_views, idempotency
+from .cache import AccountNumberCache, BalanceCache, CachedBalance, balance_cache
+from .db_routers import PinStore, ReplicaRouter, is_pinned, pin_user, request_routing, route_reads, routing_stats
+from .engine import BatchTransferError, execute_batch, execute_transfer, post_queued_transfers, set_stripe_count
+from .pagination import KeysetPagination
+from .models import (
+    Account, BalanceCheckpoint, BalanceStripe, IdempotencyKey, LedgerEntry, MonthlyStatement, QueuedTransfer, RevokedToken,
+    StatementStripe, Transfer,
+)
+from .reconcile import reconcile
+from .serializers import execute_transfer as serializer_execute_transfer
+from .throttling import SharedUserRateThrottle, SlidingWindowStore
+from .statements import add_striped_totals
+from .tokens import RevocationList, SignedTokenAuthentication, TokenUser, issue_signed_token, revoke_signed_token
+
+
+def index_name(fields):
+    return next(index.name for index in Transfer._meta.indexes if index.fields == fields)
+
+
+class AccountHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('history')
+        cls.account = Account.objects.create(user=user, account_number='1000000000000001', balance=100)
+        cls.other = Account.objects.create(user=user, account_number='1000000000000002', balance=100)
+        cls.third = Account.objects.create(user=user, account_number='1000000000000003', balance=100)
+        now = timezone.now()
+        pairs = [(cls.account, cls.other), (cls.other, cls.account), (cls.third, cls.account)]
+        Transfer.objects.bulk_create(
+            Transfer(from_account=src, to_account=dst, amount=i + 1, timestamp=now - timedelta(hours=i))
+            for i, (src, dst) in enumerate(pairs * 10)
+        )
+        cls.sent_index = index_name(['from_account', '-timestamp', '-id'])
+        cls.received_index = index_name(['to_account', '-timestamp', '-id'])
+
+    def history(self, counterparty_id=None):
+        return Transfer.objects.history(self.account.pk, counterparty_id).filter(
+            timestamp__gte=timezone.now() - timedelta(days=1),
+            amount__gte=Decimal('2'),
+        )
+
+    def test_history_matches_or_query(self):
+        expected = list(Transfer.objects.for_account(self.account.pk).filter(amount__gte=Decimal('2'))[:7])
+        self.assertEqual(list(self.history()[:7]), expected)
+        expected = list(Transfer.objects.for_account(self.account.pk, self.third.pk).filter(amount__gte=Decimal('2'))[:7])
+        self.assertEqual(list(self.history(self.third.pk)[:7]), expected)
+
+    @skipUnless(connection.vendor == 'sqlite', "SQLite query plan")
+    def test_sqlite_plan_uses_direction_indexes(self):
+        plan = self.history()[:50].explain()
+        self.assertIn(self.sent_index, plan)
+        self.assertIn(self.received_index, plan)
+        self.assertNotIn('SCAN', plan)
+
+        # Either direction index can serve a scan pinned to both accounts
+        plan = self.history(self.third.pk)[:50].explain()
+        self.assertNotIn('SCAN', plan)
+
+    @skipUnless(connection.vendor == 'postgresql', "PostgreSQL query plan")
+    def test_postgresql_plan_uses_direction_indexes(self):
+        with connection.cursor() as cursor:
+            # The test tables are tiny, so rule out the sequential scan the planner would prefer
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = self.history()[:50].explain()
+        self.assertIn(self.sent_index, plan)
+        self.assertIn(self.received_index, plan)
+        self.assertNotIn('Seq Scan', plan)
+
+
+@skipIf(connection.vendor == 'sqlite' and connection.is_in_memory_db(), "Needs a file-backed SQLite test database")
+class ConcurrentTransferTests(TransactionTestCase):
+    WRITERS = 32
+    TRANSFERS = 10
+
+    def test_concurrent_writers_lose_no_updates(self):
+        user = User.objects.create_user('concurrency')
+        opening = Decimal('1000.0000')
+        hub = Account.objects.create(user=user, account_number='2000000000000000', balance=opening, opening_balance=opening)
+        spokes = [
+            Account.objects.create(user=user, account_number=f'2{i:015d}', balance=opening, opening_balance=opening)
+            for i in range(1, self.WRITERS + 1)
+        ]
+        errors = []
+        start = threading.Barrier(self.WRITERS)
+
+        def writer(spoke):
+            start.wait()
+            try:
+                for i in range(self.TRANSFERS):
+                    # Every writer contends for the hub's row
+                    if i % 2:
+                        execute_transfer(hub, spoke, Decimal('1.00'))
+                    elif i % 4:
+                        execute_transfer(spoke, hub, Decimal('2.00'))
+                    else:
+                        # Batches read before they write, which needs the lock up front
+                        execute_batch([{
+                            'from_account_number': spoke.account_number,
+                            'to_account_number': hub.account_number,
+                            'amount': Decimal('2.00'),
+                        }])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer, args=(spoke,)) for spoke in spokes]
+        # No transfer should need the engine's "database is locked" retries
+        with self.assertNoLogs('bark_core.engine', 'WARNING'):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        per_writer = self.TRANSFERS // 2
+        self.assertEqual(Transfer.objects.count(), self.WRITERS * self.TRANSFERS)
+        hub.refresh_from_db()
+        self.assertEqual(hub.balance, opening + self.WRITERS * per_writer * Decimal('1.00'))
+        self.assertEqual(hub.ledger_sequence, self.WRITERS * self.TRANSFERS)
+        for spoke in Account.objects.filter(pk__in=[spoke.pk for spoke in spokes]):
+            self.assertEqual(spoke.balance, opening - per_writer * Decimal('1.00'))
+        total = Account.objects.aggregate(total=Sum('balance'))['total']
+        self.assertEqual(total, opening * (self.WRITERS + 1))
+        self.assertEqual(LedgerEntry.objects.count(), 2 * self.WRITERS * self.TRANSFERS)
+
+
+class BatchTransferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('batch')
+        cls.first = Account.objects.create(user=cls.user, account_number='4000000000000001', balance=10, opening_balance=10)
+        cls.second = Account.objects.create(user=cls.user, account_number='4000000000000002', balance=0, opening_balance=0)
+
+    def item(self, source, target, amount):
+        return {'from_account_number': source.account_number, 'to_account_number': target.account_number, 'amount': Decimal(amount)}
+
+    def balances(self):
+        return list(Account.objects.filter(pk__in=[self.first.pk, self.second.pk]).order_by('pk').values_list('balance', flat=True))
+
+    def test_items_see_earlier_items(self):
+        # Only valid in submission order: second has nothing until the first item lands
+        items = [
+            self.item(self.first, self.second, '10'),
+            self.item(self.second, self.first, '5'),
+            self.item(self.first, self.second, '5'),
+        ]
+        for atomic in (True, False):
+            with self.subTest(atomic=atomic):
+                Account.objects.filter(pk=self.first.pk).update(balance=10)
+                Account.objects.filter(pk=self.second.pk).update(balance=0)
+                results = execute_batch(items, atomic=atomic)
+                self.assertEqual([result['status'] for result in results], ['created'] * 3)
+                self.assertEqual(self.balances(), [Decimal('0.0000'), Decimal('10.0000')])
+                created = Transfer.objects.filter(pk__in=[result['id'] for result in results]).order_by('pk')
+                self.assertEqual([transfer.amount for transfer in created], [Decimal('10'), Decimal('5'), Decimal('5')])
+
+        # The journal replays the batch in order
+        entries = LedgerEntry.objects.filter(account=self.first).order_by('sequence').values_list('amount', 'balance_after')
+        self.assertEqual(list(entries)[-3:], [(-10, 0), (5, 5), (-5, 0)])
+
+    def test_overdraft_within_batch_is_rejected(self):
+        items = [
+            self.item(self.first, self.second, '6'),
+            self.item(self.first, self.second, '6'),
+            self.item(self.first, self.second, '4'),
+        ]
+        results = execute_batch(items, atomic=False)
+        self.assertEqual([result['status'] for result in results], ['created', 'rejected', 'created'])
+        self.assertEqual(results[1]['detail'], "Insufficient funds.")
+        self.assertNotIn('id', results[1])
+        self.assertEqual(self.balances(), [Decimal('0.0000'), Decimal('10.0000')])
+        self.assertEqual(Transfer.objects.count(), 2)
+        statement = MonthlyStatement.objects.get(account=self.first)
+        self.assertEqual((statement.sent_total, statement.sent_count), (Decimal('10'), 2))
+
+    def test_per_item_mode_skips_invalid_items(self):
+        items = [
+            {**self.item(self.first, self.second, '1'), 'to_account_number': '4999999999999999'},
+            self.item(self.first, self.first, '1'),
+            self.item(self.first, self.second, '0'),
+            self.item(self.first, self.second, '1'),
+        ]
+        results = execute_batch(items, atomic=False)
+        self.assertEqual(
+            [result.get('detail') for result in results],
+            ["One or both of the account numbers are invalid.", "Cannot transfer to the same account.",
+             "Transfer amount must be positive.", None],
+        )
+        self.assertEqual(self.balances(), [Decimal('9.0000'), Decimal('1.0000')])
+
+    def test_atomic_batch_error_rolls_back_everything(self):
+        items = [
+            self.item(self.first, self.second, '6'),
+            self.item(self.first, self.second, '6'),
+        ]
+        with self.assertRaises(BatchTransferError) as raised:
+            execute_batch(items)
+        self.assertEqual([result['status'] for result in raised.exception.results], ['created', 'rejected'])
+        self.assertEqual(self.balances(), [Decimal('10.0000'), Decimal('0.0000')])
+        self.assertFalse(Transfer.objects.exists())
+        self.assertFalse(LedgerEntry.objects.exists())
+        self.assertFalse(MonthlyStatement.objects.exists())
+        self.assertEqual(
+            list(Account.objects.filter(pk__in=[self.first.pk, self.second.pk]).values_list('ledger_sequence', flat=True)),
+            [0, 0],
+        )
+
+
+class QueuedTransferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('queued')
+        cls.first = Account.objects.create(user=cls.user, account_number='5000000000000001', balance=10, opening_balance=10)
+        cls.second = Account.objects.create(user=cls.user, account_number='5000000000000002', balance=0, opening_balance=0)
+
+    def queue(self, source, target, amount):
+        return QueuedTransfer.objects.create(user=self.user, from_account=source, to_account=target, amount=Decimal(amount))
+
+    def test_posting_links_transfers_and_marks_rejections(self):
+        queued = [
+            self.queue(self.first, self.second, '6'),
+            self.queue(self.first, self.second, '6'),
+            self.queue(self.second, self.first, '2'),
+        ]
+        processed = post_queued_transfers()
+        self.assertEqual([item.pk for item in processed], [item.pk for item in queued])
+
+        posted, rejected, returned = QueuedTransfer.objects.order_by('pk').select_related('transfer')
+        self.assertEqual(posted.status, QueuedTransfer.POSTED)
+        self.assertEqual(
+            (posted.transfer.from_account_id, posted.transfer.to_account_id, posted.transfer.amount),
+            (self.first.pk, self.second.pk, Decimal('6')),
+        )
+        self.assertEqual(returned.status, QueuedTransfer.POSTED)
+        self.assertEqual(returned.transfer.amount, Decimal('2'))
+        self.assertNotEqual(posted.transfer_id, returned.transfer_id)
+
+        self.assertEqual(rejected.status, QueuedTransfer.REJECTED)
+        self.assertEqual(rejected.detail, "Insufficient funds.")
+        self.assertIsNone(rejected.transfer_id)
+        self.assertTrue(all(item.posted_at is not None for item in (posted, rejected, returned)))
+
+        self.assertEqual(Transfer.objects.count(), 2)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.balance, Decimal('6.0000'))
+
+    def test_posts_oldest_first_and_leaves_the_rest_pending(self):
+        queued = [self.queue(self.first, self.second, '1') for _ in range(3)]
+        self.assertEqual([item.pk for item in post_queued_transfers(batch_size=2)], [item.pk for item in queued[:2]])
+        self.assertEqual(QueuedTransfer.objects.get(pk=queued[2].pk).status, QueuedTransfer.PENDING)
+        self.assertEqual([item.pk for item in post_queued_transfers(batch_size=2)], [queued[2].pk])
+        self.assertEqual(post_queued_transfers(), [])
+
+
+class IdempotencyTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('idempotency')
+        self.source = Account.objects.create(user=self.user, account_number='3000000000000001', balance=100, opening_balance=100)
+        self.target = Account.objects.create(user=self.user, account_number='3000000000000002', balance=100, opening_balance=100)
+        self.body = {
+            'from_account_number': self.source.account_number,
+            'to_account_number': self.target.account_number,
+            'amount': '10.00',
+        }
+
+    def post(self, key, body=None):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post('/api/transfers/', body or self.body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def assert_transferred_once(self):
+        self.assertEqual(Transfer.objects.count(), 1)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('90.0000'))
+
+    def blocked_transfers(self, calls_to_block):
+        """Patch the engine call of the first calls_to_block transfers to wait until released."""
+        entered = threading.Event()
+        proceed = threading.Event()
+        calls = [0]
+
+        def blocking(*args, **kwargs):
+            calls[0] += 1
+            if calls[0] <= calls_to_block:
+                entered.set()
+                proceed.wait(10)
+            return serializer_execute_transfer(*args, **kwargs)
+
+        return mock.patch('bark_core.serializers.execute_transfer', blocking), entered, proceed
+
+    def post_in_thread(self, key, responses):
+        def run():
+            try:
+                responses.append(self.post(key))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_replay_returns_stored_response(self):
+        first = self.post('replay')
+        second = self.post('replay')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assert_transferred_once()
+
+    def test_key_reused_with_different_body_is_rejected(self):
+        self.assertEqual(self.post('reused').status_code, 201)
+        response = self.post('reused', {**self.body, 'amount': '20.00'})
+        self.assertEqual(response.status_code, 422)
+        self.assert_transferred_once()
+
+    def test_claim_finish_release(self):
+        fingerprint = idempotency.request_fingerprint(self.body)
+        row, response = idempotency.claim(self.user, 'claim', fingerprint, recover=None)
+        self.assertIsNone(response)
+        # Released, e.g. after an exception: a retry claims the key afresh
+        idempotency.release(row)
+        self.assertFalse(IdempotencyKey.objects.filter(pk=row.pk).exists())
+        row, response = idempotency.claim(self.user, 'claim', fingerprint, recover=None)
+        self.assertIsNone(response)
+
+        # Server errors release the key as well
+        idempotency.finish(row, mock.Mock(status_code=500, data={}))
+        self.assertFalse(IdempotencyKey.objects.filter(pk=row.pk).exists())
+
+        row, _ = idempotency.claim(self.user, 'claim', fingerprint, recover=None)
+        idempotency.finish(row, mock.Mock(status_code=400, data={'detail': 'Insufficient funds'}))
+        claimed, response = idempotency.claim(self.user, 'claim', fingerprint, recover=None)
+        self.assertIsNone(claimed)
+        self.assertEqual((response.status_code, response.data), (400, {'detail': 'Insufficient funds'}))
+
+    @skipIf(connection.vendor == 'sqlite' and connection.is_in_memory_db(), "Needs a file-backed SQLite test database")
+    def test_concurrent_duplicate_waits_for_first(self):
+        patch, entered, proceed = self.blocked_transfers(1)
+        responses = []
+        with patch:
+            first = self.post_in_thread('concurrent', responses)
+            self.assertTrue(entered.wait(10))
+            second = self.post_in_thread('concurrent', responses)
+            # Let the duplicate find the claim in progress before the first request finishes
+            second.join(0.2)
+            self.assertTrue(second.is_alive())
+            proceed.set()
+            first.join()
+            second.join()
+
+        self.assertEqual([response.status_code for response in responses], [201, 201])
+        self.assertEqual(responses[0].data, responses[1].data)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assert_transferred_once()
+
+    @skipIf(connection.vendor == 'sqlite' and connection.is_in_memory_db(), "Needs a file-backed SQLite test database")
+    def test_takeover_after_lock_timeout_transfers_once(self):
+        patch, entered, proceed = self.blocked_transfers(1)
+        responses = []
+        with patch:
+            stalled = self.post_in_thread('takeover', responses)
+            self.assertTrue(entered.wait(10))
+            # The first request has outlived BARK_IDEMPOTENCY_LOCK_TIMEOUT
+            with override_settings(BARK_IDEMPOTENCY_LOCK_TIMEOUT=0):
+                takeover = self.post('takeover')
+            with self.assertLogs('bark_core.views', 'ERROR'):
+                proceed.set()
+                stalled.join()
+
+        self.assertEqual(takeover.status_code, 201)
+        # The stalled request's transfer rolled back when it found its claim gone
+        self.assertEqual(responses[0].status_code, 400)
+        self.assert_transferred_once()
+        replay = self.post('takeover')
+        self.assertEqual(replay.data, takeover.data)
+
+
+class SignedTokenTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('signed', is_staff=True)
+
+    def authenticate(self, token, keyword='Bearer'):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'{keyword} {token}')
+        return SignedTokenAuthentication().authenticate(request)
+
+    def test_signed_token_authenticates_without_queries(self):
+        token, expires_at = issue_signed_token(self.user)
+        self.authenticate(token)  # Loads the revocation list
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate(token)
+        self.assertIsInstance(user, TokenUser)
+        self.assertEqual((user.pk, user.username, user.is_staff, user.expires_at), (self.user.pk, 'signed', True, expires_at))
+
+    @override_settings(BARK_SIGNED_TOKEN_TTL=-1)
+    def test_expired_token_is_rejected(self):
+        token, _ = issue_signed_token(self.user)
+        with self.assertRaisesMessage(AuthenticationFailed, 'Token has expired.'):
+            self.authenticate(token)
+
+    def test_tampered_token_is_rejected(self):
+        token, _ = issue_signed_token(self.user)
+        payload, rest = token.split(':', 1)
+        tampered = ('A' if payload[0] != 'A' else 'B') + payload[1:] + ':' + rest
+        for bad in (tampered, token[:-1], token + 'x'):
+            with self.assertRaisesMessage(AuthenticationFailed, 'Invalid token.'):
+                self.authenticate(bad)
+
+    def test_revoked_token_is_rejected(self):
+        token, _ = issue_signed_token(self.user)
+        user, _ = self.authenticate(token)
+        revoke_signed_token(user)
+        with self.assertRaisesMessage(AuthenticationFailed, 'Token has been revoked.'):
+            self.authenticate(token)
+        # Another process learns of it from the database
+        other = RevocationList()
+        self.assertTrue(other.is_revoked(user.token_id))
+
+    def test_revocation_committed_behind_a_higher_id_is_seen(self):
+        expires_at = timezone.now() + timedelta(minutes=5)
+        revocations = RevocationList()
+        RevokedToken.objects.create(pk=10, jti='later', expires_at=expires_at)
+        revocations.refresh()
+        # A lower id that commits after the higher one was read
+        RevokedToken.objects.create(pk=5, jti='earlier', expires_at=expires_at)
+        revocations.refresh()
+        self.assertTrue(revocations.is_revoked('later'))
+        self.assertTrue(revocations.is_revoked('earlier'))
+
+    def test_expired_revocations_are_forgotten(self):
+        RevokedToken.objects.create(jti='expired', expires_at=timezone.now() - timedelta(seconds=1))
+        revocations = RevocationList()
+        revocations.refresh()
+        self.assertFalse(revocations.is_revoked('expired'))
+
+    def test_only_tokens_with_a_colon_are_taken_as_signed(self):
+        # Database tokens are 40 hex characters and go on to the next authentication class
+        self.assertIsNone(self.authenticate('0123456789abcdef0123456789abcdef01234567'))
+        token, _ = issue_signed_token(self.user)
+        self.assertIsNone(self.authenticate(token, keyword='Token'))
+        with self.assertRaisesMessage(AuthenticationFailed, 'Invalid token.'):
+            self.authenticate('not:signed')
+
+
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('routing')
+        cls.source = Account.objects.create(user=cls.user, account_number='6000000000000001', balance=100, opening_balance=100)
+        cls.target = Account.objects.create(user=cls.user, account_number='6000000000000002', balance=100, opening_balance=100)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pin_db = os.path.join(directory.name, 'pins.sqlite3')
+        settings = self.settings(BARK_DB_REPLICAS=['replica1'], BARK_REPLICA_PIN_DB=self.pin_db)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_router_reads_from_replica_until_the_request_writes(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Transfer), 'default')
+        with request_routing() as routing:
+            routing.alias = 'replica1'
+            self.assertEqual(router.db_for_read(Transfer), 'replica1')
+            # Authentication and idempotency always read the primary
+            self.assertEqual(router.db_for_read(RevokedToken), 'default')
+            self.assertEqual(router.db_for_read(IdempotencyKey), 'default')
+            self.assertEqual(router.db_for_write(Transfer), 'default')
+            self.assertEqual(router.db_for_read(Transfer), 'default')
+
+    def test_route_reads_skips_replicas_for_writes_and_pinned_users(self):
+        with request_routing() as routing:
+            route_reads(routing, self.user, read_only=True)
+            self.assertEqual(routing.alias, 'replica1')
+        with request_routing() as routing:
+            route_reads(routing, self.user, read_only=False)
+            self.assertIsNone(routing.alias)
+        pin_user(self.user)
+        pinned_before = routing_stats.pinned_requests
+        with request_routing() as routing:
+            route_reads(routing, self.user, read_only=True)
+            self.assertIsNone(routing.alias)
+        self.assertEqual(routing_stats.pinned_requests, pinned_before + 1)
+
+    def test_pin_is_seen_by_other_processes_and_expires(self):
+        pin_user(self.user)
+        self.assertTrue(is_pinned(self.user))
+        # Another worker process opens the same file
+        other = PinStore(self.pin_db)
+        now = time.time()
+        self.assertTrue(other.is_pinned(self.user.pk, now))
+        self.assertFalse(other.is_pinned(self.user.pk, now + 6))
+        self.assertFalse(other.is_pinned(self.user.pk + 1, now))
+
+    def test_write_pins_the_user_for_the_next_read(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/transfers/', {
+            'from_account_number': self.source.account_number,
+            'to_account_number': self.target.account_number,
+            'amount': '1.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        transfer_id = response.data['id']
+        self.assertTrue(is_pinned(self.user))
+        # There is no replica1 database here, so this only works from the primary
+        response = client.get('/api/transfers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([transfer['id'] for transfer in response.data['results']], [transfer_id])
+
+
+class BalanceCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('cache-owner')
+        cls.other = User.objects.create_user('cache-other')
+        cls.staff = User.objects.create_user('cache-staff', is_staff=True)
+        cls.account = Account.objects.create(user=cls.owner, account_number='7000000000000001', balance=100, opening_balance=100)
+        cls.target = Account.objects.create(user=cls.other, account_number='7000000000000002', balance=100, opening_balance=100)
+
+    def setUp(self):
+        balance_cache.clear()
+
+    def balance(self, user, account=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(f'/api/accounts/{(account or self.account).pk}/balance/')
+
+    def test_counters_and_lost_race(self):
+        cache = BalanceCache(2)
+        value = CachedBalance(1, Decimal('1'), None, 0)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, value, cache.token())
+        self.assertEqual(cache.get(1), value)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # A read that started before an invalidation mustn't reinstate its value
+        token = cache.token()
+        cache.invalidate([1])
+        cache.set(1, value, token)
+        self.assertIsNone(cache.get(1))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations'], stats['size']), (1, 2, 1, 0))
+
+    def test_hit_is_checked_with_one_query(self):
+        self.assertEqual(self.balance(self.owner).data, {'balance': '100.0000'})
+        hits = balance_cache.hits
+        with self.assertNumQueries(1):
+            self.assertEqual(self.balance(self.owner).data, {'balance': '100.0000'})
+        self.assertEqual(balance_cache.hits, hits + 1)
+
+    def test_transfer_invalidates_on_commit_only(self):
+        self.balance(self.owner)
+        invalidations = balance_cache.invalidations
+        try:
+            with transaction.atomic():
+                execute_transfer(self.account, self.target, Decimal('10'))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # Rolled back: the cached balance is still right and stays
+        self.assertEqual(balance_cache.invalidations, invalidations)
+        self.assertEqual(balance_cache.get(self.account.pk).balance, Decimal('100'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_transfer(self.account, self.target, Decimal('10'))
+        self.assertEqual(balance_cache.invalidations, invalidations + 2)
+        self.assertIsNone(balance_cache.get(self.account.pk))
+        self.assertEqual(self.balance(self.owner).data, {'balance': '90.0000'})
+
+    def test_write_from_another_process_is_not_served(self):
+        self.balance(self.owner)
+        # No local invalidation, as when another worker commits
+        Account.objects.filter(pk=self.account.pk).update(balance=F('balance') + 5, ledger_sequence=F('ledger_sequence') + 1)
+        self.assertEqual(self.balance(self.owner).data, {'balance': '105.0000'})
+
+    def test_hit_checks_ownership(self):
+        self.balance(self.owner)
+        self.assertEqual(self.balance(self.other).status_code, 404)
+        self.assertEqual(self.balance(self.staff).data, {'balance': '100.0000'})
+        # Changing hands doesn't bump ledger_sequence, but the old owner still loses access
+        Account.objects.filter(pk=self.account.pk).update(user=self.other)
+        self.assertEqual(self.balance(self.owner).status_code, 404)
+        self.assertEqual(self.balance(self.other).data, {'balance': '100.0000'})
+
+
+class AdminSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin-search', password='!')
+        owner = User.objects.create_user('9lives')
+        cls.numeric = Account.objects.create(user=owner, account_number='8000000000000001', balance=10)
+        cls.lettered = Account.objects.create(user=cls.admin, account_number='benc000000000001', balance=10)
+        Transfer.objects.create(from_account=cls.numeric, to_account=cls.lettered, amount=1)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def search(self, model, term):
+        response = self.client.get(f'/admin/bark_core/{model}/', {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['cl'].result_list)
+
+    def test_account_search_matches_number_or_username_prefix(self):
+        self.assertEqual(self.search('account', 'benc0000'), [self.lettered])
+        self.assertEqual(self.search('account', 'benc000000000001'), [self.lettered])
+        # A username may start with a digit too
+        self.assertEqual(self.search('account', '9li'), [self.numeric])
+        self.assertEqual(self.search('account', '8000'), [self.numeric])
+        self.assertEqual(self.search('account', 'admin-s'), [self.lettered])
+
+    def test_transfer_search_matches_non_numeric_account_numbers(self):
+        self.assertEqual(len(self.search('transfer', 'benc')), 1)
+        self.assertEqual(len(self.search('transfer', '80000000')), 1)
+        self.assertEqual(self.search('transfer', 'nobody'), [])
+
+
+class PooledTransferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pooled')
+        cls.source = Account.objects.create(user=cls.user, account_number='8100000000000001', balance=10, opening_balance=10)
+        cls.target = Account.objects.create(user=cls.user, account_number='8100000000000002', balance=0, opening_balance=0)
+
+    def test_pool_thread_connections_are_recycled_around_the_view(self):
+        request = APIRequestFactory().post('/api/transfers/', {
+            'from_account_number': self.source.account_number,
+            'to_account_number': self.target.account_number,
+            'amount': '4',
+        }, format='json')
+        force_authenticate(request, self.user)
+        calls = []
+        with mock.patch('bark_core.async_views.close_old_connections', side_effect=lambda: calls.append(Transfer.objects.count())):
+            response = async_views.pooled_transfer(request)
+        self.assertEqual(response.status_code, 201)
+        # Once before the view runs and once after it has written
+        self.assertEqual(calls, [0, 1])
+
+
+class HotAccountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('hot')
+        cls.hot = Account.objects.create(user=cls.user, account_number='8200000000000001', balance=100, opening_balance=100)
+        cls.payers = [
+            Account.objects.create(user=cls.user, account_number=f'82000000000001{i:02d}', balance=50, opening_balance=50)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        set_stripe_count(self.hot, 4)
+        self.hot.refresh_from_db()
+        # Eight credits, spread over the stripes
+        for i in range(8):
+            execute_transfer(self.payers[i % 3], self.hot, Decimal(i + 1))
+
+    def striped(self):
+        return Account.objects.with_striped_balance().get(pk=self.hot.pk)
+
+    def total_money(self):
+        striped = BalanceStripe.objects.aggregate(total=Sum('balance'))['total'] or 0
+        return Account.objects.aggregate(total=Sum('balance'))['total'] + striped
+
+    def test_striped_balance_includes_credits_held_in_stripes(self):
+        account = self.striped()
+        self.assertEqual(account.balance, Decimal('100'))
+        self.assertEqual(account.striped_balance, Decimal('36'))
+        self.assertEqual(account.current_balance, Decimal('136'))
+        self.assertEqual(self.total_money(), Decimal('250'))
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(f'/api/accounts/{self.hot.pk}/balance/').data, {'balance': '136.0000'})
+
+        # The statement row exists but the credits sit in its stripes until a fold
+        statements = list(MonthlyStatement.objects.filter(account=self.hot))
+        self.assertEqual([(s.received_total, s.received_count) for s in statements], [(0, 0)])
+        add_striped_totals(account, statements)
+        self.assertEqual([(s.received_total, s.received_count) for s in statements], [(Decimal('36'), 8)])
+
+    def test_fold_moves_stripes_into_balance_and_checkpoints(self):
+        with transaction.atomic():
+            Account.objects.lock([self.hot.pk])
+            self.assertEqual(Account.objects.fold_stripes(self.hot.pk), Decimal('36'))
+        account = self.striped()
+        self.assertEqual((account.balance, account.striped_balance), (Decimal('136'), Decimal('0')))
+        self.assertEqual(self.total_money(), Decimal('250'))
+        self.assertFalse(BalanceStripe.objects.filter(account=self.hot).exclude(balance=0).exists())
+        checkpoint = BalanceCheckpoint.objects.filter(account=self.hot).latest('sequence')
+        self.assertEqual((checkpoint.sequence, checkpoint.balance), (account.ledger_sequence, Decimal('136')))
+
+        self.assertFalse(StatementStripe.objects.filter(account=self.hot).exists())
+        statement = MonthlyStatement.objects.get(account=self.hot)
+        self.assertEqual((statement.received_total, statement.received_count), (Decimal('36'), 8))
+
+        # Nothing left to fold
+        with transaction.atomic():
+            Account.objects.lock([self.hot.pk])
+            self.assertEqual(Account.objects.fold_stripes(self.hot.pk), Decimal('0'))
+
+    def test_turning_hot_mode_off_folds_everything_back(self):
+        set_stripe_count(self.hot, 0)
+        account = self.striped()
+        self.assertEqual((account.stripe_count, account.balance, account.striped_balance), (0, Decimal('136'), Decimal('0')))
+        self.assertFalse(BalanceStripe.objects.filter(account=self.hot).exists())
+        self.assertTrue(BalanceCheckpoint.objects.filter(account=self.hot, balance=Decimal('136')).exists())
+
+        # Credits go to the row again
+        self.hot.refresh_from_db()
+        execute_transfer(self.payers[0], self.hot, Decimal('1'))
+        self.assertEqual(Account.objects.get(pk=self.hot.pk).balance, Decimal('137'))
+        self.assertEqual(self.total_money(), Decimal('250'))
+
+
+class FastSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('fast-staff', is_staff=True, first_name='Ada', email='ada@example.com')
+        owner = User.objects.create_user('fast-owner')
+        cls.account = Account.objects.create(user=cls.staff, account_number='8300000000000001', balance=Decimal('1000.5'), opening_balance=Decimal('1000.5'))
+        others = [
+            Account.objects.create(user=owner, account_number=f'83000000000001{i:02d}', balance=Decimal('0.0001') * i, opening_balance=0)
+            for i in range(3)
+        ]
+        for i, other in enumerate(others * 2):
+            execute_transfer(cls.account, other, (Decimal('12.3456') / (i + 1)).quantize(Decimal('0.0001')))
+        execute_transfer(others[1], cls.account, Decimal('0.0001'))
+        cls.token = Token.objects.create(user=cls.staff).key
+
+    def render(self, path, fast, asynchronous):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        with override_settings(BARK_FAST_SERIALIZERS=fast):
+            if asynchronous:
+                with override_settings(ROOT_URLCONF='bark_api.urls_async'):
+                    response = async_to_sync(self.async_client.get)(path, headers=headers)
+            else:
+                response = self.client.get(path, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.content
+
+    def test_fast_and_drf_serializers_render_the_same_bytes(self):
+        paths = {
+            'users': ('/api/users/', False),
+            'accounts': ('/api/accounts/', True),
+            'history': (f'/api/accounts/{self.account.pk}/transfers/', True),
+        }
+        for name, (path, has_async_view) in paths.items():
+            with self.subTest(name):
+                expected = self.render(path, fast=False, asynchronous=False)
+                self.assertGreater(len(json.loads(expected)['results']), 1)
+                self.assertEqual(self.render(path, fast=True, asynchronous=False), expected)
+                if has_async_view:
+                    self.assertEqual(self.render(path, fast=False, asynchronous=True), expected)
+                    self.assertEqual(self.render(path, fast=True, asynchronous=True), expected)
+
+
+@skipIf(connection.vendor == 'sqlite' and connection.is_in_memory_db(), "Worker processes need a file-backed SQLite test database")
+class ReconcileTests(TransactionTestCase):
+    def setUp(self):
+        user = User.objects.create_user('reconcile')
+        self.accounts = [
+            Account.objects.create(user=user, account_number=f'84000000000000{i:02d}', balance=100, opening_balance=100)
+            for i in range(7)
+        ]
+        for i in range(6):
+            execute_transfer(self.accounts[i], self.accounts[i + 1], Decimal(i + 1))
+
+    def corrupt(self, account, amount):
+        Account.objects.filter(pk=account.pk).update(balance=F('balance') + amount, updated_at=timezone.now())
+
+    def test_incremental_run_checks_only_touched_and_drifted_accounts(self):
+        report = reconcile()
+        self.assertEqual((report['full'], report['accounts_checked'], report['drifted_count']), (True, 7, 0))
+        self.assertTrue(report['money_conserved'])
+
+        execute_transfer(self.accounts[0], self.accounts[1], Decimal('1'))
+        self.corrupt(self.accounts[4], Decimal('0.5'))
+        report = reconcile(overlap=timedelta(0))
+        self.assertFalse(report['full'])
+        self.assertEqual(report['accounts_checked'], 3)
+        self.assertEqual([account['account_id'] for account in report['drifted']], [self.accounts[4].pk])
+        self.assertEqual(report['drifted'][0]['difference'], Decimal('0.5'))
+        self.assertEqual(report['total_difference'], Decimal('0.5'))
+
+        # Nothing touched since, but the drifted account is checked again
+        report = reconcile(overlap=timedelta(0))
+        self.assertEqual((report['accounts_checked'], report['drifted_count']), (1, 1))
+
+    def test_worker_pool_agrees_with_single_process(self):
+        self.corrupt(self.accounts[2], Decimal('-3'))
+        self.corrupt(self.accounts[6], Decimal('2'))
+        single = reconcile(full=True, workers=1, chunk_size=2)
+        pooled = reconcile(full=True, workers=3, chunk_size=2)
+        for key in ('accounts_checked', 'drifted', 'total_difference', 'money_conserved'):
+            self.assertEqual(pooled[key], single[key])
+        self.assertEqual([account['account_id'] for account in pooled['drifted']], [self.accounts[2].pk, self.accounts[6].pk])
+        self.assertEqual(pooled['total_difference'], Decimal('-1'))
+
+
+class LedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('ledger')
+        cls.account = Account.objects.create(user=cls.user, account_number='8500000000000001', balance=100, opening_balance=100)
+        cls.other = Account.objects.create(user=cls.user, account_number='8500000000000002', balance=100, opening_balance=100)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # A moment after each of: nothing, +10, -3, +1
+        self.moments = [timezone.now()]
+        for source, target, amount in ((self.other, self.account, '10'), (self.account, self.other, '3'), (self.other, self.account, '1')):
+            time.sleep(0.002)
+            execute_transfer(source, target, Decimal(amount))
+            self.moments.append(timezone.now())
+
+    def balance_as_of(self, moment):
+        return self.client.get(f'/api/accounts/{self.account.pk}/balance/', {'as_of': moment.isoformat()})
+
+    def journal(self, account):
+        return list(LedgerEntry.objects.filter(account=account).order_by('sequence').values_list('sequence', 'amount', 'balance_after'))
+
+    def test_transfers_are_journaled_with_running_balances(self):
+        self.assertEqual(self.journal(self.account), [(1, 10, 110), (2, -3, 107), (3, 1, 108)])
+        self.assertEqual(self.journal(self.other), [(1, -10, 90), (2, 3, 93), (3, -1, 92)])
+        self.assertEqual(Account.objects.get(pk=self.account.pk).ledger_sequence, 3)
+
+    @override_settings(BARK_LEDGER_CHECKPOINT_INTERVAL=2)
+    def test_checkpoint_every_interval_entries(self):
+        execute_transfer(self.account, self.other, Decimal('8'))
+        checkpoints = BalanceCheckpoint.objects.filter(account=self.account).order_by('sequence').values_list('sequence', 'balance')
+        self.assertEqual(list(checkpoints), [(4, 100)])
+
+    def test_balance_as_of(self):
+        for moment, expected in zip(self.moments, ['100.0000', '110.0000', '107.0000', '108.0000']):
+            response = self.balance_as_of(moment)
+            self.assertEqual(response.data['balance'], expected)
+        self.assertEqual(self.balance_as_of(self.account.created_at - timedelta(seconds=1)).status_code, 404)
+
+    def test_as_of_cost_does_not_grow_with_history(self):
+        def queries():
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.balance_as_of(timezone.now()).status_code, 200)
+            return len(captured)
+
+        short = queries()
+        for _ in range(20):
+            execute_transfer(self.other, self.account, Decimal('1'))
+        self.assertEqual(queries(), short)
+        self.assertEqual(self.balance_as_of(timezone.now()).data['balance'], '128.0000')
+
+    def test_as_of_before_the_backfill_anchor_is_rejected_until_rebuilt(self):
+        # As migration 0010 leaves an account: no journal, a sequence-0 checkpoint stamped when it ran
+        LedgerEntry.objects.all().delete()
+        BalanceCheckpoint.objects.create(account=self.account, sequence=0, balance=108, timestamp=self.moments[3])
+        response = self.balance_as_of(self.moments[1])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(self.moments[3].isoformat(), response.data['as_of'])
+        self.assertEqual(self.balance_as_of(self.moments[3]).data['balance'], '108.0000')
+
+        call_command('bark_rebuild_ledger', stdout=io.StringIO())
+        self.assertEqual(self.journal(self.account), [(1, 10, 110), (2, -3, 107), (3, 1, 108)])
+        self.assertFalse(BalanceCheckpoint.objects.filter(sequence=0).exists())
+        self.assertEqual(self.balance_as_of(self.moments[1]).data['balance'], '110.0000')
+
+    def test_rebuild_replays_the_same_journal(self):
+        with self.assertRaises(CommandError):
+            call_command('bark_rebuild_ledger')
+        before = self.journal(self.account), self.journal(self.other)
+        call_command('bark_rebuild_ledger', '--force', '--chunk-size', '2', stdout=io.StringIO())
+        self.assertEqual((self.journal(self.account), self.journal(self.other)), before)
+        self.assertEqual(Account.objects.get(pk=self.account.pk).ledger_sequence, 3)
+
+
+class ConditionalRequestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('conditional')
+        cls.account = Account.objects.create(user=cls.user, account_number='8600000000000001', balance=100, opening_balance=100)
+        cls.other = Account.objects.create(user=cls.user, account_number='8600000000000002', balance=100, opening_balance=100)
+        execute_transfer(cls.account, cls.other, Decimal('5'))
+        # Long settled, so Last-Modified is sent
+        cls.changed = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        Account.objects.update(updated_at=cls.changed)
+        Transfer.objects.update(timestamp=cls.changed)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.paths = [
+            f'/api/accounts/{self.account.pk}/',
+            f'/api/accounts/{self.account.pk}/balance/',
+            f'/api/accounts/{self.account.pk}/transfers/',
+        ]
+
+    def test_matching_validators_get_304_without_a_body(self):
+        for path in self.paths:
+            with self.subTest(path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                self.assertEqual(response['Last-Modified'], http_date(self.changed.timestamp()))
+
+                with self.assertNumQueries(1):
+                    response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+                self.assertEqual(response['ETag'], etag)
+
+                response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=http_date(self.changed.timestamp()))
+                self.assertEqual(response.status_code, 304)
+                response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=http_date(self.changed.timestamp() - 60))
+                self.assertEqual(response.status_code, 200)
+                # If-None-Match wins over If-Modified-Since
+                response = self.client.get(path, HTTP_IF_NONE_MATCH='"stale"', HTTP_IF_MODIFIED_SINCE=http_date(self.changed.timestamp()))
+                self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_after_a_transfer(self):
+        etags = [self.client.get(path)['ETag'] for path in self.paths]
+        self.assertEqual(len(set(etags)), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            execute_transfer(self.other, self.account, Decimal('1'))
+        for path, etag in zip(self.paths, etags):
+            with self.subTest(path):
+                response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                # Changed just now, so only the ETag can validate it
+                self.assertFalse(response.has_header('Last-Modified'))
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('keyset')
+        cls.account = Account.objects.create(user=cls.user, account_number='8700000000000001', balance=100, opening_balance=100)
+        other = Account.objects.create(user=cls.user, account_number='8700000000000002', balance=100, opening_balance=100)
+        now = timezone.now()
+        # Three runs of equal timestamps, so pages break inside ties
+        Transfer.objects.bulk_create(
+            Transfer(from_account=cls.account, to_account=other, amount=i + 1, timestamp=now - timedelta(minutes=i // 3))
+            for i in range(9)
+        )
+        cls.expected = list(Transfer.objects.order_by('-timestamp', '-id').values_list('pk', flat=True))
+        cls.path = f'/api/accounts/{cls.account.pk}/transfers/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, page_size):
+        ids = []
+        url = f'{self.path}?page_size={page_size}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), page_size)
+            ids.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_cursor_walk_visits_every_row_once_in_order(self):
+        for page_size in (1, 2, 4, 9, 10):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(page_size), self.expected)
+
+    def test_cursor_round_trips(self):
+        page = self.client.get(self.path, {'page_size': 4}).data
+        cursor = parse_qs(urlsplit(page['next']).query)['cursor'][0]
+        position = json.loads(base64.urlsafe_b64decode(cursor))
+        last = Transfer.objects.get(pk=page['results'][-1]['id'])
+        self.assertEqual(position, [last.timestamp.isoformat(), last.pk])
+        self.assertEqual(self.client.get(self.path, {'page_size': 4, 'cursor': cursor}).data['results'][0]['id'], self.expected[4])
+
+    def test_page_size_is_capped(self):
+        self.assertEqual(len(self.client.get(self.path).data['results']), 9)
+        with mock.patch.object(KeysetPagination, 'max_page_size', 3):
+            response = self.client.get(self.path, {'page_size': 1000})
+        self.assertEqual([row['id'] for row in response.data['results']], self.expected[:3])
+        self.assertIsNotNone(response.data['next'])
+        # Not a positive integer: the default page size
+        self.assertEqual(len(self.client.get(self.path, {'page_size': 'all'}).data['results']), 9)
+
+    def test_invalid_cursor_is_404(self):
+        def encode(position):
+            return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+        for cursor in ('not base64!', base64.urlsafe_b64encode(b'\xff').decode(), encode({'a': 1}), encode([1]),
+                       encode(['yesterday', 1]), encode([None, 1]), encode([timezone.now().isoformat(), 'x'])):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.path, {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data, {'detail': 'Invalid cursor'})
+
+
+class TransferExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('export')
+        cls.account = Account.objects.create(user=cls.user, account_number='8800000000000001', balance=100, opening_balance=100)
+        other = Account.objects.create(user=User.objects.create_user('export-other'), account_number='8800000000000002', balance=100, opening_balance=100)
+        for i in range(5):
+            execute_transfer(cls.account, other, Decimal('1.25') * (i + 1))
+        execute_transfer(other, cls.account, Decimal('0.5'))
+        cls.path = f'/api/accounts/{cls.account.pk}/transfers/export/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # The paginated history, oldest first, is what the export must match
+        history = self.client.get(f'/api/accounts/{self.account.pk}/transfers/').data['results']
+        self.expected = [{key: str(value) for key, value in row.items()} for row in reversed(history)]
+
+    def export(self, format):
+        # Small chunks, so the stream is more than one chunk
+        with mock.patch('bark_core.renderers.ROWS_PER_CHUNK', 2):
+            response = self.client.get(self.path, {'format': format})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            chunks = [chunk.decode('utf-8') for chunk in response.streaming_content]
+        self.assertIn(f'account-{self.account.pk}-transfers.{format}', response['Content-Disposition'])
+        return response, chunks
+
+    def test_csv_export(self):
+        response, chunks = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(len(chunks), 4)  # header and three chunks of two rows
+        rows = list(csv.DictReader(io.StringIO(''.join(chunks))))
+        self.assertEqual(rows, self.expected)
+
+    def test_ndjson_export(self):
+        response, chunks = self.export('ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+        self.assertEqual([{key: str(value) for key, value in row.items()} for row in rows], self.expected)
+
+    def test_other_users_account_is_not_found(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='export-other'))
+        self.assertEqual(client.get(self.path, {'format': 'csv'}).status_code, 404)
+
+
+class MonthlyStatementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('statements')
+        cls.account = Account.objects.create(user=cls.user, account_number='8900000000000001', balance=100, opening_balance=100)
+        cls.other = Account.objects.create(user=cls.user, account_number='8900000000000002', balance=100, opening_balance=100)
+        execute_transfer(cls.account, cls.other, Decimal('10'))
+        execute_transfer(cls.account, cls.other, Decimal('2.5'))
+        execute_transfer(cls.other, cls.account, Decimal('4'))
+        cls.path = f'/api/accounts/{cls.account.pk}/statements/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def statements(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_transfers_roll_up_as_they_post_and_match_a_rebuild(self):
+        month = timezone.localtime().strftime('%Y-%m')
+        current = {'month': month, 'sent_total': '12.5000', 'sent_count': 2, 'received_total': '4.0000', 'received_count': 1}
+        self.assertEqual(self.statements(), [current])
+
+        # History from before the rollups existed
+        last_year = timezone.now() - timedelta(days=400)
+        Transfer.objects.bulk_create([
+            Transfer(from_account=self.other, to_account=self.account, amount=7, timestamp=last_year),
+            Transfer(from_account=self.other, to_account=self.account, amount=1, timestamp=last_year),
+        ])
+        call_command('bark_rebuild_statements', '--chunk-size', '1', stdout=io.StringIO())
+        older = {'month': timezone.localtime(last_year).strftime('%Y-%m'), 'sent_total': '0.0000', 'sent_count': 0,
+                 'received_total': '8.0000', 'received_count': 2}
+        self.assertEqual(self.statements(), [current, older])
+
+    def test_only_monthly_period(self):
+        self.assertEqual(self.client.get(self.path, {'period': 'week'}).status_code, 400)
+
+
+class ImportAccountsTests(TestCase):
+    ROWS = [
+        ('9000000000000001', 'importer', '10'),
+        ('9000000000000002', 'importer', '20'),
+        ('9000000000000003', 'importer', '-5'),  # Rejected
+        ('9000000000000004', 'importer', '40'),
+        ('9000000000000005', 'nobody', '50'),  # Rejected
+        ('9000000000000006', 'importer', '60'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user('importer')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'accounts.csv')
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['account_number', 'username', 'opening_balance'])
+            writer.writerows(self.ROWS)
+
+    def run_import(self):
+        out = io.StringIO()
+        call_command('bark_import_accounts', self.path, '--chunk-size', '2', stdout=out)
+        return out.getvalue()
+
+    def rejects(self):
+        with open(f'{self.path}.rejects.ndjson') as f:
+            return [(reject['row'], reject['error']) for reject in map(json.loads, f)]
+
+    def test_rerun_after_crash_resumes_and_rejects_each_row_once(self):
+        from bark_core.management.commands.bark_import_accounts import Command
+        save_progress = Command.save_progress
+        saved = []
+
+        def crash_on_second_checkpoint(command, *args):
+            # The second chunk has committed and written its reject; its checkpoint never lands
+            if saved:
+                raise KeyboardInterrupt
+            saved.append(args)
+            save_progress(command, *args)
+
+        with mock.patch.object(Command, 'save_progress', crash_on_second_checkpoint), self.assertRaises(KeyboardInterrupt):
+            self.run_import()
+        self.assertEqual(Account.objects.count(), 3)
+        self.assertTrue(os.path.exists(f'{self.path}.checkpoint'))
+
+        output = self.run_import()
+        self.assertIn("Resuming after row 2.", output)
+        self.assertIn("Imported 3 accounts; 1 were already there and 2 were rejected.", output)
+        self.assertEqual(
+            sorted(Account.objects.values_list('account_number', 'opening_balance')),
+            [(number, Decimal(balance)) for number, username, balance in self.ROWS if username == 'importer' and balance != '-5'],
+        )
+        self.assertEqual([row for row, _ in self.rejects()], [3, 5])
+        self.assertFalse(os.path.exists(f'{self.path}.checkpoint'))
+
+        # Finished, so a rerun starts over and finds everything already there
+        self.assertIn("Imported 0 accounts; 4 were already there and 2 were rejected.", self.run_import())
+        self.assertEqual([row for row, _ in self.rejects()], [3, 5])
+
+
+class RequestTimingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('timing-staff', is_staff=True)
+        cls.customer = User.objects.create_user('timing-customer')
+        Account.objects.create(user=cls.customer, account_number='9100000000000001', balance=10)
+
+    def get(self, user):
+        # The middleware reads its settings when the client's handler loads it
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/accounts/')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_server_timing_is_shown_to_staff_only(self):
+        header = self.get(self.staff)['Server-Timing']
+        self.assertRegex(header, r'^db;dur=[\d.]+;desc="\d+ queries", view;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+        self.assertFalse(self.get(self.customer).has_header('Server-Timing'))
+        with override_settings(BARK_SERVER_TIMING_PUBLIC=True):
+            self.assertTrue(self.get(self.customer).has_header('Server-Timing'))
+        with override_settings(BARK_REQUEST_TIMING_SAMPLE_RATE=0):
+            self.assertFalse(self.get(self.staff).has_header('Server-Timing'))
+
+    def test_slow_requests_are_logged_whether_sampled_or_not(self):
+        for rate in (1, 0):
+            with self.subTest(sample_rate=rate), override_settings(BARK_SLOW_REQUEST_MS=0, BARK_REQUEST_TIMING_SAMPLE_RATE=rate):
+                with self.assertLogs('bark_core.middleware', 'WARNING') as logs:
+                    self.get(self.customer)
+                line = json.loads(logs.records[0].getMessage())
+                self.assertEqual((line['event'], line['path'], line['user_id'], line['sampled']),
+                                 ('slow_request', '/api/accounts/', self.customer.pk, bool(rate)))
+                self.assertGreater(line['queries'], 0)
+                self.assertEqual(bool(line['slowest_sql']), bool(rate))
+
+
+class AccountResolutionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('resolve')
+        cls.first = Account.objects.create(user=user, account_number='9200000000000001', balance=10)
+        cls.second = Account.objects.create(user=user, account_number='9200000000000002', balance=10)
+
+    def setUp(self):
+        patcher = mock.patch('bark_core.models.account_number_cache', AccountNumberCache(100))
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def resolve(self, *numbers):
+        return {number: account.pk for number, account in Account.objects.resolve_numbers(numbers).items()}
+
+    def test_both_sides_resolve_in_one_query(self):
+        expected = {self.first.account_number: self.first.pk, self.second.account_number: self.second.pk}
+        for cached in (False, True):
+            with self.subTest(cached=cached), self.assertNumQueries(1):
+                self.assertEqual(self.resolve(self.first.account_number, self.second.account_number, '9299999999999999'), expected)
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_renumbered_account_is_not_found_by_its_old_number(self):
+        self.resolve(self.first.account_number)
+        self.first.account_number = '9200000000000009'
+        self.first.save()
+        self.assertEqual(self.resolve('9200000000000001'), {})
+        self.assertEqual(self.resolve('9200000000000009'), {'9200000000000009': self.first.pk})
+
+        # The old number, taken by another account, is found behind the stale hint
+        self.resolve('9200000000000002')
+        self.second.account_number = '9200000000000001'
+        self.second.save()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.resolve('9200000000000002', '9200000000000001'), {'9200000000000001': self.second.pk})
+
+    def test_transfer_serializer_rejects_unknown_numbers(self):
+        client = APIClient()
+        client.force_authenticate(self.first.user)
+        response = client.post('/api/transfers/', {
+            'from_account_number': self.first.account_number, 'to_account_number': '9299999999999999', 'amount': '1',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("One or both of the account numbers are invalid.", str(response.data))
+
+
+class ThrottleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('throttled')
+        Account.objects.create(user=cls.user, account_number='9300000000000001', balance=10)
+        cls.token = Token.objects.create(user=cls.user).key
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'throttle.sqlite3')
+
+    def test_window_is_shared_by_stores_on_the_same_file(self):
+        # As two worker processes would each open it
+        first, second = SlidingWindowStore(self.path), SlidingWindowStore(self.path)
+        self.assertEqual(first.hit('user_1', 4, 10, 5.0), (True, None))
+        self.assertEqual(second.hit('user_1', 4, 10, 5.5), (True, None))
+        self.assertEqual(first.hit('user_1', 4, 10, 6.0), (True, None))
+        self.assertEqual(second.hit('user_1', 4, 10, 6.5), (True, None))
+        allowed, wait = first.hit('user_1', 4, 10, 7.5)
+        self.assertFalse(allowed)
+        # The full window has to become the previous one and start to decay
+        self.assertAlmostEqual(wait, 2.5)
+        self.assertTrue(second.hit('user_2', 4, 10, 7.5)[0])
+
+        # A fifth into the next window the previous one still counts for 3.2 of its 4
+        self.assertTrue(second.hit('user_1', 4, 10, 12.0)[0])
+        allowed, wait = first.hit('user_1', 4, 10, 12.0)
+        self.assertFalse(allowed)
+        # Until a quarter in, when it counts for 3
+        self.assertAlmostEqual(wait, 0.5)
+        self.assertTrue(first.hit('user_1', 4, 10, 12.6)[0])
+
+    def test_zero_limit_denies_without_a_wait(self):
+        store = SlidingWindowStore(self.path)
+        self.assertEqual(store.hit('user_1', 0, 60, 30.0), (False, None))
+
+    def get(self, asynchronous):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        if asynchronous:
+            with override_settings(ROOT_URLCONF='bark_api.urls_async'):
+                return async_to_sync(self.async_client.get)('/api/accounts/', headers=headers)
+        return self.client.get('/api/accounts/', headers=headers)
+
+    def test_throttled_requests_get_retry_after(self):
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous), \
+                    override_settings(BARK_THROTTLE_DB=f'{self.path}.{asynchronous}'), \
+                    mock.patch.object(SharedUserRateThrottle, 'rate', '2/minute', create=True):
+                self.assertEqual([self.get(asynchronous).status_code for _ in range(2)], [200, 200])
+                response = self.get(asynchronous)
+                self.assertEqual(response.status_code, 429)
+                self.assertTrue(0 < int(response['Retry-After']) <= 60)
+
+    def test_zero_rate_is_throttled_without_retry_after(self):
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous), override_settings(BARK_THROTTLE_DB=self.path), \
+                    mock.patch.object(SharedUserRateThrottle, 'rate', '0/minute', create=True):
+                response = self.get(asynchronous)
+                self.assertEqual(response.status_code, 429)
+                self.assertFalse(response.has_header('Retry-After'))
@@ -0,0 +1,144 @@
+# bark_core/throttling.py
+"""
+Rate throttles backed by a SQLite file shared by every worker process on a node.
+
+DRF's SimpleRateThrottle keeps a list of request timestamps per client in the
+(per-process) cache and rewrites the whole list on every request. Here each
+client is one row holding a sliding-window counter: the request count for the
+current fixed window and the previous one. The estimate weights the previous
+window by how much of it still overlaps the sliding window, so every request
+is an O(1) read and update of a single row.
+"""
+import math
+import sqlite3
+import threading
+
+from django.conf import settings
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+
+# Purge expired rows once every this many hits per process
+PURGE_EVERY = 10000
+
+
+class SlidingWindowStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._hits = 0
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS throttle ('
+                ' key TEXT PRIMARY KEY,'
+                ' window INTEGER NOT NULL,'
+                ' current INTEGER NOT NULL,'
+                ' previous INTEGER NOT NULL,'
+                ' expires REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS throttle_expires ON throttle (expires)')
+
+    def _connect(self):
+        """One connection per thread, reused across requests."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Throttle counters aren't worth an fsync per request
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, limit, duration, now):
+        """
+        Count a request for key if it is within limit requests per duration
+        seconds. Returns (allowed, seconds to wait when not allowed). A limit
+        of 0 denies every request, with no wait to suggest.
+        """
+        if limit <= 0:
+            return False, None
+        window = int(now // duration)
+        elapsed = (now % duration) / duration
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT window, current, previous FROM throttle WHERE key = ?', (key,)).fetchone()
+            current, previous = 0, 0
+            if row is not None:
+                if row[0] == window:
+                    current, previous = row[1], row[2]
+                elif row[0] == window - 1:
+                    previous = row[1]
+
+            allowed = previous * (1 - elapsed) + current < limit
+            if allowed:
+                conn.execute(
+                    'INSERT INTO throttle (key, window, current, previous, expires) VALUES (?, ?, ?, ?, ?)'
+                    ' ON CONFLICT(key) DO UPDATE SET window = excluded.window, current = excluded.current,'
+                    ' previous = excluded.previous, expires = excluded.expires',
+                    (key, window, current + 1, previous, (window + 2) * duration),
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self._maybe_purge(now)
+        if allowed:
+            return True, None
+        return False, self._wait(limit, duration, elapsed, current, previous)
+
+    def _wait(self, limit, duration, elapsed, current, previous):
+        """Seconds until the sliding estimate drops below limit again."""
+        if current < limit and previous:
+            # The previous window decays out first
+            needed = 1 - (limit - current) / previous
+            return max(needed - elapsed, 0) * duration
+        # Wait for this window to become the previous one, then decay enough
+        needed = 1 - limit / current
+        return (1 - elapsed + needed) * duration
+
+    def _maybe_purge(self, now):
+        with self._lock:
+            self._hits += 1
+            if self._hits % PURGE_EVERY:
+                return
+        self._connect().execute('DELETE FROM throttle WHERE expires < ?', (now,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    """Return the store for the configured BARK_THROTTLE_DB path."""
+    path = settings.BARK_THROTTLE_DB
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SlidingWindowStore(path)
+        return _stores[path]
+
+
+class SlidingWindowThrottleMixin:
+    """Swap SimpleRateThrottle's cached timestamp history for the shared store."""
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        allowed, self._wait = get_store().hit(self.key, self.num_requests, self.duration, self.timer())
+        return allowed
+
+    def wait(self):
+        return math.ceil(self._wait) if self._wait is not None else None
+
+
+class SharedAnonRateThrottle(SlidingWindowThrottleMixin, AnonRateThrottle):
+    pass
+
+
+class SharedUserRateThrottle(SlidingWindowThrottleMixin, UserRateThrottle):
+    pass
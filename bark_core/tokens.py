@@ -1,5 +1,164 @@
-from rest_framework.authentication import TokenAuthentication
+import secrets
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
 
 
 class BearerTokenAuthentication(TokenAuthentication):
-    keyword = "Bearer"
\ No newline at end of file
+    keyword = "Bearer"
+
+
+SIGNED_TOKEN_SALT = 'bark_core.tokens.signed'
+
+
+class TokenUser:
+    """
+    A user rebuilt from a verified signed token without touching the
+    database. Anything beyond id, username and is_staff loads the real User.
+    """
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, username, is_staff, token_id, expires_at):
+        self.id = user_id
+        self.username = username
+        self.is_staff = is_staff
+        self.token_id = token_id
+        self.expires_at = expires_at
+
+    @property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def _user(self):
+        return User.objects.get(pk=self.id)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._user, name)
+
+    def __eq__(self, other):
+        return isinstance(other, (TokenUser, User)) and other.pk == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return self.username
+
+
+def issue_signed_token(user):
+    """Return (token, expires_at) for a short-lived HMAC-signed token."""
+    ttl = getattr(settings, 'BARK_SIGNED_TOKEN_TTL', 900)
+    expires_at = int(time.time()) + ttl
+    payload = {
+        'uid': user.pk,
+        'usr': user.username,
+        'stf': user.is_staff,
+        'jti': secrets.token_urlsafe(12),
+        'exp': expires_at,
+    }
+    return signing.dumps(payload, salt=SIGNED_TOKEN_SALT), expires_at
+
+
+class RevocationList:
+    """
+    In-memory set of revoked token ids.
+
+    Revoked ids are pulled from the database at most once every
+    BARK_SIGNED_TOKEN_REVOCATION_REFRESH seconds. Every pull reads all ids
+    whose token hasn't expired yet rather than only rows with a higher id,
+    because ids can commit out of order and a row committed behind one
+    already read would be missed for good. Ids are forgotten once their
+    token has expired anyway, so the set stays bounded by the token TTL.
+    """
+
+    def __init__(self):
+        self._revoked = {}  # token id -> expiry (epoch seconds)
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, token_id):
+        if self.needs_refresh():
+            self.refresh()
+        return token_id in self._revoked
+
+    def needs_refresh(self):
+        refresh = getattr(settings, 'BARK_SIGNED_TOKEN_REVOCATION_REFRESH', 5)
+        return time.monotonic() - self._refreshed_at >= refresh
+
+    def refresh(self):
+        from .models import RevokedToken
+
+        with self._lock:
+            now = time.time()
+            rows = RevokedToken.objects.filter(
+                expires_at__gt=datetime.fromtimestamp(now, tz=dt_timezone.utc)
+            ).values_list('jti', 'expires_at')
+            # Kept: ids this process revoked itself, whose rows may not be visible yet
+            revoked = {jti: expiry for jti, expiry in self._revoked.items() if expiry > now}
+            revoked.update((jti, expires_at.timestamp()) for jti, expires_at in rows)
+            self._revoked = revoked
+            self._refreshed_at = time.monotonic()
+
+    def add(self, token_id, expires_at):
+        with self._lock:
+            self._revoked[token_id] = expires_at
+
+
+revocation_list = RevocationList()
+
+
+def revoke_signed_token(token_user):
+    """Revoke the token a TokenUser was authenticated with."""
+    from .models import RevokedToken
+
+    expires_at = datetime.fromtimestamp(token_user.expires_at, tz=dt_timezone.utc)
+    RevokedToken.objects.get_or_create(jti=token_user.token_id, defaults={'expires_at': expires_at})
+    # Expired ids no longer need to be remembered
+    RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    revocation_list.add(token_user.token_id, token_user.expires_at)
+
+
+class SignedTokenAuthentication(BearerTokenAuthentication):
+    """
+    Authenticate "Bearer <signed token>" headers in memory: verify the HMAC,
+    check the expiry and the revocation list, and build a TokenUser. Plain
+    database tokens are passed on to the next authentication class.
+    """
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode() or len(auth) != 2:
+            return None
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            return None
+        # Database tokens are 40 hex characters; signed tokens contain ':'
+        if ':' not in token:
+            return None
+        return self.authenticate_signed(token)
+
+    def authenticate_signed(self, token):
+        try:
+            payload = signing.loads(token, salt=SIGNED_TOKEN_SALT)
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        if payload['exp'] <= time.time():
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        if revocation_list.is_revoked(payload['jti']):
+            raise exceptions.AuthenticationFailed('Token has been revoked.')
+        user = TokenUser(payload['uid'], payload['usr'], payload['stf'], payload['jti'], payload['exp'])
+        return (user, token)
@@ -1,7 +1,7 @@
 # bark_core/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, AccountViewSet, TransferViewSet
+from .views import UserViewSet, AccountViewSet, TransferViewSet, MetricsView
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -9,5 +9,6 @@ router.register(r'accounts', AccountViewSet)
 router.register(r'transfers', TransferViewSet)
 
 urlpatterns = [
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
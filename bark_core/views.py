@@ -1,37 +1,117 @@
 # bark_core/views.py
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.views import APIView
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.response import Response
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError as DRFValidationError
 from django.db import transaction
 from django.core.exceptions import ValidationError
-from decimal import Decimal
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.db.models import Q
 from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from decimal import Decimal, InvalidOperation
 import logging
 
-from .models import Account, Transfer
-from .serializers import UserSerializer, AccountSerializer, TransferSerializer, BalanceSerializer, TransferHistorySerializer
+from .models import Account, Transfer, MonthlyStatement, QueuedTransfer
+from .serializers import UserSerializer, AccountSerializer, TransferSerializer, BalanceSerializer, TransferHistorySerializer, TransferBatchSerializer, MonthlyStatementSerializer, QueuedTransferSerializer
+from .engine import execute_batch, BatchTransferError
+from .ledger import HistoryUnavailable, balance_as_of
+from .statements import add_striped_totals
+from .cache import balance_cache, account_number_cache, CachedBalance
+from .renderers import CSVRenderer, NDJSONRenderer
+from .tokens import TokenUser, issue_signed_token, revoke_signed_token
+from .db_routers import ReplicaReadMixin, reading_from_primary, routing_stats, current_read_alias
+from .conditional import make_etag, account_etag, changed_at, last_modified, not_modified, set_validators
+from . import fast_serializers, idempotency
 
 logger = logging.getLogger(__name__)
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = User.objects.all()
+# Rows fetched per round trip when streaming exports
+EXPORT_CHUNK_SIZE = 2000
+
+
+def parse_datetime_param(value, param):
+    """Parse an ISO 8601 datetime query parameter, treating naive values as server time."""
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise DRFValidationError({param: "Expected an ISO 8601 datetime."})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def history_filters(query_params):
+    """
+    Parse the transfer history filters: from <= timestamp < to,
+    min_amount <= amount <= max_amount and a counterparty account id.
+    Returns (filter kwargs, counterparty id or None).
+    """
+    filters = {}
+    if 'from' in query_params:
+        filters['timestamp__gte'] = parse_datetime_param(query_params['from'], 'from')
+    if 'to' in query_params:
+        filters['timestamp__lt'] = parse_datetime_param(query_params['to'], 'to')
+    for param, lookup in (('min_amount', 'amount__gte'), ('max_amount', 'amount__lte')):
+        if param in query_params:
+            try:
+                filters[lookup] = Decimal(query_params[param])
+            except InvalidOperation:
+                filters[lookup] = None
+            if filters[lookup] is None or not filters[lookup].is_finite():
+                raise DRFValidationError({param: "Expected a decimal amount."})
+    counterparty_id = None
+    if 'counterparty' in query_params:
+        try:
+            counterparty_id = int(query_params['counterparty'])
+        except ValueError:
+            raise DRFValidationError({'counterparty': "Expected an account id."})
+    return filters, counterparty_id
+
+
+def fast_list_response(view, queryset, fast):
+    """A view's (paginated) list response for queryset, serialized by a FastSerializer."""
+    rows = fast.values(queryset)
+    page = view.paginate_queryset(rows)
+    if page is None:
+        return Response(fast.represent(rows))
+    return view.get_paginated_response(fast.represent(page))
+
+class UserViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    # auth_user has no index on date_joined, so page on the primary key
+    queryset = User.objects.order_by('-id')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    replica_actions = ('list', 'retrieve')
 
+    def list(self, request, *args, **kwargs):
+        if not fast_serializers.enabled():
+            return super().list(request, *args, **kwargs)
+        return fast_list_response(self, self.filter_queryset(self.get_queryset()), fast_serializers.users)
 
-class AccountViewSet(viewsets.ModelViewSet):
+
+class AccountViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
     permission_classes = [permissions.IsAuthenticated]
+    replica_actions = ('list', 'retrieve', 'balance', 'transfers', 'statements', 'export_transfers')
+    # Actions that answer If-None-Match / If-Modified-Since with a 304
+    conditional_actions = ('retrieve', 'balance', 'transfers')
 
     def get_queryset(self):
-        queryset = self.queryset.select_related('user').all()
+        queryset = self.queryset.select_related('user').with_striped_balance().order_by('-created_at', '-id')
+        if self.action in self.conditional_actions:
+            queryset = queryset.with_last_transfer()
         if self.request.user.is_staff:
             return queryset
-        return queryset.filter(user=self.request.user)
+        return queryset.filter(user_id=self.request.user.pk)
 
     @transaction.atomic
     def create(self, request, *args, **kwargs):
@@ -46,8 +126,24 @@ class AccountViewSet(viewsets.ModelViewSet):
         except IntegrityError:
             return Response({"detail": "An account with this number already exists."}, status=status.HTTP_400_BAD_REQUEST)
 
+    def list(self, request, *args, **kwargs):
+        if not fast_serializers.enabled():
+            return super().list(request, *args, **kwargs)
+        return fast_list_response(self, self.filter_queryset(self.get_queryset()), fast_serializers.accounts)
+
+    def retrieve(self, request, *args, **kwargs):
+        account = self.get_object()
+        user = account.user
+        # auth_user has no modification time, so only the ETag sees profile edits
+        etag = account_etag(request, account, user.username, user.email, user.first_name, user.last_name)
+        modified = last_modified(changed_at(account))
+        response = not_modified(request, etag, modified)
+        if response is not None:
+            return response
+        return set_validators(Response(self.get_serializer(account).data), etag, modified)
+
     def perform_create(self, serializer):
-        if not self.request.user.is_staff and serializer.validated_data['user'] != self.request.user:
+        if not self.request.user.is_staff and serializer.validated_data['user'].pk != self.request.user.pk:
             raise PermissionDenied("You don't have permission to create an account for another user.")
         try:
             account = serializer.save()
@@ -59,51 +155,165 @@ class AccountViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def balance(self, request, pk=None):
+        as_of = request.query_params.get('as_of')
+        if as_of is None:
+            current = self.get_current_balance(pk)
+            etag = make_etag(request, current.balance)
+            modified = last_modified(current.changed_at)
+            response = not_modified(request, etag, modified)
+            if response is not None:
+                return response
+            return set_validators(Response(BalanceSerializer({'balance': current.balance}).data), etag, modified)
+
         account = self.get_object()
-        serializer = BalanceSerializer({'balance': account.balance})
+        as_of = parse_datetime_param(as_of, 'as_of')
+        try:
+            balance = balance_as_of(account, as_of)
+        except HistoryUnavailable as e:
+            raise DRFValidationError({'as_of': str(e)})
+        if balance is None:
+            return Response({"detail": "The account did not exist at that time."}, status=status.HTTP_404_NOT_FOUND)
+        serializer = BalanceSerializer({'balance': balance, 'as_of': as_of})
         return Response(serializer.data)
 
+    def get_current_balance(self, pk):
+        """
+        Return the account's CachedBalance from the cache when the caller may
+        see the account and its ledger_sequence and owner on the primary
+        still match, otherwise load it through get_object() and populate the
+        cache.
+        """
+        try:
+            account_id = int(pk)
+        except (TypeError, ValueError):
+            account_id = None
+        if account_id is not None:
+            cached = balance_cache.get(account_id)
+            if (cached and (self.request.user.is_staff or cached.user_id == self.request.user.pk)
+                    and Account.objects.balance_unchanged(account_id, cached.ledger_sequence, cached.user_id)):
+                return cached
+
+        token = balance_cache.token()
+        account = self.get_object()
+        current = CachedBalance(account.user_id, account.current_balance, changed_at(account), account.ledger_sequence)
+        # Hits are checked on the primary, so only the primary fills the cache
+        if reading_from_primary() and not account.stripe_count:
+            balance_cache.set(account.pk, current, token)
+        return current
+
     @action(detail=True, methods=['get'])
     def transfers(self, request, pk=None):
         account = self.get_object()
-        transfers = Transfer.objects.filter(Q(from_account=account) | Q(to_account=account))
-        transfers = transfers.order_by('-timestamp')
-        serializer = TransferHistorySerializer(transfers, many=True)
-        return Response(serializer.data)
+        filters, counterparty_id = history_filters(request.query_params)
+        etag = account_etag(request, account)
+        modified = last_modified(changed_at(account))
+        response = not_modified(request, etag, modified)
+        if response is not None:
+            return response
+        transfers = Transfer.objects.history(account.pk, counterparty_id).filter(**filters)
+        if fast_serializers.enabled():
+            return set_validators(fast_list_response(self, transfers, fast_serializers.transfer_history), etag, modified)
+        page = self.paginate_queryset(transfers)
+        serializer = TransferHistorySerializer(page, many=True)
+        return set_validators(self.get_paginated_response(serializer.data), etag, modified)
+
+    @action(detail=True, methods=['get'])
+    def statements(self, request, pk=None):
+        """Sent and received totals and counts per month (?period=month), newest first."""
+        account = self.get_object()
+        period = request.query_params.get('period', 'month')
+        if period != 'month':
+            raise DRFValidationError({"period": "Only monthly statements (period=month) are available."})
+        statements = MonthlyStatement.objects.filter(account=account).order_by('-month', '-id')
+        page = add_striped_totals(account, self.paginate_queryset(statements))
+        serializer = MonthlyStatementSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path='transfers/export', renderer_classes=[CSVRenderer, NDJSONRenderer])
+    def export_transfers(self, request, pk=None):
+        """
+        Stream an account's full transfer history, oldest first, as CSV or
+        NDJSON (?format=csv|ndjson). Takes the same filters as the paginated
+        history.
+        """
+        account = self.get_object()
+        filters, counterparty_id = history_filters(request.query_params)
+        transfers = Transfer.objects.for_account(account.pk, counterparty_id).filter(**filters).order_by('timestamp', 'id')
+        # Rows are read while the response streams, after this request's routing has ended
+        transfers = transfers.using(current_read_alias())
+
+        # Same representation as the paginated history, without building serializers per row
+        fields = TransferHistorySerializer().fields
+        format_amount = fields['amount'].to_representation
+        format_timestamp = fields['timestamp'].to_representation
+        rows = (
+            [transfer_id, from_account_id, to_account_id, format_amount(amount), format_timestamp(timestamp)]
+            for transfer_id, from_account_id, to_account_id, amount, timestamp in transfers.values_list(
+                'id', 'from_account_id', 'to_account_id', 'amount', 'timestamp'
+            ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+
+        renderer = request.accepted_renderer
+        columns = ['id', 'from_account', 'to_account', 'amount', 'timestamp']
+        response = StreamingHttpResponse(
+            renderer.render_stream(columns, rows),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
+        )
+        response['Content-Disposition'] = f'attachment; filename="account-{account.pk}-transfers.{renderer.format}"'
+        return response
 
     def get_object(self):
         obj = super().get_object()
-        if not self.request.user.is_staff and obj.user != self.request.user:
+        if not self.request.user.is_staff and obj.user_id != self.request.user.pk:
             raise PermissionDenied("You don't have permission to access this account.")
         return obj
 
 
-class TransferViewSet(viewsets.ModelViewSet):
+class TransferViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Transfer.objects.all()
     serializer_class = TransferSerializer
     permission_classes = [permissions.IsAuthenticated]
+    replica_actions = ('list', 'retrieve', 'queued')
 
-    @transaction.atomic
     def create(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return self.create_transfer(request)
+
+        claim, response = idempotency.claim(
+            request.user, key, idempotency.request_fingerprint(request.data), self.recover_idempotent_response
+        )
+        if response is not None:
+            return response
+        try:
+            response = self.create_transfer(request, claim)
+        except Exception:
+            idempotency.release(claim)
+            raise
+        idempotency.finish(claim, response)
+        return response
+
+    def recover_idempotent_response(self, claim):
+        """Response for a claim whose transfer committed but whose response was never stored."""
+        return Response(self.get_serializer(claim.transfer).data, status=status.HTTP_201_CREATED)
+
+    def create_transfer(self, request, idempotency_key=None):
+        # No outer transaction here: the transfer engine owns its transaction
+        # so it can retry serialization failures from the start.
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         from_account = serializer.validated_data['from_account']
-        to_account = serializer.validated_data['to_account']
-        amount = Decimal(serializer.validated_data['amount'])
 
-        if not self.request.user.is_staff and from_account.user != self.request.user:
+        if not self.request.user.is_staff and from_account.user_id != self.request.user.pk:
             raise PermissionDenied("You don't have permission to transfer from this account.")
 
-        try:
-            # Deduct the amount from the source account
-            from_account.withdraw(amount)
-
-            # Add the amount to the destination account
-            to_account.deposit(amount)
+        if self.queue_requested(request):
+            return self.queue_transfer(serializer.validated_data)
 
-            # Save the transfer record
-            transfer = serializer.save()
+        try:
+            # Debit, credit and record the transfer atomically
+            transfer = serializer.save(idempotency_key=idempotency_key)
 
             logger.info(f"Transfer created: {transfer.id}")
         except ValidationError as e:
@@ -116,9 +326,110 @@ class TransferViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def queue_requested(self, request):
+        """Queue the transfer when the client sends "Prefer: respond-async" or queueing is the default."""
+        return getattr(settings, 'BARK_QUEUED_TRANSFERS', False) or 'respond-async' in request.headers.get('Prefer', '')
+
+    def queue_transfer(self, validated_data):
+        if validated_data['amount'] <= 0:
+            return Response({"detail": "Transfer amount must be positive"}, status=status.HTTP_400_BAD_REQUEST)
+        queued = QueuedTransfer.objects.create(
+            user_id=self.request.user.pk,
+            from_account=validated_data['from_account'],
+            to_account=validated_data['to_account'],
+            amount=validated_data['amount'],
+        )
+        logger.info(f"Transfer queued: {queued.id}")
+        data = QueuedTransferSerializer(queued, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers={'Location': data['status_url']})
+
+    @action(detail=False, methods=['get'], url_path=r'queued/(?P<queued_id>[0-9]+)', url_name='queued')
+    def queued(self, request, queued_id=None):
+        """Status of a queued transfer; once posted it links to the Transfer."""
+        queued = QueuedTransfer.objects.filter(pk=queued_id)
+        if not request.user.is_staff:
+            queued = queued.filter(user_id=request.user.pk)
+        queued = queued.first()
+        if queued is None:
+            return Response({"detail": "No queued transfer matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(QueuedTransferSerializer(queued, context=self.get_serializer_context()).data)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            results = execute_batch(
+                serializer.validated_data['transfers'],
+                user=request.user,
+                atomic=serializer.validated_data['atomic'],
+            )
+        except BatchTransferError as e:
+            logger.error(f"Batch transfer rejected: {str(e.message)}")
+            return Response({"detail": e.message, "results": e.results}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Batch transfer error: {str(e)}")
+            return Response({"detail": "An error occurred during the batch transfer."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        created = sum(1 for result in results if result['status'] == 'created')
+        logger.info(f"Batch transfer posted: {created}/{len(results)} transfers")
+        # 207 tells per-item callers that some transfers were rejected
+        response_status = status.HTTP_201_CREATED if created == len(results) else status.HTTP_207_MULTI_STATUS
+        return Response({"results": results}, status=response_status)
+
+    def get_serializer_class(self):
+        if self.action == 'batch':
+            return TransferBatchSerializer
+        return super().get_serializer_class()
+
     def get_queryset(self):
-        queryset = self.queryset.select_related('from_account', 'to_account')
+        queryset = self.queryset.select_related('from_account', 'to_account').order_by('-timestamp', '-id')
         if self.request.user.is_staff:
             return queryset
-        user_accounts = Account.objects.filter(user=self.request.user)
+        user_accounts = Account.objects.filter(user_id=self.request.user.pk)
         return queryset.filter(Q(from_account__in=user_accounts) | Q(to_account__in=user_accounts))
+
+
+class ObtainSignedTokenView(ObtainAuthToken):
+    """Exchange a username and password for a short-lived signed bearer token."""
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token, expires_at = issue_signed_token(serializer.validated_data['user'])
+        return Response({'token': token, 'expires_at': expires_at})
+
+
+class RevokeSignedTokenView(APIView):
+    """Revoke the signed bearer token used to make this request."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if not isinstance(request.user, TokenUser):
+            return Response({"detail": "Only signed tokens can be revoked."}, status=status.HTTP_400_BAD_REQUEST)
+        revoke_signed_token(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def transfer_queue_stats():
+    """Depth of the queued-transfer backlog and the age of its oldest entry."""
+    pending = QueuedTransfer.objects.filter(status=QueuedTransfer.PENDING)
+    oldest = pending.order_by('pk').values_list('created_at', flat=True).first()
+    return {
+        'depth': pending.count(),
+        'lag_seconds': round((timezone.now() - oldest).total_seconds(), 3) if oldest else 0,
+    }
+
+
+class MetricsView(APIView):
+    """Operational counters for staff."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'balance_cache': balance_cache.stats(),
+            'account_number_cache': account_number_cache.stats(),
+            'transfer_queue': transfer_queue_stats(),
+            'db_routing': routing_stats.stats(),
+        })